@@ -1,28 +1,47 @@
 import sys
 import asyncio
 import qasync # Import qasync
-import re # Import regex module
+import time
+from contextlib import aclosing
 from PySide6.QtWidgets import (QApplication, QMainWindow, QMenuBar, QStatusBar,
                                QSplitter, QTextEdit, QWidget, QVBoxLayout, QHBoxLayout,
                                QTabWidget, QScrollArea, QLineEdit, QPushButton, QMessageBox,
                                QPlainTextEdit, QToolBar, QDialog, QLineEdit, QLabel, QComboBox, # Add QLabel, QComboBox
-                               QCheckBox, QPlainTextEdit) # Ensure QPlainTextEdit is imported, Add QCheckBox
+                               QCheckBox, QPlainTextEdit, QSpinBox) # Ensure QPlainTextEdit is imported, Add QCheckBox
 from PySide6.QtCore import Qt, Slot, QTimer # Add QTimer
 from PySide6.QtGui import QTextCursor, QAction, QActionGroup, QFont # Add QFont
 from typing import Dict, Optional, List # Add Optional and List here
 
 # Correctly import custom widgets and other modules
 from src.ui.widgets import CollapsibleSection, TagWidget
-from src.ui.dialogs import ClientConfigDialog, GenerationParamsDialog
+from src.ui.dialogs import ClientConfigDialog, GenerationParamsDialog, OutputArchiveDialog
+from src.ui.output_sink import BufferedOutputSink
+from src.ui.settings_notifier import SettingsNotifier
 from src.core.llm_client import LLMClient
 from src.core.kobold_client import KoboldClient, KoboldClientError
 from src.core.openai_compatible_client import OpenAICompatibleClient
-from src.core.prompt_builder import build_prompt
-from src.core.dynamic_prompts import evaluate_dynamic_prompt # Import dynamic prompt evaluator
+from src.core.load_balancer_client import LoadBalancingClient
+from src.core.prompt_builder import build_prompt, PrefixReuseTracker, IncrementalPromptBuilder
+from src.core.dynamic_prompts import evaluate_dynamic_prompt, set_dynamic_prompt_seed # Import dynamic prompt evaluator
 from src.core.settings import load_settings, DEFAULT_SETTINGS # Import DEFAULT_SETTINGS
+from src.core.output_archive import OutputArchive, OutputArchiveError
+from src.core.prefetch_queue import PrefetchQueue, PrefetchQueueError
+from src.core.generation_scheduler import GenerationScheduler, PRIORITY_USER, PRIORITY_BACKGROUND
+from src.core.generation_metrics import (GenerationMetrics, SessionMetrics, track_generation, STOP_REASON_STOP,
+                                         STOP_REASON_SECTION, STOP_REASON_DUPLICATE, STOP_REASON_REPETITION)
+from src.core.similarity_filter import NearDuplicateFilter, DuplicateStreamCheck
 from src.ui.menu_handler import MenuHandler # Import the new MenuHandler
 # Import IdeaProcessor and constants
-from src.core.idea_processor import IdeaProcessor, IDEA_ITEM_ORDER, IDEA_ITEM_ORDER_JA, METADATA_MAP
+from src.core.idea_processor import IdeaProcessor, IdeaSectionWatcher, IDEA_ITEM_ORDER, IDEA_ITEM_ORDER_JA, METADATA_MAP
+from src.core.idea_schema import IdeaRecord, format_idea_section, parse_idea_output
+from src.core.idea_pool import IdeaCandidatePool
+from src.core.idea_chain import IdeaChain, IdeaChainError
+
+# Scheduler job groups
+JOB_GROUP_SINGLE = "single"
+JOB_GROUP_INFINITE = "infinite"
+# Appended to a block whose stream the client cut because it fell into a loop
+REPETITION_MARKER = "\n--- (繰り返しを検出したため生成を打ち切りました) ---\n"
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -36,14 +55,33 @@ class MainWindow(QMainWindow):
             self.llm_client: LLMClient = KoboldClient()
         elif client_type == "openai_compatible":
             self.llm_client: LLMClient = OpenAICompatibleClient()
+        elif client_type == "load_balancer":
+            self.llm_client: LLMClient = LoadBalancingClient()
         else:
             raise ValueError(f"不明なクライアントタイプ: {settings.get('client_type')}")
-        # Generation status: "idle", "single_running", "infinite_running"
-        self.generation_status = "idle"
-        self.generation_task = None # Holds the asyncio task for generation
+        # Generation jobs (single generation, infinite cycles, prefetch) run through the scheduler;
+        # user-triggered single generations preempt background jobs when all slots are busy
+        self.scheduler = GenerationScheduler(self._get_max_concurrency(settings))
+        self.infinite_task: Optional[asyncio.Task] = None # Supervises infinite generation while it is on
         self.output_block_counter = 1
+        # Output blocks in the output area, oldest first:
+        # {"start": QTextCursor, "cursor": QTextCursor | None, "open": bool, "separator_length": int}
+        self.output_blocks: List[Dict] = []
+        self.output_archive = OutputArchive() # Older blocks moved out of the output area
         self.current_mode = "generate" # Initial mode: "generate" or "idea"
         self.infinite_generation_prompt = "" # Store prompt for infinite loop
+        self.backend_max_context: Optional[int] = None # Context size reported by the backend
+        self.prefix_reuse_tracker = PrefixReuseTracker() # Reports KV cache prefix reuse between prompts
+        self.incremental_prompt_builder = IncrementalPromptBuilder() # Reuses unchanged prompt parts in infinite generation
+        self.session_metrics = SessionMetrics() # Rolling timing summary of this session's requests
+        self.active_metrics: Dict[GenerationMetrics, float] = {} # Running requests -> sink render time at start
+        self.last_metrics: Optional[GenerationMetrics] = None
+        self.prefetch_queue: Optional[PrefetchQueue] = None # Candidates generated ahead in manual infinite mode
+        self.prefetch_needs_rebuild = False # Set when the prompt inputs are edited during prefetching
+        self.duplicate_filter: Optional[NearDuplicateFilter] = None # Recent blocks of the infinite generation session
+        # IDEA sections that were generated but not shown; saved with the project, answered before generating
+        self.idea_pool = IdeaCandidatePool(settings.get("idea_candidate_pool_size", DEFAULT_SETTINGS["idea_candidate_pool_size"]))
+        asyncio.ensure_future(self._refresh_backend_context_length())
         self.idea_item_key_map = {name_ja: key for key, name_ja in METADATA_MAP.items() if key in IDEA_ITEM_ORDER} # Map JA name to key
 
         # Instantiate MenuHandler
@@ -53,6 +91,8 @@ class MainWindow(QMainWindow):
         self.idea_controls_widget = None
         self.idea_item_combo = None
         self.idea_fast_mode_check = None
+        self.idea_chain_check = None
+        self.idea_chain_count_spinbox = None
         self.infinite_warning_shown = False # Flag for infinite gen warning
 
         # Create UI elements
@@ -60,12 +100,49 @@ class MainWindow(QMainWindow):
         self._create_status_bar()
         self._create_central_widget() # Create central widget before menu bar needs it
         self._create_menu_bar() # Create menu bar using the handler
+        self._connect_prompt_invalidation()
+
+        # React to saved or externally edited settings (clients follow the store themselves)
+        self.settings_notifier = SettingsNotifier(parent=self)
+        self.settings_notifier.settings_changed.connect(self._on_settings_changed)
 
         # Apply initial theme and font from settings via MenuHandler
         # These might be called within MenuHandler's creation logic already
         # self.menu_handler._apply_initial_font() # Ensure initial font is applied
         # self.menu_handler._apply_theme(load_settings().get("theme", "light")) # Ensure initial theme
 
+    @property
+    def generation_status(self) -> str:
+        """
+        "infinite_running", "single_running" or "idle". Derived from the scheduler; a single
+        generation may run while infinite generation is on (it is reported as infinite).
+        """
+        if self.infinite_task is not None:
+            return "infinite_running"
+        if self.scheduler.has_jobs(JOB_GROUP_SINGLE):
+            return "single_running"
+        return "idle"
+
+    @staticmethod
+    def _get_max_concurrency(settings: Dict, idea_chains: int = 1) -> int:
+        """
+        Generation jobs allowed at once; 0 in settings = enough for parallel streams,
+        prefetch and the concurrent idea chains (idea_chains).
+        """
+        max_concurrency = int(settings.get("generation_max_concurrency", DEFAULT_SETTINGS["generation_max_concurrency"]))
+        if max_concurrency > 0:
+            return max_concurrency
+        parallel_streams = int(settings.get("infinite_parallel_streams", DEFAULT_SETTINGS["infinite_parallel_streams"]))
+        prefetch_depth = int(settings.get("infinite_prefetch_depth", DEFAULT_SETTINGS["infinite_prefetch_depth"]))
+        return max(1, parallel_streams, 1 + prefetch_depth, idea_chains)
+
+    def _update_max_concurrency(self, settings: Optional[Dict] = None):
+        """Applies the concurrency limit for the current settings and idea chain count."""
+        idea_chains = 1
+        if self.idea_chain_check and self.idea_chain_check.isChecked():
+            idea_chains = self.idea_chain_count_spinbox.value()
+        self.scheduler.set_max_concurrency(self._get_max_concurrency(settings or load_settings(), idea_chains))
+
     def _create_menu_bar(self):
         """Creates the menu bar using MenuHandler."""
         self.setMenuBar(self.menu_handler.create_menu_bar())
@@ -96,6 +173,12 @@ class MainWindow(QMainWindow):
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("準備完了") # Changed to Japanese
+        # Live TTFT / tokens/s of running requests; the session summary is shown as tooltip
+        self.metrics_label = QLabel("")
+        self.status_bar.addPermanentWidget(self.metrics_label)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.setInterval(500)
+        self.metrics_timer.timeout.connect(self._update_metrics_label)
 
     def _create_central_widget(self):
         central_splitter = QSplitter(Qt.Horizontal)
@@ -125,16 +208,22 @@ class MainWindow(QMainWindow):
         self.output_text_edit.setReadOnly(True)
         self.output_text_edit.setPlaceholderText("LLMからの出力がここに表示されます...")
         output_layout.addWidget(self.output_text_edit)
+        # Streamed tokens are batched and rendered at a fixed rate
+        refresh_rate = load_settings().get("output_refresh_rate", DEFAULT_SETTINGS["output_refresh_rate"])
+        self.output_sink = BufferedOutputSink(self.output_text_edit, refresh_rate, parent=self)
         output_button_layout = QHBoxLayout()
         output_clear_button = QPushButton("[ 出力物クリア ]")
         output_to_main_button = QPushButton("[ 選択部分を本文へ転記 ]")
         output_to_memo_button = QPushButton("[ 選択部分をメモへ転記 ]")
+        output_archive_button = QPushButton("[ 過去の出力 ]")
         output_clear_button.clicked.connect(self._clear_output_edit)
         output_to_main_button.clicked.connect(self._transfer_output_to_main)
         output_to_memo_button.clicked.connect(self._transfer_output_to_memo)
+        output_archive_button.clicked.connect(self._open_output_archive_dialog)
         output_button_layout.addWidget(output_clear_button)
         output_button_layout.addWidget(output_to_main_button)
         output_button_layout.addWidget(output_to_memo_button)
+        output_button_layout.addWidget(output_archive_button)
         output_button_layout.addStretch()
         output_layout.addLayout(output_button_layout)
         left_splitter.addWidget(output_container)
@@ -183,6 +272,23 @@ class MainWindow(QMainWindow):
         self.idea_fast_mode_check = QCheckBox("高速な手法（実験的）")
         idea_controls_layout.addWidget(self.idea_fast_mode_check)
 
+        idea_chain_layout = QHBoxLayout()
+        self.idea_chain_check = QCheckBox("空欄の項目を連鎖生成")
+        self.idea_chain_check.setToolTip("タイトルから順に、それまでに生成した項目を踏まえて空欄の項目を1つずつ生成します。\n"
+                                         "入力済みの項目はそのまま使います。")
+        idea_chain_count_label = QLabel("同時:")
+        self.idea_chain_count_spinbox = QSpinBox()
+        self.idea_chain_count_spinbox.setRange(1, 16)
+        self.idea_chain_count_spinbox.setValue(1)
+        self.idea_chain_count_spinbox.setToolTip("同時に生成するアイデアの数\n"
+                                                 "生成の同時実行数が 0 (自動) の場合は、この数まで並列に生成します。\n"
+                                                 "同時実行数を指定している場合は、その数を超えた分は順番待ちになります。")
+        idea_chain_layout.addWidget(self.idea_chain_check)
+        idea_chain_layout.addStretch()
+        idea_chain_layout.addWidget(idea_chain_count_label)
+        idea_chain_layout.addWidget(self.idea_chain_count_spinbox)
+        idea_controls_layout.addLayout(idea_chain_layout)
+
         # Add a separator or some visual distinction if desired
         # separator = QFrame()
         # separator.setFrameShape(QFrame.HLine)
@@ -193,6 +299,9 @@ class MainWindow(QMainWindow):
         self.idea_controls_widget.hide() # Hide initially
         # Connect signal after creation
         self.idea_item_combo.currentIndexChanged.connect(self._update_idea_fast_mode_state)
+        self.idea_chain_check.toggled.connect(self._update_idea_fast_mode_state)
+        self.idea_chain_check.toggled.connect(lambda _checked: self._update_max_concurrency())
+        self.idea_chain_count_spinbox.valueChanged.connect(lambda _value: self._update_max_concurrency())
         # --- End IDEA Task Controls ---
 
 
@@ -306,6 +415,33 @@ class MainWindow(QMainWindow):
 
         details_layout.addStretch()
 
+    def _connect_prompt_invalidation(self):
+        """Marks cached prompt parts as changed when the corresponding widgets are edited."""
+        builder = self.incremental_prompt_builder
+        self.main_text_edit.textChanged.connect(lambda: builder.invalidate(builder.MAIN_TEXT))
+        invalidate_ui_data = lambda *args: builder.invalidate(builder.UI_DATA)
+        self.title_edit.textChanged.connect(invalidate_ui_data)
+        self.keywords_widget.tagsChanged.connect(invalidate_ui_data)
+        self.genre_widget.tagsChanged.connect(invalidate_ui_data)
+        self.synopsis_edit.textChanged.connect(invalidate_ui_data)
+        self.setting_edit.textChanged.connect(invalidate_ui_data)
+        self.plot_edit.textChanged.connect(invalidate_ui_data)
+        self.authors_note_edit.textChanged.connect(invalidate_ui_data)
+        self.dialogue_level_combo.currentIndexChanged.connect(invalidate_ui_data)
+        self.rating_combo_details.currentIndexChanged.connect(invalidate_ui_data)
+        # Edits also drop candidates generated ahead in manual infinite mode
+        for signal in (self.main_text_edit.textChanged, self.title_edit.textChanged, self.keywords_widget.tagsChanged,
+                       self.genre_widget.tagsChanged, self.synopsis_edit.textChanged, self.setting_edit.textChanged,
+                       self.plot_edit.textChanged, self.authors_note_edit.textChanged,
+                       self.dialogue_level_combo.currentIndexChanged, self.rating_combo_details.currentIndexChanged):
+            signal.connect(self._invalidate_prefetch)
+
+    def _invalidate_prefetch(self, *args):
+        """Drops prefetched candidates; the prompt is rebuilt before the next block."""
+        if self.prefetch_queue is not None:
+            self.prefetch_queue.invalidate()
+            self.prefetch_needs_rebuild = True
+
     def _create_memo_tab(self):
         self.memo_tab_widget = QWidget()
         memo_layout = QVBoxLayout(self.memo_tab_widget)
@@ -323,16 +459,24 @@ class MainWindow(QMainWindow):
         dialog = ClientConfigDialog(self)
         if dialog.exec() == QDialog.Accepted:
             client_type = load_settings()["client_type"]
+            old_client = self.llm_client
             if client_type == "kobold":
-                from src.core.kobold_client import KoboldClient
-                self.llm_client = KoboldClient()
+                if not isinstance(old_client, KoboldClient):
+                    self.llm_client = KoboldClient()
             elif client_type == "openai_compatible":
-                from src.core.openai_compatible_client import OpenAICompatibleClient
-                self.llm_client = OpenAICompatibleClient()
+                if not isinstance(old_client, OpenAICompatibleClient):
+                    self.llm_client = OpenAICompatibleClient()
+            elif client_type == "load_balancer":
+                if not isinstance(old_client, LoadBalancingClient):
+                    self.llm_client = LoadBalancingClient()
             else:
                 raise ValueError(f"不明なクライアントタイプ: {client_type}")
+            if self.llm_client is not old_client:
+                # Release the old client; the shared HTTP pool (and its warm connections) stays open
+                asyncio.ensure_future(old_client.close())
             self.status_bar.showMessage("クライアント設定が更新されました。", 3000)
             self.llm_client.reload_settings()
+            asyncio.ensure_future(self._refresh_backend_context_length())
         else:
             self.status_bar.showMessage("クライアント設定の変更はキャンセルされました。", 3000)
 
@@ -340,35 +484,135 @@ class MainWindow(QMainWindow):
         dialog = GenerationParamsDialog(self)
         if dialog.exec() == QDialog.Accepted:
             self.status_bar.showMessage("生成パラメータが更新されました。", 3000)
-            self.llm_client.reload_settings()
+            # The LLM client and output area pick up the new values via the settings store
         else:
             self.status_bar.showMessage("生成パラメータの変更はキャンセルされました。", 3000)
 
+    @Slot(dict, object)
+    def _on_settings_changed(self, settings: Dict, changed_keys: set):
+        """Applies changed settings that the UI caches."""
+        if "output_refresh_rate" in changed_keys:
+            self.output_sink.set_refresh_rate(settings.get("output_refresh_rate", DEFAULT_SETTINGS["output_refresh_rate"]))
+        if "output_max_blocks" in changed_keys:
+            self._spill_old_output_blocks()
+        if changed_keys & {"base_url", "backends", "max_context_length"}:
+            asyncio.ensure_future(self._refresh_backend_context_length())
+        if changed_keys & {"generation_max_concurrency", "infinite_parallel_streams", "infinite_prefetch_depth"}:
+            self._update_max_concurrency(settings)
+        if "idea_candidate_pool_size" in changed_keys:
+            self.idea_pool.set_max_per_item(settings.get("idea_candidate_pool_size", DEFAULT_SETTINGS["idea_candidate_pool_size"]))
+
+    async def _refresh_backend_context_length(self):
+        """Queries the backend's context size used for the continuation prompt budget."""
+        try:
+            self.backend_max_context = await self.llm_client.get_max_context_length()
+            print(f"Backend max context length: {self.backend_max_context}")
+        except Exception as e:
+            print(f"Could not get backend context length: {e}")
+            self.backend_max_context = None
+
+    def _get_context_budget(self, settings: Dict) -> Optional[int]:
+        """
+        Returns the token budget for a generate-mode prompt: the model context
+        (from settings, or as reported by the backend) minus max_length_generate.
+        Returns None (no trimming) if the context size is unknown.
+        """
+        max_context = settings.get("max_context_length", DEFAULT_SETTINGS["max_context_length"]) or self.backend_max_context
+        if not max_context:
+            return None
+        max_length = settings.get("max_length_generate", DEFAULT_SETTINGS["max_length_generate"])
+        return max(0, max_context - max_length)
+
+    def _report_prefix_reuse(self, prompt: str, settings: Dict):
+        """In cache-stable mode, logs and shows how much of the prompt matches the previous one."""
+        chars_per_token = float(settings.get("context_chars_per_token", DEFAULT_SETTINGS["context_chars_per_token"]))
+        reuse = self.prefix_reuse_tracker.record(prompt, chars_per_token)
+        message = (f"プレフィックス一致: {reuse['matched_chars']}/{reuse['total_chars']} 文字 "
+                   f"(約{reuse['matched_tokens']}/{reuse['total_tokens']} トークン, {reuse['ratio']:.0%})")
+        if settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"]):
+            print(message)
+            self.status_bar.showMessage(message, 3000)
+
+    # --- Generation Metrics ---
+    def _begin_metrics(self, label: str, prompt: str, prompt_build_s: float, max_length: Optional[int]) -> GenerationMetrics:
+        """Starts timing a request and shows its live TTFT / tokens/s in the status bar."""
+        chars_per_token = float(load_settings().get("context_chars_per_token", DEFAULT_SETTINGS["context_chars_per_token"]))
+        metrics = GenerationMetrics(label, prompt, prompt_build_s, max_length, chars_per_token)
+        self.active_metrics[metrics] = self.output_sink.render_time
+        if not self.metrics_timer.isActive():
+            self.metrics_timer.start()
+        return metrics
+
+    def _end_metrics(self, metrics: Optional[GenerationMetrics], stop_reason: Optional[str] = None,
+                     cancelled: bool = False, error: Optional[str] = None):
+        """Finishes a request's metrics and adds them to the session summary."""
+        if metrics is None or metrics not in self.active_metrics:
+            return
+        # Rendering time while the request ran (shared with parallel streams)
+        metrics.ui_ms = (self.output_sink.render_time - self.active_metrics.pop(metrics)) * 1000
+        metrics.finish(stop_reason, cancelled=cancelled, error=error)
+        self.session_metrics.add(metrics)
+        self.last_metrics = metrics
+        print(metrics.format_log())
+        if not self.active_metrics:
+            self.metrics_timer.stop()
+        self._update_metrics_label()
+
+    @Slot()
+    def _update_metrics_label(self):
+        """Shows TTFT and tokens/s of the running requests, or of the last one when idle."""
+        def format_ttft(value: Optional[float]) -> str:
+            return f"{value:.0f}ms" if value is not None else "-"
+        if self.active_metrics:
+            running = list(self.active_metrics)
+            rates = [metrics.tokens_per_s for metrics in running if metrics.tokens_per_s]
+            ttfts = [metrics.ttft_ms for metrics in running if metrics.ttft_ms is not None]
+            text = f"TTFT {format_ttft(ttfts[-1] if ttfts else None)} | {sum(rates):.1f} tok/s"
+            if len(running) > 1:
+                text = f"{len(running)} ストリーム | {text}"
+        elif self.last_metrics is not None:
+            rate = self.last_metrics.tokens_per_s
+            text = (f"前回: TTFT {format_ttft(self.last_metrics.ttft_ms)} | "
+                    f"{f'{rate:.1f}' if rate else '-'} tok/s | {self.last_metrics.stop_reason}")
+        else:
+            text = ""
+        self.metrics_label.setText(text)
+        self.metrics_label.setToolTip(self.session_metrics.format_summary())
+
     # --- Generation Control Slots ---
     @Slot()
     def _trigger_single_generation(self):
-        """Starts a single generation task, or stops it if already running."""
-        if self.generation_status == "single_running":
+        """
+        Starts a single generation job, or stops it if already running.
+        During infinite generation, the single generation runs with user priority and
+        preempts an infinite generation stream if no slot is free.
+        """
+        if self.scheduler.has_jobs(JOB_GROUP_SINGLE):
             # If single generation is running, stop it.
-            self._stop_current_generation()
-            return
-        elif self.generation_status == "infinite_running":
-            # If infinite generation is running, show warning and do nothing.
-            QMessageBox.warning(self, "生成中", "現在、無限生成が実行中です。停止してから単発生成を開始してください。")
+            self._stop_single_generation()
             return
-        elif self.generation_status != "idle":
-             # Handle unexpected status (should ideally not happen)
-             QMessageBox.warning(self, "不明な状態", f"予期せぬ生成ステータスです: {self.generation_status}")
-             return
 
-        # Only proceed if status is idle
+        if self.infinite_task is None:
+            self._apply_dynamic_prompt_seed() # Don't reseed in the middle of an infinite session
         # --- IDEA Mode Logic ---
         if self.current_mode == "idea":
             selected_item_index = self.idea_item_combo.currentIndex()
             selected_item_key = self.idea_item_combo.itemData(selected_item_index) # Get internal key ('all', 'title', etc.)
             fast_mode_enabled = self.idea_fast_mode_check.isChecked()
-            ui_inputs = self._get_metadata_from_ui()["metadata"] # Get only metadata part
+            # Pass the full ui_data including rating and authors_note to build_prompt
+            full_ui_data = self._get_metadata_from_ui()
+            ui_inputs = full_ui_data["metadata"] # Get only metadata part
+
+            # Chain mode fills all empty items step by step, ignoring the item selection
+            if self.idea_chain_check.isChecked():
+                self._start_idea_chains(full_ui_data)
+                return
 
+            # A section left over from an earlier output that fits the current inputs is shown at once
+            if selected_item_key != "all" and self._show_pooled_idea_candidate(selected_item_key, full_ui_data):
+                return
+
+            build_started = time.perf_counter()
             processor = IdeaProcessor(ui_inputs)
             stop_sequence = processor.determine_stop_sequence(selected_item_key)
             prompt_suffix = ""
@@ -384,8 +628,6 @@ class MainWindow(QMainWindow):
                 prompt_suffix = processor.generate_prompt_suffix(selected_item_key)
 
             # Get base prompt (unchanged logic for IDEA mode in build_prompt)
-            # Pass the full ui_data including rating and authors_note to build_prompt
-            full_ui_data = self._get_metadata_from_ui()
             base_prompt = build_prompt(
                 current_mode="idea",
                 main_text="", # main_text is not used for IDEA mode
@@ -394,38 +636,36 @@ class MainWindow(QMainWindow):
             )
 
             final_prompt = base_prompt + prompt_suffix
+            prompt_build_s = time.perf_counter() - build_started
 
             # --- Execute Generation based on mode ---
-            self.generation_status = "single_running" # Use single_running status for IDEA task
-            self._update_ui_for_generation_start() # Update UI (e.g., status bar)
-
             # Use unified separator format including counter
             separator = f"\n--- アイデア生成 ({self.idea_item_combo.currentText()}) ({self.output_block_counter}) ---\n"
-            self._append_to_output(separator)
+            # Anchored, so that blocks of a running infinite generation can't mix into it
+            block_cursor = self._open_output_block(separator)
 
             # IDEA "all" item or fast mode should stream
             if selected_item_key == "all" or fast_mode_enabled:
-                 self.generation_task = asyncio.ensure_future(
-                    self._run_single_generation(final_prompt, stop_sequence=stop_sequence)
+                self._submit_single_job(
+                    lambda: self._run_single_generation(final_prompt, block_cursor, stop_sequence=stop_sequence,
+                                                       prompt_build_s=prompt_build_s,
+                                                       idea_ui_data=full_ui_data if selected_item_key == "all" else None),
+                    "アイデア生成 (高速)"
                 )
-            # else: # Safe Mode (specific item, not fast)
-            #     # Safe Mode: Get full output, then filter
-            #     self.generation_task = asyncio.ensure_future(
-            #         self._run_safe_idea_generation(final_prompt, stop_sequence=stop_sequence, selected_item_key=selected_item_key)
-            #     )
             # Simplified: If not 'all' and not 'fast', it must be 'safe'
             else: # Safe Mode (specific item, not fast)
-                self.generation_task = asyncio.ensure_future(
-                    self._run_safe_idea_generation(final_prompt, stop_sequence=stop_sequence, selected_item_key=selected_item_key)
+                self._submit_single_job(
+                    lambda: self._run_safe_idea_generation(final_prompt, block_cursor, stop_sequence=stop_sequence,
+                                                           selected_item_key=selected_item_key, prompt_build_s=prompt_build_s,
+                                                           ui_data=full_ui_data),
+                    "アイデア生成 (安全)"
                 )
 
 
         # --- Generate Mode Logic (Existing) ---
         else: # self.current_mode == "generate"
-            self.generation_status = "single_running"
-            self._update_ui_for_generation_start()
-
             # Get raw main text and evaluate dynamic prompts
+            build_started = time.perf_counter()
             raw_main_text = self.main_text_edit.toPlainText()
             main_text = evaluate_dynamic_prompt(raw_main_text)
 
@@ -440,24 +680,92 @@ class MainWindow(QMainWindow):
                 current_mode=self.current_mode,
                 main_text=main_text,
                 ui_data=ui_data, # Pass the whole ui_data dictionary
-                cont_prompt_order=cont_order
+                cont_prompt_order=cont_order,
+                context_budget=self._get_context_budget(settings),
+                cache_stable=settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"])
             )
+            prompt_build_s = time.perf_counter() - build_started
+            self._report_prefix_reuse(prompt, settings)
 
             separator = f"\n--- 生成ブロック {self.output_block_counter} ---\n"
-            self._append_to_output(separator)
+            block_cursor = self._open_output_block(separator)
 
             # Pass None for stop_sequence to use settings default in generate mode
-            self.generation_task = asyncio.ensure_future(self._run_single_generation(prompt, stop_sequence=None))
+            self._submit_single_job(
+                lambda: self._run_single_generation(prompt, block_cursor, stop_sequence=None, prompt_build_s=prompt_build_s),
+                "単発生成"
+            )
+
+    def _show_pooled_idea_candidate(self, item_key: str, ui_data: Dict) -> bool:
+        """
+        Shows a pooled candidate for item_key that fits the current inputs in a new output block.
+        Returns False if the pool has none (the request is then generated as usual).
+        """
+        candidate = self.idea_pool.take(item_key, ui_data)
+        if candidate is None:
+            return False
+        separator = f"\n--- アイデア生成 ({self.idea_item_combo.currentText()}) ({self.output_block_counter}) [候補プール] ---\n"
+        self.output_block_counter += 1
+        block_cursor = self._open_output_block(separator)
+        self._append_to_block(block_cursor, format_idea_section(item_key, candidate.content))
+        self._close_output_block(block_cursor)
+        remaining = self.idea_pool.count(item_key, ui_data)
+        self.status_bar.showMessage(f"候補プールから表示しました (同じ条件の残り: {remaining} 件)", 3000)
+        return True
+
+    def _harvest_idea_candidates(self, record: IdeaRecord, ui_data: Optional[Dict], shown_item_key: str,
+                                 finished: bool = False):
+        """
+        Adds the sections of an IDEA output to the candidate pool.
+
+        Args:
+            record: The parsed output.
+            ui_data: The UI data the prompt was built from (nothing is added if None).
+            shown_item_key: The requested item; it was shown, so it is not kept ('all' keeps every section).
+            finished: True if the output ended by itself. Otherwise the last section may be cut off and is dropped.
+        """
+        if ui_data is None or not self.idea_pool.enabled or not record.contents:
+            return
+        exclude = [] if shown_item_key == "all" else [shown_item_key]
+        if not finished:
+            exclude.append(list(record.contents)[-1])
+        added = self.idea_pool.harvest(record, ui_data, exclude=exclude)
+        if added:
+            print(f"Added {added} section(s) to the idea candidate pool ({len(self.idea_pool)} pooled).")
+
+    def _start_idea_chains(self, ui_data: Dict):
+        """Opens one output block per idea chain and queues the chains as single jobs (they run concurrently)."""
+        count = self.idea_chain_count_spinbox.value()
+        chains = [IdeaChain(ui_data) for _ in range(count)] # Each chain rolls its own dynamic prompts
+        if not chains[0].items:
+            self.status_bar.showMessage("空欄の項目がありません", 3000)
+            return
+        for chain in chains:
+            separator = f"\n--- アイデア連鎖生成 ({self.output_block_counter}) ---\n"
+            block_cursor = self._open_output_block(separator)
+            self._submit_single_job(
+                lambda chain=chain, block_cursor=block_cursor: self._run_idea_chain(chain, block_cursor),
+                "アイデア連鎖生成"
+            )
+
+    def _submit_single_job(self, run, label: str):
+        """Queues a single generation with user priority and updates the UI."""
+        self.output_block_counter += 1 # The block is already open; number the next one
+        self.scheduler.submit(run, PRIORITY_USER, group=JOB_GROUP_SINGLE, label=label)
+        if self.infinite_task is not None:
+            self.status_bar.showMessage("単発生成中 (無限生成より優先)...")
+        else:
+            self._update_ui_for_generation_start()
 
     @Slot()
     def _toggle_infinite_generation(self):
         """Starts/stops infinite generation, or stops single generation if running."""
         if self.generation_status == "infinite_running":
             # If infinite is running, stop it.
-            self._stop_current_generation()
+            self._stop_infinite_generation()
         elif self.generation_status == "single_running":
             # If single is running, stop it.
-            self._stop_current_generation()
+            self._stop_single_generation()
             # Ensure the infinite gen button remains unchecked as we just stopped single gen
             self.infinite_gen_action.setChecked(False)
         elif self.generation_status == "idle":
@@ -467,11 +775,15 @@ class MainWindow(QMainWindow):
              QMessageBox.warning(self, "不明な状態", f"予期せぬ生成ステータスです: {self.generation_status}")
              self.infinite_gen_action.setChecked(False) # Ensure button is unchecked
 
+    def _apply_dynamic_prompt_seed(self):
+        """Reseeds Dynamic Prompts if a fixed seed is set, so each run rolls the same choices."""
+        seed = load_settings().get("dynamic_prompt_seed", DEFAULT_SETTINGS["dynamic_prompt_seed"])
+        set_dynamic_prompt_seed(seed if seed >= 0 else None)
+
     def _start_infinite_generation(self):
         """Starts the infinite generation loop."""
-        self.generation_status = "infinite_running"
         self.infinite_warning_shown = False # Reset warning flag for new session
-        self._update_ui_for_generation_start()
+        self._apply_dynamic_prompt_seed()
 
         # Initial prompt build (might be overwritten in loop if immediate update is on)
         # Get raw main text and evaluate dynamic prompts for the initial prompt
@@ -490,33 +802,45 @@ class MainWindow(QMainWindow):
             current_mode=self.current_mode,
             main_text=main_text,
             ui_data=ui_data, # Pass the whole ui_data dictionary
-            cont_prompt_order=cont_order
+            cont_prompt_order=cont_order,
+            context_budget=self._get_context_budget(settings),
+            cache_stable=settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"])
             # rating_override is no longer needed here, handled inside build_prompt
         )
 
-        self.generation_task = asyncio.ensure_future(self._run_infinite_generation_loop())
+        # Near-duplicate suppression compares blocks within this session only
+        dedup_threshold = settings.get("infinite_dedup_threshold", DEFAULT_SETTINGS["infinite_dedup_threshold"])
+        self.duplicate_filter = NearDuplicateFilter(dedup_threshold) if dedup_threshold > 0 else None
+
+        self.infinite_task = asyncio.ensure_future(self._run_infinite_generation_loop())
+        self._update_ui_for_generation_start()
 
     def _stop_current_generation(self):
-        """Stops any currently running generation task."""
-        if self.generation_status == "idle" or self.generation_task is None:
+        """Stops infinite generation and any single generation."""
+        if self.infinite_task is not None:
+            self._stop_infinite_generation()
+        if self.scheduler.has_jobs(JOB_GROUP_SINGLE):
+            self._stop_single_generation()
+
+    def _stop_infinite_generation(self):
+        """Stops the infinite generation loop and cancels its queued and running jobs."""
+        if self.infinite_task is None:
             return
+        self.status_bar.showMessage("無限生成 停止中...", 2000)
+        task, self.infinite_task = self.infinite_task, None # generation_status is idle from here on
+        if not task.done():
+            task.cancel()
+        self.scheduler.cancel_group(JOB_GROUP_INFINITE)
+        self._update_ui_for_generation_stop()
+        self.status_bar.showMessage("停止中", 3000)
 
-        current_status_before_stop = self.generation_status
-        self.generation_status = "idle" # Set status to idle first
-
-        if current_status_before_stop == "infinite_running":
-            self.status_bar.showMessage("無限生成 停止中...", 2000)
-        else: # single_running
-            self.status_bar.showMessage("単発生成 停止中...", 2000)
-
-        if self.generation_task and not self.generation_task.done():
-            self.generation_task.cancel()
-            # Set task to None immediately after cancellation request
-            self.generation_task = None
-
+    def _stop_single_generation(self):
+        """Cancels the running (or queued) single generation."""
+        if not self.scheduler.has_jobs(JOB_GROUP_SINGLE):
+            return
+        self.status_bar.showMessage("単発生成 停止中...", 2000)
+        self.scheduler.cancel_group(JOB_GROUP_SINGLE)
         self._update_ui_for_generation_stop()
-        # Add a slight delay before final status message if needed
-        # QTimer.singleShot(100, lambda: self.status_bar.showMessage("停止中", 3000))
         self.status_bar.showMessage("停止中", 3000)
 
 
@@ -537,7 +861,7 @@ class MainWindow(QMainWindow):
 
     def _update_ui_for_generation_stop(self):
         """Updates UI elements when generation stops or completes."""
-        self.infinite_gen_action.setChecked(False) # Ensure infinite toggle is unchecked
+        self.infinite_gen_action.setChecked(self.infinite_task is not None) # Unchecked unless infinite generation goes on
         # Keep actions enabled
         # self.single_gen_action.setEnabled(True)
         # self.infinite_gen_action.setEnabled(True)
@@ -545,12 +869,18 @@ class MainWindow(QMainWindow):
 
 
     # --- Async Generation Methods ---
-    async def _run_single_generation(self, prompt: str, stop_sequence: Optional[List[str]] = None):
+    async def _run_single_generation(self, prompt: str, block_cursor: QTextCursor, stop_sequence: Optional[List[str]] = None,
+                                     prompt_build_s: float = 0.0, idea_ui_data: Optional[Dict] = None):
         """
         Runs a single generation (for Generate mode or IDEA Fast mode) and updates status.
-        Streams output directly to the UI.
+        Streams output into the output block of block_cursor. Runs as a scheduler job.
+
+        Args:
+            idea_ui_data: For IDEA "全部" generations, the UI data of the prompt; the sections
+                of the output are then added to the candidate pool.
         """
         task_name = "アイデア生成 (高速)" if self.current_mode == "idea" else "単発生成"
+        metrics = None
         try:
             # Get mode-specific max_length
             settings = load_settings()
@@ -559,97 +889,191 @@ class MainWindow(QMainWindow):
             else: # generate mode
                 current_max_length = settings.get("max_length_generate", DEFAULT_SETTINGS["max_length_generate"])
 
+            # A previous stop may still be aborting on the server
+            await self.llm_client.wait_until_ready()
+
             # Pass max_length and stop_sequence to generate_stream
-            async for token in self.llm_client.generate_stream(
-                prompt,
-                max_length=current_max_length,
-                stop_sequence=stop_sequence # Pass the determined stop sequence
-            ):
-                self._append_to_output(token)
-                await asyncio.sleep(0.001) # Yield control briefly
+            metrics = self._begin_metrics(task_name, prompt, prompt_build_s, current_max_length)
+            chunks = []
+            with track_generation(metrics): # Lets the client record connect time and finish reason
+                # Closed right away on cancellation, so the client aborts the request on the server
+                async with aclosing(self.llm_client.generate_stream(
+                    prompt,
+                    max_length=current_max_length,
+                    stop_sequence=stop_sequence # Pass the determined stop sequence
+                )) as stream:
+                    async for token in stream:
+                        metrics.mark_token(token)
+                        self.output_sink.append(token, block_cursor) # Rendered in batches by the sink
+                        if idea_ui_data is not None:
+                            chunks.append(token)
+            if metrics.backend_stop_reason == STOP_REASON_REPETITION:
+                self.output_sink.append(REPETITION_MARKER, block_cursor)
 
             # Finished successfully
-            self.output_block_counter += 1
+            self.output_sink.flush()
+            self._end_metrics(metrics)
+            if idea_ui_data is not None:
+                self._harvest_idea_candidates(parse_idea_output("".join(chunks)), idea_ui_data, "all",
+                                              finished=metrics.stop_reason == STOP_REASON_STOP)
             self.status_bar.showMessage(f"{task_name} 完了", 3000)
 
         except KoboldClientError as e:
+            self._end_metrics(metrics, error=str(e))
             error_msg = f"\n--- {task_name} エラー: {e} ---\n"
-            self._append_to_output(error_msg)
+            self._append_to_block(block_cursor, error_msg)
             self.status_bar.showMessage(f"{task_name} エラー", 3000)
         except asyncio.CancelledError:
             print(f"{task_name} task cancelled.")
-            self._append_to_output(f"\n--- {task_name}がキャンセルされました ---\n")
+            self._end_metrics(metrics, cancelled=True)
+            self._append_to_block(block_cursor, f"\n--- {task_name}がキャンセルされました ---\n")
             self.status_bar.showMessage(f"{task_name} キャンセル", 3000)
         except Exception as e:
+             self._end_metrics(metrics, error=str(e))
              error_msg = f"\n--- {task_name}中に予期せぬエラーが発生しました: {e} ---\n"
              print(error_msg)
-             self._append_to_output(error_msg)
+             self._append_to_block(block_cursor, error_msg)
              self.status_bar.showMessage("予期せぬエラー", 3000)
         finally:
-            # Reset status after single run finishes or errors out
-            self.generation_status = "idle"
+            # The job ends here; the scheduler drops it from the "single" group
+            self._close_output_block(block_cursor)
             self._update_ui_for_generation_stop()
-            self.generation_task = None
 
-    async def _run_safe_idea_generation(self, prompt: str, stop_sequence: Optional[List[str]], selected_item_key: str):
+    async def _run_idea_chain(self, chain: IdeaChain, block_cursor: QTextCursor):
         """
-        Runs generation for IDEA Safe mode: gets full output, filters, then displays.
+        Runs all steps of an idea chain, one request per item, streaming the sections into
+        the output block of block_cursor. Runs as a scheduler job.
+        """
+        task_name = "アイデア連鎖生成"
+        metrics = None
+        try:
+            settings = load_settings()
+            max_length = settings.get("max_length_idea", DEFAULT_SETTINGS["max_length_idea"])
+            for item_key in chain.items:
+                # A previous stop may still be aborting on the server
+                await self.llm_client.wait_until_ready()
+                metrics = self._begin_metrics(f"{task_name} {METADATA_MAP[item_key]}", chain.step_prompt(item_key),
+                                              0.0, max_length)
+                with track_generation(metrics):
+                    async for text in chain.run_step(self.llm_client, item_key, max_length, metrics):
+                        self.output_sink.append(text, block_cursor)
+                self._end_metrics(metrics)
+                metrics = None
+
+            self.output_sink.flush()
+            self.status_bar.showMessage(f"{task_name} 完了", 3000)
+
+        except (KoboldClientError, IdeaChainError) as e:
+            self._end_metrics(metrics, error=str(e))
+            error_msg = f"\n--- {task_name} エラー: {e} ---\n"
+            self._append_to_block(block_cursor, error_msg)
+            self.status_bar.showMessage(f"{task_name} エラー", 3000)
+        except asyncio.CancelledError:
+            print(f"{task_name} task cancelled.")
+            self._end_metrics(metrics, cancelled=True)
+            self._append_to_block(block_cursor, f"\n--- {task_name}がキャンセルされました ---\n")
+            self.status_bar.showMessage(f"{task_name} キャンセル", 3000)
+        except Exception as e:
+             self._end_metrics(metrics, error=str(e))
+             error_msg = f"\n--- {task_name}中に予期せぬエラーが発生しました: {e} ---\n"
+             print(error_msg)
+             self._append_to_block(block_cursor, error_msg)
+             self.status_bar.showMessage("予期せぬエラー", 3000)
+        finally:
+            self._close_output_block(block_cursor)
+            self._update_ui_for_generation_stop()
+
+    async def _collect_idea_section(self, prompt: str, max_length: int, stop_sequence: Optional[List[str]],
+                                    selected_item_key: str, infinite: bool = False,
+                                    metrics: Optional[GenerationMetrics] = None) -> IdeaRecord:
+        """
+        Streams an IDEA safe-mode generation and stops it as soon as the selected section
+        is complete (the next '# 見出し:' header has started), instead of waiting for
+        max_length. Closing the stream early makes the client abort the request on the server.
+
+        Args:
+            infinite: If True, raises CancelledError when infinite generation is stopped mid-stream.
+            metrics: Optional metrics of this request; records tokens and the early stop.
+
+        Returns:
+            IdeaRecord: The output parsed while streaming, to be passed to IdeaProcessor.filter_record().
+        """
+        watcher = IdeaSectionWatcher(selected_item_key)
+        async with aclosing(self.llm_client.generate_stream(
+            prompt,
+            max_length=max_length,
+            stop_sequence=stop_sequence
+        )) as stream:
+            async for token in stream:
+                if infinite and self.generation_status != "infinite_running":
+                    raise asyncio.CancelledError("Infinite generation stopped during stream.")
+                if metrics is not None:
+                    metrics.mark_token(token)
+                if watcher.feed(token):
+                    print(f"Selected section '{selected_item_key}' complete. Stopping stream early.")
+                    if metrics is not None:
+                        metrics.finish(STOP_REASON_SECTION)
+                    break
+                if infinite:
+                    await asyncio.sleep(0.001) # No UI update during collection
+        return watcher.record()
+
+    async def _run_safe_idea_generation(self, prompt: str, block_cursor: QTextCursor, stop_sequence: Optional[List[str]],
+                                        selected_item_key: str, prompt_build_s: float = 0.0, ui_data: Optional[Dict] = None):
+        """
+        Runs generation for IDEA Safe mode: gets full output, filters, then displays
+        it in the output block of block_cursor. Runs as a scheduler job.
+        The other sections written on the way are added to the candidate pool (ui_data: inputs of the prompt).
         """
         task_name = "アイデア生成 (安全)"
-        full_output = ""
+        metrics = None
         try:
             # Get mode-specific max_length
             settings = load_settings()
             current_max_length = settings.get("max_length_idea", DEFAULT_SETTINGS["max_length_idea"])
 
-            # Collect full output from the stream
-            async for token in self.llm_client.generate_stream(
-                prompt,
-                max_length=current_max_length,
-                stop_sequence=stop_sequence
-            ):
-                full_output += token
-                # Optional: Add a small sleep if needed, but not strictly necessary here
-                # await asyncio.sleep(0.001)
+            # A previous stop may still be aborting on the server
+            await self.llm_client.wait_until_ready()
+
+            # Collect output until the selected section is complete
+            metrics = self._begin_metrics(task_name, prompt, prompt_build_s, current_max_length)
+            with track_generation(metrics):
+                idea_record = await self._collect_idea_section(prompt, current_max_length, stop_sequence, selected_item_key,
+                                                               metrics=metrics)
 
             # Filter the output
             ui_inputs = self._get_metadata_from_ui()["metadata"] # Get current inputs for processor context
             processor = IdeaProcessor(ui_inputs) # Re-instantiate or pass if needed
-            filtered_output = processor.filter_output(full_output, selected_item_key)
-
-            # Display filtered output (replace existing content in output area)
-            # self._append_to_output(filtered_output) # Append might be confusing, let's replace
-            self.output_text_edit.appendPlainText(filtered_output) # Append after the separator
-            cursor = self.output_text_edit.textCursor()
-            cursor.movePosition(QTextCursor.End)
-            self.output_text_edit.setTextCursor(cursor)
+            filtered_output = processor.filter_record(idea_record, selected_item_key)
 
+            # Display filtered output after the separator (the block number was reserved at submit)
+            self._append_to_block(block_cursor, filtered_output)
+            self._end_metrics(metrics)
+            self._harvest_idea_candidates(idea_record, ui_data, selected_item_key)
 
             # Finished successfully
-            # Increment counter only if generation was successful (or started for streaming)
-            # For safe mode, counter is incremented after successful filtering/display
-            # For fast mode (including 'all'), counter is incremented after stream finishes in _run_single_generation
-            # self.output_block_counter += 1 # Moved to _run_single_generation and after filtering in safe mode
             self.status_bar.showMessage(f"{task_name} 完了", 3000)
 
         except KoboldClientError as e:
+            self._end_metrics(metrics, error=str(e))
             error_msg = f"\n--- {task_name} エラー: {e} ---\n"
-            self._append_to_output(error_msg) # Append errors
+            self._append_to_block(block_cursor, error_msg) # Append errors
             self.status_bar.showMessage(f"{task_name} エラー", 3000)
         except asyncio.CancelledError:
             print(f"{task_name} task cancelled.")
-            self._append_to_output(f"\n--- {task_name}がキャンセルされました ---\n") # Append cancellation message
+            self._end_metrics(metrics, cancelled=True)
+            self._append_to_block(block_cursor, f"\n--- {task_name}がキャンセルされました ---\n") # Append cancellation message
             self.status_bar.showMessage(f"{task_name} キャンセル", 3000)
         except Exception as e:
+             self._end_metrics(metrics, error=str(e))
              error_msg = f"\n--- {task_name}中に予期せぬエラーが発生しました: {e} ---\n"
              print(error_msg)
-             self._append_to_output(error_msg) # Append errors
+             self._append_to_block(block_cursor, error_msg) # Append errors
              self.status_bar.showMessage("予期せぬエラー", 3000)
         finally:
-            # Reset status after run finishes or errors out
-            self.generation_status = "idle"
+            # The job ends here; the scheduler drops it from the "single" group
+            self._close_output_block(block_cursor)
             self._update_ui_for_generation_stop()
-            self.generation_task = None
 
 
     async def _run_infinite_generation_loop(self):
@@ -665,19 +1089,27 @@ class MainWindow(QMainWindow):
         fast_mode_enabled = False
         selected_item_key = "all" # Default for safety
         processor = None
+        processor_ui_data = None # ui_data the current processor was created from
         current_max_length = settings.get("max_length_generate", DEFAULT_SETTINGS["max_length_generate"]) # Default to generate
+        prompt_build_s = 0.0 # Time of the last prompt preparation, reported with the next request
+        # Parts not invalidated by widget edits are reused between cycles
+        prompt_builder = self.incremental_prompt_builder
+        prompt_builder.invalidate()
 
         # --- Helper function to prepare IDEA generation parameters ---
         def prepare_idea_params():
-            nonlocal final_prompt, stop_sequence, fast_mode_enabled, selected_item_key, processor, current_max_length
+            nonlocal final_prompt, stop_sequence, fast_mode_enabled, selected_item_key, processor, processor_ui_data, current_max_length
+            nonlocal prompt_build_s
+            build_started = time.perf_counter()
             try:
                 selected_item_index = self.idea_item_combo.currentIndex()
                 selected_item_key = self.idea_item_combo.itemData(selected_item_index)
                 fast_mode_enabled = self.idea_fast_mode_check.isChecked()
-                ui_inputs = self._get_metadata_from_ui()["metadata"]
-                full_ui_data = self._get_metadata_from_ui() # For build_prompt
+                full_ui_data = prompt_builder.get_ui_data(self._get_metadata_from_ui) # Re-read only after edits
 
-                processor = IdeaProcessor(ui_inputs)
+                if processor is None or processor_ui_data is not full_ui_data:
+                    processor = IdeaProcessor(full_ui_data["metadata"])
+                    processor_ui_data = full_ui_data
                 # Call correct IdeaProcessor methods
                 stop_sequence = processor.determine_stop_sequence(selected_item_key)
                 prompt_suffix = ""
@@ -695,13 +1127,14 @@ class MainWindow(QMainWindow):
                         self.infinite_warning_shown = True # Set flag after showing
 
                 # Build base prompt
-                base_prompt = build_prompt(
-                    current_mode="idea",
-                    main_text="",
-                    ui_data=full_ui_data,
+                base_prompt = prompt_builder.build(
+                    "idea",
+                    read_main_text=lambda: "", # main_text is not used for IDEA mode
+                    read_ui_data=self._get_metadata_from_ui,
                     cont_prompt_order="reference_first" # Doesn't affect IDEA
                 )
                 final_prompt = base_prompt + prompt_suffix
+                prompt_build_s = time.perf_counter() - build_started
 
                 # Get IDEA max length
                 current_max_length = settings.get("max_length_idea", DEFAULT_SETTINGS["max_length_idea"])
@@ -716,21 +1149,25 @@ class MainWindow(QMainWindow):
 
         # --- Helper function to prepare Generate mode parameters ---
         def prepare_generate_params():
-            nonlocal final_prompt, stop_sequence, current_max_length
+            nonlocal final_prompt, stop_sequence, current_max_length, prompt_build_s
+            build_started = time.perf_counter()
             try:
-                raw_main_text = self.main_text_edit.toPlainText()
-                main_text = evaluate_dynamic_prompt(raw_main_text)
-                ui_data = self._get_metadata_from_ui()
                 # Load settings for prompt order
                 current_settings = load_settings() # Reload settings if needed
                 cont_order = current_settings.get("cont_prompt_order", DEFAULT_SETTINGS["cont_prompt_order"])
 
-                final_prompt = build_prompt(
-                    current_mode="generate",
-                    main_text=main_text,
-                    ui_data=ui_data,
-                    cont_prompt_order=cont_order
+                # Widgets are only read (and the 本文 only split) if they changed since the last cycle;
+                # dynamic prompts are still evaluated on every build
+                final_prompt = prompt_builder.build(
+                    "generate",
+                    read_main_text=self.main_text_edit.toPlainText,
+                    read_ui_data=self._get_metadata_from_ui,
+                    cont_prompt_order=cont_order,
+                    context_budget=self._get_context_budget(current_settings),
+                    cache_stable=current_settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"])
                 )
+                prompt_build_s = time.perf_counter() - build_started
+                self._report_prefix_reuse(final_prompt, current_settings)
                 # Use default stop sequence from KoboldClient/settings for generate mode
                 stop_sequence = None
                 # Get Generate max length
@@ -748,19 +1185,114 @@ class MainWindow(QMainWindow):
         if update_behavior == "manual":
             if self.current_mode == "idea":
                 if not prepare_idea_params():
-                    self._stop_current_generation()
+                    self._stop_infinite_generation()
                     return
             else: # generate mode
                 if not prepare_generate_params():
-                    self._stop_current_generation()
+                    self._stop_infinite_generation()
                     return
             # Check if initial prompt is empty after manual prep
             if not final_prompt:
                  print("Error: Initial infinite generation prompt is empty after manual preparation.")
-                 self._stop_current_generation() # This line was missing in the previous SEARCH block
+                 self._stop_infinite_generation() # This line was missing in the previous SEARCH block
                  return # Add the missing return statement here
-        # --- Main Generation Loop ---
-        try:
+        # --- Number of concurrent streams (each fills its own output block) ---
+        parallel_streams = max(1, int(settings.get("infinite_parallel_streams", DEFAULT_SETTINGS["infinite_parallel_streams"])))
+        # --- Candidates generated ahead in manual mode (the prompt only changes on edits) ---
+        prefetch_depth = max(0, int(settings.get("infinite_prefetch_depth", DEFAULT_SETTINGS["infinite_prefetch_depth"])))
+
+        def block_separator(block_number: int) -> str:
+            if self.current_mode == "idea":
+                current_item_text_for_separator = self.idea_item_combo.currentText() if self.idea_item_combo else "N/A"
+                return f"\n--- アイデア生成 ({current_item_text_for_separator}) ({block_number}) ---\n"
+            return f"\n--- 生成ブロック {block_number} ---\n" # generate mode
+
+        async def run_generation_cycle():
+            """Runs one generation into a newly reserved output block."""
+            nonlocal prompt_build_s
+            # Snapshot the prepared parameters; other workers may re-prepare them while this stream runs
+            prompt = final_prompt
+            cycle_build_s, prompt_build_s = prompt_build_s, 0.0 # Reused prompts cost nothing to build
+            cycle_stop_sequence = stop_sequence
+            cycle_item_key = selected_item_key
+            cycle_fast_mode = fast_mode_enabled
+            cycle_processor = processor
+            cycle_ui_data = processor_ui_data # Inputs of the prompt, for the candidate pool
+            cycle_max_length = current_max_length
+
+            # Reserve the block number up front so concurrent blocks are numbered in start order
+            block_number = self.output_block_counter
+            self.output_block_counter += 1
+
+            # --- Define Separator Dynamically (Inside the loop for immediate mode) ---
+            # This needs to happen *after* potential parameter updates in immediate mode
+            separator = block_separator(block_number)
+
+            metrics = self._begin_metrics(f"無限生成 {block_number}", prompt, cycle_build_s, cycle_max_length)
+            try:
+                with track_generation(metrics):
+                    if self.current_mode == "idea" and cycle_item_key != "all" and not cycle_fast_mode:
+                        # --- Safe Mode (Collect until section complete, Filter, Append) ---
+                        idea_record = await self._collect_idea_section(
+                            prompt, cycle_max_length, cycle_stop_sequence, cycle_item_key, infinite=True, metrics=metrics
+                        )
+
+                        if not cycle_processor: # Ensure processor exists
+                            print("Error: IdeaProcessor not available for filtering.")
+                            self._append_to_output("\n--- フィルタリングエラー ---\n")
+                            return
+                        filtered_output = cycle_processor.filter_record(idea_record, cycle_item_key)
+                        self._harvest_idea_candidates(idea_record, cycle_ui_data, cycle_item_key)
+                        block_cursor = self._open_output_block(separator)
+                        self._append_to_block(block_cursor, filtered_output)
+                        self._suppress_duplicate_block(block_cursor, filtered_output, separator)
+                        self._close_output_block(block_cursor)
+                    else:
+                        # --- Streaming ("all" item, Fast Mode, or Generate Mode) ---
+                        block_cursor = self._open_output_block(separator)
+                        duplicate_check = self._start_duplicate_check()
+                        chunks = []
+                        try:
+                            async with aclosing(self.llm_client.generate_stream(
+                                prompt,
+                                max_length=cycle_max_length,
+                                stop_sequence=cycle_stop_sequence # Will be None for generate mode
+                            )) as stream:
+                                async for token in stream:
+                                    if self.generation_status != "infinite_running":
+                                        raise asyncio.CancelledError("Infinite generation stopped during stream.")
+                                    metrics.mark_token(token)
+                                    chunks.append(token)
+                                    self.output_sink.append(token, block_cursor) # Rendered in batches by the sink
+                                    if duplicate_check is not None and duplicate_check.feed(token):
+                                        metrics.finish(STOP_REASON_DUPLICATE) # Closing the stream aborts the request
+                                        break
+                            if metrics.backend_stop_reason == STOP_REASON_REPETITION:
+                                self.output_sink.append(REPETITION_MARKER, block_cursor) # The next cycle starts as usual
+                            self._suppress_duplicate_block(block_cursor, "".join(chunks), separator, duplicate_check)
+                            if self.current_mode == "idea" and cycle_item_key == "all":
+                                metrics.finish()
+                                self._harvest_idea_candidates(parse_idea_output("".join(chunks)), cycle_ui_data, "all",
+                                                              finished=metrics.stop_reason == STOP_REASON_STOP)
+                        finally:
+                            self._close_output_block(block_cursor)
+            except asyncio.CancelledError:
+                self._end_metrics(metrics, cancelled=True)
+                raise
+            except Exception as e:
+                self._end_metrics(metrics, error=str(e))
+                raise
+            finally:
+                self._end_metrics(metrics) # No-op if already ended above
+
+        async def run_cycle_job():
+            """One generation cycle as a scheduler job."""
+            # Make sure aborted streams (stop/cancel) have released the server slot
+            await self.llm_client.wait_until_ready()
+            await run_generation_cycle()
+
+        async def run_worker():
+            """Keeps one generation slot busy until infinite generation is stopped."""
             while self.generation_status == "infinite_running":
                 # --- Re-prepare parameters if behavior is 'immediate' ---
                 if update_behavior == "immediate":
@@ -778,103 +1310,31 @@ class MainWindow(QMainWindow):
                          await asyncio.sleep(0.5)
                          continue
 
-                # --- Define Separator Dynamically (Inside the loop for immediate mode) ---
-                # This needs to happen *after* potential parameter updates in immediate mode
-                current_item_text_for_separator = "N/A" # Default
-                if self.current_mode == "idea" and self.idea_item_combo:
-                     current_item_text_for_separator = self.idea_item_combo.currentText()
-
-                if self.current_mode == "idea":
-                    separator = f"\n--- アイデア生成 ({current_item_text_for_separator}) ({self.output_block_counter}) ---\n"
-                else: # generate mode
-                    separator = f"\n--- 生成ブロック {self.output_block_counter} ---\n"
-
-
-                # --- Execute Generation based on mode and settings ---
-                generation_successful = False
                 try:
-                    if self.current_mode == "idea":
-                        # --- IDEA Mode Execution ---
-                        if selected_item_key == "all":
-                            # --- "All" Item: Always Stream ---
-                            self._append_to_output(separator)
-                            async for token in self.llm_client.generate_stream(
-                                final_prompt,
-                                max_length=current_max_length,
-                                stop_sequence=stop_sequence # Use determined stop sequence even for 'all'
-                            ):
-                                if self.generation_status != "infinite_running":
-                                    raise asyncio.CancelledError("Infinite generation stopped during stream.")
-                                self._append_to_output(token)
-                                await asyncio.sleep(0.001)
-                            generation_successful = True
-                        elif not fast_mode_enabled:
-                            # --- Safe Mode (Collect, Filter, Append) ---
-                            full_output = ""
-                            async for token in self.llm_client.generate_stream(
-                                final_prompt,
-                                max_length=current_max_length,
-                                stop_sequence=stop_sequence
-                            ):
-                                if self.generation_status != "infinite_running":
-                                    raise asyncio.CancelledError("Infinite generation stopped during stream.")
-                                full_output += token
-                                # No UI update during collection, maybe a small sleep
-                                await asyncio.sleep(0.001)
-
-                            if processor: # Ensure processor exists
-                                filtered_output = processor.filter_output(full_output, selected_item_key)
-                                # Append separator and filtered output directly
-                                self.output_text_edit.appendPlainText(separator + filtered_output)
-                                cursor = self.output_text_edit.textCursor()
-                                cursor.movePosition(QTextCursor.End)
-                                self.output_text_edit.setTextCursor(cursor)
-                                generation_successful = True
-                            else:
-                                print("Error: IdeaProcessor not available for filtering.")
-                                self._append_to_output("\n--- フィルタリングエラー ---\n")
-
-                        else:
-                            # --- Fast Mode (Stream directly) ---
-                            self._append_to_output(separator)
-                            async for token in self.llm_client.generate_stream(
-                                final_prompt,
-                                max_length=current_max_length,
-                                stop_sequence=stop_sequence
-                            ):
-                                if self.generation_status != "infinite_running":
-                                    raise asyncio.CancelledError("Infinite generation stopped during stream.")
-                                self._append_to_output(token)
-                                await asyncio.sleep(0.001)
-                            generation_successful = True
-
+                    job = self.scheduler.submit(run_cycle_job, PRIORITY_BACKGROUND, group=JOB_GROUP_INFINITE, label="無限生成")
+                    try:
+                        await job.wait()
+                    except asyncio.CancelledError:
+                        if job.preempted and self.generation_status == "infinite_running":
+                            # A single generation took the slot; the next cycle waits in the queue until it is done
+                            print("Infinite generation cycle preempted by a single generation.")
+                            continue
+                        job.cancel()
+                        raise
+                    # Single stream keeps the original pacing; parallel slots are refilled immediately
+                    if parallel_streams == 1:
+                        await asyncio.sleep(0.5) # Wait before next generation
                     else:
-                        # --- Generate Mode Execution (Stream directly) ---
-                        self._append_to_output(separator)
-                        async for token in self.llm_client.generate_stream(
-                            final_prompt,
-                            max_length=current_max_length,
-                            stop_sequence=stop_sequence # Will be None for generate mode
-                        ):
-                            if self.generation_status != "infinite_running":
-                                raise asyncio.CancelledError("Infinite generation stopped during stream.")
-                            self._append_to_output(token)
-                            await asyncio.sleep(0.001)
-                        generation_successful = True
-
-                    # --- Post-generation ---
-                    if generation_successful:
-                        self.output_block_counter += 1
-                    await asyncio.sleep(0.5) # Wait before next generation
+                        await asyncio.sleep(0)
 
                 except KoboldClientError as e:
                     error_msg = f"\n--- 無限生成中エラー: {e} ---\n"
                     self._append_to_output(error_msg)
                     self.status_bar.showMessage("無限生成エラー発生、停止します", 5000)
-                    self._stop_current_generation() # Stop the infinite loop
+                    self._stop_infinite_generation() # Stop the infinite loop
                     break # Exit while loop
                 except asyncio.CancelledError:
-                     print("Infinite generation loop cancelled.")
+                     print("Infinite generation worker cancelled.")
                      # Stop is handled outside, just break the loop
                      break
                 except Exception as e:
@@ -882,19 +1342,294 @@ class MainWindow(QMainWindow):
                      print(error_msg)
                      self._append_to_output(error_msg)
                      self.status_bar.showMessage("予期せぬエラー発生、停止します", 5000)
-                     self._stop_current_generation() # Stop the infinite loop
+                     self._stop_infinite_generation() # Stop the infinite loop
                      break # Exit while loop
+
+        async def generate_candidate():
+            """Chunks of one prefetched candidate (safe IDEA mode yields the filtered text at once)."""
+            nonlocal prompt_build_s
+            prompt = final_prompt
+            cycle_build_s, prompt_build_s = prompt_build_s, 0.0
+            cycle_stop_sequence = stop_sequence
+            cycle_item_key = selected_item_key
+            cycle_fast_mode = fast_mode_enabled
+            cycle_processor = processor
+            cycle_ui_data = processor_ui_data # Inputs of the prompt, for the candidate pool
+            cycle_max_length = current_max_length
+
+            metrics = self._begin_metrics("無限生成 (先読み)", prompt, cycle_build_s, cycle_max_length)
+            try:
+                with track_generation(metrics):
+                    if self.current_mode == "idea" and cycle_item_key != "all" and not cycle_fast_mode:
+                        idea_record = await self._collect_idea_section(
+                            prompt, cycle_max_length, cycle_stop_sequence, cycle_item_key, infinite=True, metrics=metrics
+                        )
+                        if not cycle_processor:
+                            raise RuntimeError("IdeaProcessor not available for filtering.")
+                        self._harvest_idea_candidates(idea_record, cycle_ui_data, cycle_item_key)
+                        yield cycle_processor.filter_record(idea_record, cycle_item_key)
+                    else:
+                        harvest = self.current_mode == "idea" and cycle_item_key == "all"
+                        chunks = []
+                        # Closed together with the candidate, so a discarded candidate stops on the server
+                        async with aclosing(self.llm_client.generate_stream(
+                            prompt,
+                            max_length=cycle_max_length,
+                            stop_sequence=cycle_stop_sequence
+                        )) as stream:
+                            async for token in stream:
+                                metrics.mark_token(token)
+                                if harvest:
+                                    chunks.append(token)
+                                yield token
+                        if metrics.backend_stop_reason == STOP_REASON_REPETITION:
+                            yield REPETITION_MARKER
+                        if harvest:
+                            metrics.finish()
+                            self._harvest_idea_candidates(parse_idea_output("".join(chunks)), cycle_ui_data, "all",
+                                                          finished=metrics.stop_reason == STOP_REASON_STOP)
+            except (asyncio.CancelledError, GeneratorExit):
+                self._end_metrics(metrics, cancelled=True)
+                raise
+            except Exception as e:
+                self._end_metrics(metrics, error=str(e))
+                raise
+            finally:
+                self._end_metrics(metrics)
+
+        async def run_prefetch_loop():
+            """Shows candidates one after another while the next ones are generated in the background."""
+            queue = PrefetchQueue(generate_candidate, depth=prefetch_depth, scheduler=self.scheduler, group=JOB_GROUP_INFINITE)
+            self.prefetch_queue = queue
+            self.prefetch_needs_rebuild = False
+            try:
+                while self.generation_status == "infinite_running":
+                    if self.prefetch_needs_rebuild:
+                        # The 本文 or 詳細情報 was edited: queued candidates were dropped, rebuild the prompt
+                        self.prefetch_needs_rebuild = False
+                        prepared = prepare_idea_params() if self.current_mode == "idea" else prepare_generate_params()
+                        if not prepared or not final_prompt:
+                            await asyncio.sleep(0.5)
+                            self.prefetch_needs_rebuild = True
+                            continue
+
+                    candidate = queue.next()
+                    block_number = self.output_block_counter
+                    self.output_block_counter += 1
+                    separator = block_separator(block_number)
+                    block_cursor = self._open_output_block(separator)
+                    duplicate_check = self._start_duplicate_check()
+                    try:
+                        async for chunk in candidate.stream():
+                            if self.generation_status != "infinite_running":
+                                raise asyncio.CancelledError("Infinite generation stopped during stream.")
+                            self.output_sink.append(chunk, block_cursor) # Rendered in batches by the sink
+                            if duplicate_check is not None and duplicate_check.feed(chunk):
+                                candidate.cancel() # Aborts the request if it is still generating
+                                break
+                        self._suppress_duplicate_block(block_cursor, candidate.text, separator, duplicate_check)
+                    except PrefetchQueueError:
+                        continue # Cancelled by an edit while queued; the block stays as it is
+                    finally:
+                        self._close_output_block(block_cursor)
+
+            except KoboldClientError as e:
+                self._append_to_output(f"\n--- 無限生成中エラー: {e} ---\n")
+                self.status_bar.showMessage("無限生成エラー発生、停止します", 5000)
+                self._stop_infinite_generation()
+            except asyncio.CancelledError:
+                print("Infinite generation prefetch loop cancelled.")
+            except Exception as e:
+                error_msg = f"\n--- 無限生成中に予期せぬエラー: {e} ---\n"
+                print(error_msg)
+                self._append_to_output(error_msg)
+                self.status_bar.showMessage("予期せぬエラー発生、停止します", 5000)
+                self._stop_infinite_generation()
+            finally:
+                self.prefetch_queue = None
+                await queue.close() # Aborts candidates that were generated ahead
+
+        # --- Main Generation Loop ---
+        try:
+            if update_behavior == "manual" and prefetch_depth > 0:
+                await run_prefetch_loop()
+            else:
+                await asyncio.gather(*(run_worker() for _ in range(parallel_streams)))
+        except asyncio.CancelledError:
+            print("Infinite generation loop cancelled.")
         finally:
             # Ensure status is reset if loop exits unexpectedly (e.g., error not caught above)
             # or if it finishes normally but wasn't stopped via button click.
-            # The _stop_current_generation call inside the loop handles cancellation/errors.
+            # The _stop_infinite_generation call inside the loop handles cancellation/errors.
             # This ensures cleanup if the loop condition itself becomes false unexpectedly.
-            if self.generation_status == "infinite_running":
-                 self._stop_current_generation()
+            if self.infinite_task is asyncio.current_task():
+                 self._stop_infinite_generation()
+
+
+    def _open_output_block(self, separator: str, anchored: bool = True) -> Optional[QTextCursor]:
+        """
+        Appends a block separator to the output area and registers the block for
+        the bounded output history.
+
+        Args:
+            separator: The separator line starting the block.
+            anchored: If True, returns a cursor anchored at the end of the block. Text
+                inserted through it stays inside the block even when other blocks are
+                appended after it (parallel generation), and the block is kept in the
+                output area until _close_output_block() is called. If False, the output
+                is appended at the end of the document and None is returned.
+        """
+        document = self.output_text_edit.document()
+        self.output_sink.flush()
+        start_position = document.characterCount() - 1 # Position of the document end
+        self._append_to_output(separator)
+        # Start marker moves forward when earlier blocks still insert text in front of it
+        start_cursor = QTextCursor(document)
+        start_cursor.setPosition(start_position)
+
+        block_cursor = None
+        if anchored:
+            block_cursor = QTextCursor(document)
+            block_cursor.movePosition(QTextCursor.End)
+            # Don't let text appended at the same position by other blocks push this anchor forward
+            block_cursor.setKeepPositionOnInsert(True)
+        self.output_blocks.append({"start": start_cursor, "cursor": block_cursor, "open": anchored,
+                                   "separator_length": len(separator.encode("utf-16-le")) // 2})
+        self._spill_old_output_blocks()
+        return block_cursor
+
+    def _rewrite_output_block(self, block_cursor: QTextCursor, text: Optional[str]):
+        """
+        Replaces the text of an open anchored block (after its separator) with 'text',
+        or removes the whole block including the separator if 'text' is None.
+        """
+        block = next((block for block in self.output_blocks if block["cursor"] is block_cursor), None)
+        if block is None:
+            return
+        self.output_sink.flush() # Pending chunks of this block must be in the document first
+        cursor = QTextCursor(self.output_text_edit.document())
+        start_position = block["start"].position()
+        cursor.setPosition(start_position if text is None else start_position + block["separator_length"])
+        cursor.setPosition(block_cursor.position(), QTextCursor.KeepAnchor)
+        cursor.beginEditBlock()
+        cursor.removeSelectedText()
+        if text:
+            cursor.insertText(text)
+        cursor.endEditBlock()
+        if text is None:
+            self.output_blocks.remove(block)
+
+    def _start_duplicate_check(self) -> Optional[DuplicateStreamCheck]:
+        """Returns a prefix check for a new infinite generation stream, if early abort is enabled."""
+        abort_chars = load_settings().get("infinite_dedup_abort_chars", DEFAULT_SETTINGS["infinite_dedup_abort_chars"])
+        if self.duplicate_filter is None or abort_chars <= 0:
+            return None
+        return self.duplicate_filter.stream_check(abort_chars)
+
+    def _suppress_duplicate_block(self, block_cursor: QTextCursor, text: str, separator: str,
+                                  duplicate_check: Optional[DuplicateStreamCheck] = None) -> bool:
+        """
+        Compares a finished infinite generation block with the recent blocks of the session.
+        A near-duplicate is collapsed to a note or dropped (infinite_dedup_action); any
+        other block is remembered for the next comparisons.
+
+        Returns:
+            bool: True if the block was suppressed.
+        """
+        if self.duplicate_filter is None:
+            return False
+        label = separator.strip().strip("-").strip()
+        if duplicate_check is not None and duplicate_check.match is not None:
+            match = duplicate_check.match # The stream was aborted early
+        else:
+            match = self.duplicate_filter.find_duplicate(text)
+        if match is None:
+            self.duplicate_filter.add(text, label)
+            return False
+        print(f"Near-duplicate block suppressed: '{label}' matches '{match.label}' ({match.similarity:.2f}).")
+        if load_settings().get("infinite_dedup_action", DEFAULT_SETTINGS["infinite_dedup_action"]) == "drop":
+            self._rewrite_output_block(block_cursor, None)
+        else:
+            self._rewrite_output_block(block_cursor, f"(「{match.label}」と類似のため省略 / 類似度 {match.similarity:.2f})\n")
+        self.status_bar.showMessage(f"類似ブロックを省略しました ({match.label} と類似)", 3000)
+        return True
+
+    def _close_output_block(self, block_cursor: QTextCursor):
+        """Marks an anchored block as finished so it can be moved to the archive."""
+        for block in self.output_blocks:
+            if block["cursor"] is block_cursor:
+                block["open"] = False
+                block["cursor"] = None
+                break
+        self._spill_old_output_blocks()
+
+    def _spill_old_output_blocks(self):
+        """
+        Keeps at most 'output_max_blocks' blocks in the output area by moving the oldest
+        finished blocks to the on-disk archive. Blocks still being written are never moved.
+        """
+        max_blocks = load_settings().get("output_max_blocks", DEFAULT_SETTINGS["output_max_blocks"])
+        if max_blocks <= 0 or len(self.output_blocks) <= max_blocks:
+            return
+        spill_count = 0
+        for block in self.output_blocks[:len(self.output_blocks) - max_blocks]:
+            if block["open"]:
+                break # Later blocks must wait until this one is finished
+            spill_count += 1
+        if spill_count == 0:
+            return
+
+        self.output_sink.flush()
+        document = self.output_text_edit.document()
+        end_position = self.output_blocks[spill_count]["start"].position()
+        read_cursor = QTextCursor(document)
+        try:
+            for index in range(spill_count):
+                # Text before the first block (if any) is archived together with it
+                read_cursor.setPosition(0 if index == 0 else self.output_blocks[index]["start"].position())
+                read_cursor.setPosition(self.output_blocks[index + 1]["start"].position(), QTextCursor.KeepAnchor)
+                self.output_archive.append(read_cursor.selection().toPlainText())
+        except OutputArchiveError as e:
+            print(f"Error: Could not archive output blocks: {e}")
+            return # Keep the blocks in the output area
 
+        v_bar = self.output_text_edit.verticalScrollBar()
+        is_at_bottom = v_bar.value() >= v_bar.maximum() - 5
+        scroll_value = v_bar.value()
+        line_count = document.blockCount()
+
+        read_cursor.setPosition(0)
+        read_cursor.setPosition(end_position, QTextCursor.KeepAnchor)
+        read_cursor.removeSelectedText()
+        del self.output_blocks[:spill_count]
+
+        # Keep the view on the same text (QPlainTextEdit scrolls by lines)
+        if is_at_bottom:
+            v_bar.setValue(v_bar.maximum())
+        else:
+            v_bar.setValue(max(0, scroll_value - (line_count - document.blockCount())))
+        print(f"Moved {spill_count} output block(s) to the archive ({len(self.output_archive)} archived).")
+
+    def _append_to_block(self, block_cursor: QTextCursor, text: str):
+        """Inserts text at the end of an output block and handles scrolling."""
+        self.output_sink.flush() # Keep buffered tokens in order
+        v_bar = self.output_text_edit.verticalScrollBar()
+        is_at_bottom = v_bar.value() >= v_bar.maximum() - 5
+
+        position = block_cursor.position()
+        block_cursor.insertText(text)
+        # Advance explicitly (Qt positions count UTF-16 code units)
+        block_cursor.setPosition(position + len(text.encode("utf-16-le")) // 2)
+
+        if is_at_bottom:
+            v_bar.setValue(v_bar.maximum())
 
     def _append_to_output(self, text: str):
-        """Safely appends text to the output area and handles scrolling."""
+        """
+        Safely appends text to the output area and handles scrolling.
+        Buffered stream tokens are written first so the order is kept.
+        """
+        self.output_sink.flush()
         cursor = self.output_text_edit.textCursor()
         v_bar = self.output_text_edit.verticalScrollBar()
         is_at_bottom = v_bar.value() >= v_bar.maximum() - 5
@@ -934,22 +1669,43 @@ class MainWindow(QMainWindow):
     async def _cleanup(self): # Make cleanup async
         """Closes the Kobold client when the application is about to quit."""
         print("Cleaning up...")
+        self.settings_notifier.stop()
         if self.generation_status != "idle":
             self._stop_current_generation() # Attempt to stop gracefully
+        await self.scheduler.close() # Waits until cancelled jobs have closed their streams
         print("Requesting LLM client close...")
         try:
             await self.llm_client.close() # Await the async close
             print("LLM client closed.")
         except Exception as e:
             print(f"Error during client close: {e}")
+        self.output_archive.close() # Deletes the temporary archive file
+        if self.session_metrics.requests:
+            print(self.session_metrics.format_summary())
 
     @Slot()
     def _clear_output_edit(self):
         """Clears the output text edit and resets the block counter."""
+        self.output_sink.discard()
         self.output_text_edit.clear()
+        self.output_blocks = []
+        self.output_archive.clear()
         self.output_block_counter = 1
         self.status_bar.showMessage("出力エリアをクリアしました。", 2000)
 
+    @Slot()
+    def _open_output_archive_dialog(self):
+        """Shows the output blocks that were moved out of the output area."""
+        page_size = load_settings().get("output_max_blocks", DEFAULT_SETTINGS["output_max_blocks"]) or 10
+        dialog = OutputArchiveDialog(
+            self.output_archive,
+            page_size,
+            transfer_to_main=self._transfer_text_to_main,
+            transfer_to_memo=self._transfer_text_to_memo,
+            parent=self
+        )
+        dialog.exec()
+
     @Slot()
     def _transfer_output_to_main(self):
         """Transfers selected text from output area to main text area based on settings."""
@@ -957,7 +1713,10 @@ class MainWindow(QMainWindow):
         if not selected_text:
             self.status_bar.showMessage("出力エリアでテキストが選択されていません。", 2000)
             return
+        self._transfer_text_to_main(selected_text)
 
+    def _transfer_text_to_main(self, selected_text: str):
+        """Inserts text into the main text area according to the transfer settings."""
         settings = load_settings()
         transfer_mode = settings.get("transfer_to_main_mode", DEFAULT_SETTINGS["transfer_to_main_mode"])
         newlines_before = settings.get("transfer_newlines_before", DEFAULT_SETTINGS["transfer_newlines_before"])
@@ -989,11 +1748,15 @@ class MainWindow(QMainWindow):
         """Transfers selected text from output area to memo area."""
         selected_text = self.output_text_edit.textCursor().selectedText() # Source is output_text_edit
         if selected_text:
-            self.memo_edit.appendPlainText(selected_text) # Append to memo
-            self.status_bar.showMessage("選択範囲をメモエリアに転記しました。", 2000)
+            self._transfer_text_to_memo(selected_text)
         else:
             self.status_bar.showMessage("出力エリアでテキストが選択されていません。", 2000) # Message updated
 
+    def _transfer_text_to_memo(self, selected_text: str):
+        """Appends text to the memo area."""
+        self.memo_edit.appendPlainText(selected_text) # Append to memo
+        self.status_bar.showMessage("選択範囲をメモエリアに転記しました。", 2000)
+
     @Slot()
     def _transfer_idea_to_details(self, metadata_key: str):
         """
@@ -1005,58 +1768,28 @@ class MainWindow(QMainWindow):
             self.status_bar.showMessage("出力エリアで転記したいテキストを選択してください。", 3000)
             return
 
-        japanese_name_map = {
-            "title": "タイトル", "keywords": "キーワード", "genres": "ジャンル",
-            "synopsis": "あらすじ", "setting": "設定", "plot": "プロット",
-        }
-        target_name = japanese_name_map.get(metadata_key)
+        target_name = METADATA_MAP.get(metadata_key)
         if not target_name:
             print(f"Error: Unknown metadata key '{metadata_key}' for transfer.")
             return
 
-        # Find the target section header anywhere in the selection and capture everything after it
-        pattern = re.compile(rf"# {re.escape(target_name)}:\s*(.*)", re.MULTILINE | re.DOTALL)
-        match = pattern.search(selected_text)
-
-        if not match:
+        # Qt returns paragraph/line separators instead of newlines in selections
+        selected_text = selected_text.replace("\u2029", "\n").replace("\u2028", "\n")
+        record = parse_idea_output(selected_text)
+        if metadata_key not in record:
             self.status_bar.showMessage(f"選択範囲から「{target_name}」セクションが見つかりませんでした。", 3000)
             return
 
-        # Extract content after the header and process line by line
-        content_after_header = match.group(1).strip()
-        lines = content_after_header.splitlines()
-        extracted_lines = []
-        for line in lines:
-            # Check if the line starts with another section header
-            is_next_header = False
-            # Iterate through all possible Japanese names in the map
-            for key, jp_name in japanese_name_map.items():
-                # Make sure we don't stop at the *current* header if it appears again,
-                # only stop if it's a *different* header.
-                if key != metadata_key and line.strip().startswith(f"# {jp_name}:"):
-                    is_next_header = True
-                    break # Found a different header, stop checking for this line
-            
-            if is_next_header:
-                break # Stop extracting lines when the next header is found
-            extracted_lines.append(line) # Append the line if it's not a subsequent header
-
-        extracted_value = "\n".join(extracted_lines).strip() # Join the extracted lines
-
-        # Handle potential empty extraction if the target header was last or immediately followed
-        # (extracted_value might be "" here, which is generally okay, but check specific cases)
+        # Typed value: first line for the title, a tag list for keywords/genres, text otherwise
+        extracted_value = record.value(metadata_key)
 
         try:
             if metadata_key == "title":
-                # Title should be single line, take the first extracted line
-                extracted_value = extracted_value.splitlines()[0] if extracted_value else ""
                 self.title_edit.setText(extracted_value)
             elif metadata_key == "keywords":
-                tags = [line.strip().lstrip('-').strip() for line in extracted_value.splitlines() if line.strip()]
-                self.keywords_widget.set_tags(tags)
+                self.keywords_widget.set_tags(extracted_value)
             elif metadata_key == "genres":
-                tags = [line.strip().lstrip('-').strip() for line in extracted_value.splitlines() if line.strip()]
-                self.genre_widget.set_tags(tags)
+                self.genre_widget.set_tags(extracted_value)
             elif metadata_key == "synopsis":
                 self.synopsis_edit.setPlainText(extracted_value)
             elif metadata_key == "setting":
@@ -1110,8 +1843,14 @@ class MainWindow(QMainWindow):
         selected_item_index = self.idea_item_combo.currentIndex()
         selected_item_key = self.idea_item_combo.itemData(selected_item_index)
 
+        # Chain mode ignores the item selection
+        chain_enabled = bool(self.idea_chain_check and self.idea_chain_check.isChecked())
+        self.idea_item_combo.setEnabled(not chain_enabled)
+        if self.idea_chain_count_spinbox:
+            self.idea_chain_count_spinbox.setEnabled(chain_enabled)
+
         # Disable fast mode for "全部" or the first item ("タイトル")
-        if selected_item_key == 'all' or selected_item_key == IDEA_ITEM_ORDER[0]:
+        if chain_enabled or selected_item_key == 'all' or selected_item_key == IDEA_ITEM_ORDER[0]:
             self.idea_fast_mode_check.setEnabled(False)
             self.idea_fast_mode_check.setChecked(False) # Uncheck when disabled
         else:
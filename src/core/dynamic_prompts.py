@@ -1,35 +1,221 @@
 import re
 import random
-from typing import List
-
-# Regex to find {option1|option2|"option 3"} patterns
-DYNAMIC_PROMPT_PATTERN = re.compile(r"\{([^}]+)\}")
-
-# Regex to parse the options within a {..} block, handling quoted strings
-# Handles double quotes, single quotes, or unquoted parts separated by |
-OPTION_PARSE_PATTERN = re.compile(r'"[^"]*"|\'[^\']*\'|[^|]+')
-
-def _parse_options(options_str: str) -> List[str]:
-    """Parses the options string, respecting quotes."""
-    options = []
-    # Find all matches for quoted strings or unquoted parts
-    matches = OPTION_PARSE_PATTERN.findall(options_str)
-    for match in matches:
-        match = match.strip() # Remove leading/trailing whitespace from the segment
+import itertools
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple, Union
+
+# Syntax:
+#   {option1|option2|"option 3"}   -> one option chosen at random
+#   {A|{B|C}}                      -> options can contain nested choices
+#   {3::A|B|0.5::C}                -> optional weights (default 1)
+# Quoted options ("..." or '...') are taken literally, so they may contain | { }.
+# Blocks that are unclosed or have no non-empty options are kept as plain text.
+
+# Templates up to this length are cached; longer texts (e.g. a whole manuscript that
+# changes with every edit) are parsed each time instead of pinning copies in the cache
+MAX_CACHED_TEMPLATE_CHARS = 4096
+
+# Characters that end a literal run inside a template
+SPECIAL_CHAR_PATTERN = re.compile(r"[{|}]")
+# Optional weight prefix of an option, e.g. "2::" or "0.5::"
+WEIGHT_PATTERN = re.compile(r"\s*(\d+(?:\.\d+)?)::")
+
+class Choice:
+    """A {..} block: a list of (weight, nodes) options."""
+    __slots__ = ("options", "weights", "uniform")
+
+    def __init__(self, options: List[Tuple[float, List["Node"]]]):
+        self.options = [nodes for _, nodes in options]
+        self.weights = [weight for weight, _ in options]
+        self.uniform = all(weight == 1.0 for weight in self.weights)
+
+Node = Union[str, Choice]
+
+def _strip_option(nodes: List[Node]) -> List[Node]:
+    """Strips surrounding whitespace of an unquoted option (leading/trailing literal parts)."""
+    if nodes and isinstance(nodes[0], str):
+        nodes[0] = nodes[0].lstrip()
+    if nodes and isinstance(nodes[-1], str):
+        nodes[-1] = nodes[-1].rstrip()
+    return [node for node in nodes if node != ""]
+
+def _parse_quoted(text: str, pos: int) -> Optional[Tuple[str, int]]:
+    """
+    Parses a quoted option starting at pos. Returns (content, index of the closing | or })
+    or None if the text at pos is not a complete quoted option.
+    """
+    quote = text[pos]
+    end = text.find(quote, pos + 1)
+    if end == -1:
+        return None
+    after = end + 1
+    while after < len(text) and text[after].isspace():
+        after += 1
+    if after < len(text) and text[after] in "|}":
+        return text[pos + 1:end], after
+    return None
+
+class _OpenBlock:
+    """A '{' whose block is still being parsed (see compile_dynamic_prompt())."""
+    __slots__ = ("start", "options", "weight", "nodes", "literal_start", "quoted", "raw", "raw_start")
+
+    def __init__(self, start: int):
+        self.start = start # Index of the '{' (-1 for the top level)
+        self.options: List[Tuple[float, List[Node]]] = []
+        self.weight = 1.0
+        self.nodes: List[Node] = [] # The current option
+        self.literal_start = start + 1
+        self.quoted = False
+        # Everything since the '{' as written, in case the block is never closed
+        self.raw: List[Node] = []
+        self.raw_start = start
+
+    def begin_option(self, text: str, pos: int) -> int:
+        """Starts an option at pos. Returns the index to continue scanning at."""
+        self.weight = 1.0
+        match = WEIGHT_PATTERN.match(text, pos)
         if match:
-            # Keep quotes for now, they will be handled after selection
-            options.append(match)
-    # Filter out empty strings that might result from consecutive pipes or stripping
-    return [opt for opt in options if opt]
+            self.weight = float(match.group(1))
+            pos = match.end()
+        self.nodes = []
+        self.literal_start = pos
+        self.quoted = False
+        start = pos
+        while start < len(text) and text[start].isspace():
+            start += 1
+        if start < len(text) and text[start] in "\"'":
+            quoted = _parse_quoted(text, start)
+            if quoted is not None:
+                content, end = quoted
+                self.nodes = [content] if content else []
+                self.quoted = True
+                return end # The closing | or }
+        return pos
+
+    def end_option(self, text: str, pos: int):
+        """Ends the current option at the | or } at pos."""
+        if not self.quoted:
+            self.nodes.append(text[self.literal_start:pos])
+            self.nodes = _strip_option(self.nodes)
+        if self.nodes and self.weight > 0:
+            self.options.append((self.weight, self.nodes))
 
+    def add_choice(self, text: str, choice: Choice, start: int, end: int):
+        """Adds a closed nested block spanning text[start:end] to the current option."""
+        self.nodes.append(text[self.literal_start:start])
+        self.nodes.append(choice)
+        self.literal_start = end
+        self.raw.append(text[self.raw_start:start])
+        self.raw.append(choice)
+        self.raw_start = end
+
+def _merge_literals(parts: List[Node]) -> Tuple[Node, ...]:
+    """Joins adjacent literal parts and drops empty ones."""
+    nodes: List[Node] = []
+    literals: List[str] = []
+    for part in parts:
+        if isinstance(part, str):
+            literals.append(part)
+        else:
+            if literals:
+                nodes.append("".join(literals))
+                literals = []
+            nodes.append(part)
+    if literals:
+        nodes.append("".join(literals))
+    return tuple(node for node in nodes if node != "")
+
+def _parse_template(text: str) -> Tuple[Node, ...]:
+    """
+    Parses a template into a tuple of literal strings and Choice nodes.
 
-def evaluate_dynamic_prompt(text: str) -> str:
+    Single pass with an explicit stack of open blocks, so the time is linear in the
+    text length and deep nesting can't exhaust the recursion limit. A '{' that is never
+    closed stays literal (blocks closed inside it are kept); it is not rescanned.
+    """
+    top = _OpenBlock(-1)
+    top.literal_start = 0
+    stack: List[_OpenBlock] = [] # Open blocks, innermost last
+    pos = 0
+    while True:
+        if stack:
+            match = SPECIAL_CHAR_PATTERN.search(text, pos)
+            if match is None:
+                break
+            pos = match.start()
+        else:
+            pos = text.find("{", pos) # '|' and '}' are plain text outside blocks
+            if pos == -1:
+                break
+        char = text[pos]
+        if char == "{":
+            block = _OpenBlock(pos)
+            stack.append(block)
+            pos = block.begin_option(text, pos + 1)
+        elif char == "|":
+            stack[-1].end_option(text, pos)
+            pos = stack[-1].begin_option(text, pos + 1)
+        else: # '}'
+            block = stack.pop()
+            block.end_option(text, pos)
+            pos += 1
+            if block.options:
+                (stack[-1] if stack else top).add_choice(text, Choice(block.options), block.start, pos)
+            # {} or {||}: no options; its text simply stays part of the enclosing literal
+
+    parts = top.nodes
+    parts.append(text[top.literal_start:stack[0].start if stack else len(text)])
+    # Unclosed blocks are kept as written, from the outermost '{' to the end
+    for index, block in enumerate(stack):
+        parts.extend(block.raw)
+        parts.append(text[block.raw_start:stack[index + 1].start if index + 1 < len(stack) else len(text)])
+    return _merge_literals(parts)
+
+_parse_template_cached = lru_cache(maxsize=256)(_parse_template)
+
+def compile_dynamic_prompt(text: str) -> Tuple[Node, ...]:
+    """
+    Parses a template into a tuple of literal strings and Choice nodes.
+    Short templates are cached, so each is parsed only once; texts longer than
+    MAX_CACHED_TEMPLATE_CHARS are parsed on every call (linear time).
+    """
+    if len(text) > MAX_CACHED_TEMPLATE_CHARS:
+        return _parse_template(text)
+    return _parse_template_cached(text)
+
+def _render(nodes, rng: random.Random, output: List[str]):
+    # Iterative, so deeply nested blocks can't exhaust the recursion limit
+    stack = [iter(nodes)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, str):
+                output.append(node)
+            else:
+                if node.uniform:
+                    option = rng.choice(node.options)
+                else:
+                    option = rng.choices(node.options, weights=node.weights)[0]
+                stack.append(iter(option))
+                break
+        else:
+            stack.pop()
+
+# RNG used when no rng is passed; reseed with set_dynamic_prompt_seed() for reproducible runs
+_default_rng = random.Random()
+
+def set_dynamic_prompt_seed(seed: Optional[int]):
+    """Reseeds the default RNG. None (or a negative seed) uses a random seed."""
+    _default_rng.seed(seed if seed is not None and seed >= 0 else None)
+
+def evaluate_dynamic_prompt(text: str, rng: Optional[random.Random] = None) -> str:
     """
     Evaluates a string containing dynamic prompt syntax like {option1|option2|"option 3"},
-    replacing each occurrence with a randomly chosen option.
+    replacing each block with a randomly chosen option. Nested blocks and weights
+    ({2::A|B}) are supported.
 
     Args:
         text: The input string containing potential dynamic prompts. Can be None.
+        rng: Optional random.Random instance (e.g. random.Random(seed)) for reproducible results.
 
     Returns:
         The string with dynamic prompts evaluated, or the original text if input is None or invalid.
@@ -37,30 +223,125 @@ def evaluate_dynamic_prompt(text: str) -> str:
     # Handle None input gracefully
     if text is None:
         return "" # Or return None, depending on desired behavior for None input
+    # Fast path: a single C-level scan, so large texts without braces cost next to nothing
     if not isinstance(text, str) or '{' not in text:
         return text # Return early if not string or no dynamic prompts seem present
 
-    # Use a function for re.sub to handle each match
-    def replace_match(match):
-        options_str = match.group(1) # Content inside {}
-        options = _parse_options(options_str)
-        if not options:
-            # If parsing fails or yields no options, return the original match {content}
-            return match.group(0)
-        # Choose a random option
-        chosen_option = random.choice(options)
-
-        # Strip outer quotes (double or single) from the chosen option before returning
-        if len(chosen_option) >= 2:
-            if (chosen_option.startswith('"') and chosen_option.endswith('"')) or \
-               (chosen_option.startswith("'") and chosen_option.endswith("'")):
-                return chosen_option[1:-1] # Return content without quotes
-        # If not quoted or too short to be quoted, return as is
-        return chosen_option
-
-    # Replace all occurrences
-    evaluated_text = DYNAMIC_PROMPT_PATTERN.sub(replace_match, text)
-    return evaluated_text
+    nodes = compile_dynamic_prompt(text)
+    output: List[str] = []
+    _render(nodes, rng or _default_rng, output)
+    return "".join(output)
+
+# --- Combinatorial expansion (batch sweeps) ---
+
+def _alternatives(nodes) -> List[Tuple[str, float]]:
+    """
+    All renderings of a node sequence with their probability under random evaluation.
+    Identical renderings (e.g. {A|A}) are merged.
+    """
+    results = {"": 1.0}
+    for node in nodes:
+        if isinstance(node, str):
+            part = [(node, 1.0)]
+        else:
+            total = sum(node.weights)
+            part = []
+            for weight, option in zip(node.weights, node.options):
+                part.extend((text, weight / total * probability) for text, probability in _alternatives(option))
+        combined: dict = {}
+        for prefix, prefix_probability in results.items():
+            for text, probability in part:
+                key = prefix + text
+                combined[key] = combined.get(key, 0.0) + prefix_probability * probability
+        results = combined
+    return list(results.items())
+
+class PromptVariantSpace:
+    """
+    All variants of a list of templates, i.e. the cartesian product of every {..}
+    block in every template. Each top-level block (with its nested blocks flattened)
+    is one dimension; literal text is a dimension with a single value.
+
+    variants() enumerates the product lazily, stratified_sample() draws a sample
+    in which every option appears in proportion to its weight.
+    """
+    def __init__(self, templates: List[Optional[str]]):
+        """
+        Args:
+            templates: Template strings; None and non-strings are treated as "".
+        """
+        self.templates = [text if isinstance(text, str) else "" for text in templates]
+        self._dimensions: List[List[Tuple[str, float]]] = []
+        self._bounds: List[Tuple[int, int]] = [] # Slice of _dimensions per template
+        for text in self.templates:
+            start = len(self._dimensions)
+            nodes = compile_dynamic_prompt(text) if '{' in text else ((text,) if text else ())
+            for node in nodes:
+                self._dimensions.append(_alternatives([node]))
+            self._bounds.append((start, len(self._dimensions)))
+
+    @property
+    def size(self) -> int:
+        """Number of variants (product of the dimension sizes)."""
+        size = 1
+        for alternatives in self._dimensions:
+            size *= len(alternatives)
+        return size
+
+    def _assemble(self, indices: Tuple[int, ...]) -> List[str]:
+        return ["".join(self._dimensions[d][indices[d]][0] for d in range(start, end)) for start, end in self._bounds]
+
+    def variant(self, index: int) -> List[str]:
+        """Returns the variant with the given index (0 <= index < size), one string per template."""
+        indices = []
+        for alternatives in reversed(self._dimensions):
+            index, digit = divmod(index, len(alternatives))
+            indices.append(digit)
+        return self._assemble(tuple(reversed(indices)))
+
+    def variants(self, limit: Optional[int] = None) -> Iterator[List[str]]:
+        """Yields all variants (at most 'limit') in index order."""
+        product = itertools.product(*(range(len(alternatives)) for alternatives in self._dimensions))
+        for indices in itertools.islice(product, limit):
+            yield self._assemble(indices)
+
+    def stratified_sample(self, count: int, rng: Optional[random.Random] = None) -> List[List[str]]:
+        """
+        Draws 'count' distinct variants. Each dimension is stratified on its own (Latin
+        hypercube style): its options are allocated to the samples in proportion to
+        their weights and shuffled, so every option is covered before any repeats.
+        Returns all variants if 'count' is at least the size of the space.
+        """
+        if count >= self.size:
+            return list(self.variants())
+        rng = rng or _default_rng
+        columns = []
+        for alternatives in self._dimensions:
+            quotas = [probability * count for _, probability in alternatives]
+            counts = [int(quota) for quota in quotas]
+            # Largest remainder, so that the column has exactly 'count' entries
+            by_remainder = sorted(range(len(quotas)), key=lambda i: quotas[i] - counts[i], reverse=True)
+            for i in by_remainder[:count - sum(counts)]:
+                counts[i] += 1
+            column = [i for i, n in enumerate(counts) for _ in range(n)]
+            rng.shuffle(column)
+            columns.append(column)
+        seen = set()
+        samples = []
+        for indices in zip(*columns) if columns else [()]:
+            if indices not in seen:
+                seen.add(indices)
+                samples.append(indices)
+        # Combinations drawn twice are replaced by weighted random ones
+        attempts = 0
+        while len(samples) < count and attempts < count * 20:
+            attempts += 1
+            indices = tuple(rng.choices(range(len(alternatives)), weights=[p for _, p in alternatives])[0]
+                            for alternatives in self._dimensions)
+            if indices not in seen:
+                seen.add(indices)
+                samples.append(indices)
+        return [self._assemble(indices) for indices in samples]
 
 # --- Example Usage ---
 if __name__ == "__main__":
@@ -74,7 +355,10 @@ if __name__ == "__main__":
         "Single option: {lonely}",
         "Single quoted: {\"quoted lonely\"}",
         "Single single-quoted: {'single quoted lonely'}",
-        "Nested (not supported): {A|{B|C}}", # Regex won't handle nesting correctly
+        "Nested: {A|{B|C}}",
+        "Weighted: {9::often|rarely}",
+        "Quoted pipe: {\"a|b\"|c}",
+        "Unclosed: {A|B",
         "Adjacent: {one|two}{three|four}",
         "Text with {dynamic|random} elements and {fixed|static} parts.",
         "Path: C:/Users/{UserA|UserB}/Documents",
@@ -87,15 +371,22 @@ if __name__ == "__main__":
         "{A| B | C }", # Spaces around pipes
         "{\"A B\"|\"C D\"}", # Only quoted options
         "{'E F'|'G H'}", # Only single-quoted options
+        "{" * 18 + "abc", # Run of unclosed braces (must stay fast)
+        "{" * 1000 + "a}", # Long run; only the last brace is closed
+        "{" * 1000 + "a" + "}" * 1000, # Deep nesting
+        "Inner empty: {x{}|y}",
     ]
 
+    def shorten(value) -> str:
+        return repr(value) if len(repr(value)) < 80 else repr(value[:60]) + f"... ({len(value)} chars)"
+
     print("--- Running Test Cases ---")
     for i, case in enumerate(test_cases):
         print(f"\n--- Case {i+1} ---")
-        print(f"Input:  {repr(case)}") # Use repr to show None/int clearly
+        print(f"Input:  {shorten(case)}") # Use repr to show None/int clearly
         try:
             output = evaluate_dynamic_prompt(case)
-            print(f"Output: {repr(output)}")
+            print(f"Output: {shorten(output)}")
         except Exception as e:
             print(f"Error: {e}")
         print("-" * 10)
@@ -110,3 +401,16 @@ if __name__ == "__main__":
     print(f"Outputs (20 runs, should contain multiple from 1-5):")
     for res in sorted(list(results)):
         print(f"- {res}")
+
+    # Test seeding
+    print("\n--- Seed Test ---")
+    runs = [[evaluate_dynamic_prompt(test_random, random.Random(42)) for _ in range(3)] for _ in range(2)]
+    print(f"Same seed gives same results: {runs[0] == runs[1]} {runs[0]}")
+
+    # Test combinatorial expansion
+    print("\n--- Expansion Test ---")
+    space = PromptVariantSpace(["{3::sea|mountain} story", "{A|{B|C}}", "fixed"])
+    print(f"Variants: {space.size}")
+    for variant in space.variants():
+        print(f"- {variant}")
+    print(f"Stratified sample of 3: {space.stratified_sample(3, random.Random(0))}")
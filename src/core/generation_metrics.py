@@ -0,0 +1,240 @@
+import time
+import statistics
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# Stop reasons recorded in GenerationMetrics.stop_reason
+STOP_REASON_STOP = "stop" # Stop sequence or end of text
+STOP_REASON_LENGTH = "length" # max_length reached
+STOP_REASON_SECTION = "section_complete" # IDEA safe mode stopped the stream early
+STOP_REASON_DUPLICATE = "duplicate" # Aborted as a near-duplicate of an earlier block
+STOP_REASON_REPETITION = "repetition" # Cut by the client's repetition guard (degenerate loop)
+STOP_REASON_CANCELLED = "cancelled"
+STOP_REASON_ERROR = "error"
+
+class GenerationMetrics:
+    """
+    Timings of one generation request, from prompt building to the last token.
+
+    All times are time.perf_counter() values; the *_ms properties are relative to the
+    start of the request. 'tokens' counts streamed chunks (one token per chunk for
+    KoboldCpp and OpenAI-compatible servers).
+    """
+    def __init__(self, label: str, prompt: str, prompt_build_s: float = 0.0,
+                 max_length: Optional[int] = None, chars_per_token: float = 2.0):
+        """
+        Args:
+            label: Short name of the task (shown in logs), e.g. "単発生成".
+            prompt: The prompt sent to the backend.
+            prompt_build_s: Seconds spent building the prompt.
+            max_length: Requested max_length, used to tell 'length' from 'stop'.
+            chars_per_token: Characters per token for the prompt token estimate.
+        """
+        self.label = label
+        self.prompt_chars = len(prompt)
+        self.prompt_tokens = int(len(prompt) / chars_per_token) if chars_per_token > 0 else 0
+        self.prompt_build_ms = prompt_build_s * 1000
+        self.max_length = max_length
+        self.started = time.perf_counter()
+        self.connected: Optional[float] = None # Response headers received
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.tokens = 0
+        self.output_chars = 0
+        self.ui_ms = 0.0 # Time spent rendering this request's output (set by the caller)
+        self.backend_stop_reason: Optional[str] = None # finish_reason reported by the server
+        self.stop_reason: Optional[str] = None
+        self.cancelled = False
+        self.error: Optional[str] = None
+
+    def mark_connected(self):
+        if self.connected is None:
+            self.connected = time.perf_counter()
+
+    def mark_token(self, text: str):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        self.last_token = now
+        self.tokens += 1
+        self.output_chars += len(text)
+
+    def finish(self, stop_reason: Optional[str] = None, cancelled: bool = False, error: Optional[str] = None):
+        """
+        Ends the measurement. Without an explicit stop_reason, the reason reported by the
+        backend is used, or 'length'/'stop' inferred from the token count.
+        """
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        self.cancelled = cancelled
+        self.error = error
+        if cancelled:
+            self.stop_reason = STOP_REASON_CANCELLED
+        elif error is not None:
+            self.stop_reason = STOP_REASON_ERROR
+        elif stop_reason:
+            self.stop_reason = stop_reason
+        elif self.backend_stop_reason:
+            self.stop_reason = self.backend_stop_reason
+        elif self.max_length and self.tokens >= self.max_length:
+            self.stop_reason = STOP_REASON_LENGTH
+        else:
+            self.stop_reason = STOP_REASON_STOP
+
+    def _since_start_ms(self, timestamp: Optional[float]) -> Optional[float]:
+        return (timestamp - self.started) * 1000 if timestamp is not None else None
+
+    @property
+    def connect_ms(self) -> Optional[float]:
+        return self._since_start_ms(self.connected)
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        return self._since_start_ms(self.first_token)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    @property
+    def tokens_per_s(self) -> Optional[float]:
+        """Generation speed after the first token (excludes prompt processing)."""
+        if self.tokens < 2 or self.first_token is None:
+            return None
+        end = self.last_token if self.finished is not None else time.perf_counter()
+        elapsed = end - self.first_token
+        return (self.tokens - 1) / elapsed if elapsed > 0 else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "prompt_build_ms": self.prompt_build_ms,
+            "prompt_chars": self.prompt_chars,
+            "prompt_tokens": self.prompt_tokens,
+            "connect_ms": self.connect_ms,
+            "ttft_ms": self.ttft_ms,
+            "tokens": self.tokens,
+            "tokens_per_s": self.tokens_per_s,
+            "duration_ms": self.duration_ms,
+            "ui_ms": self.ui_ms,
+            "stop_reason": self.stop_reason,
+            "cancelled": self.cancelled,
+            "error": self.error,
+        }
+
+    def format_log(self) -> str:
+        """One-line summary for the console log."""
+        def ms(value: Optional[float]) -> str:
+            return f"{value:.0f}ms" if value is not None else "-"
+        rate = self.tokens_per_s
+        return (f"[metrics] {self.label}: build={self.prompt_build_ms:.1f}ms "
+                f"prompt={self.prompt_chars}chars/~{self.prompt_tokens}tok connect={ms(self.connect_ms)} "
+                f"ttft={ms(self.ttft_ms)} tokens={self.tokens} "
+                f"rate={f'{rate:.1f}tok/s' if rate else '-'} total={self.duration_ms:.0f}ms "
+                f"ui={self.ui_ms:.1f}ms stop={self.stop_reason}")
+
+
+class SessionMetrics:
+    """Rolling summary of the finished requests of this session."""
+    def __init__(self, window: int = 50):
+        """
+        Args:
+            window: Number of most recent requests used for the averages.
+        """
+        self.recent: Deque[GenerationMetrics] = deque(maxlen=window)
+        self.requests = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.total_tokens = 0
+
+    def add(self, metrics: GenerationMetrics):
+        self.recent.append(metrics)
+        self.requests += 1
+        self.cancelled += int(metrics.cancelled)
+        self.errors += int(metrics.error is not None)
+        self.total_tokens += metrics.tokens
+
+    @staticmethod
+    def _median(values: List[Optional[float]]) -> Optional[float]:
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals and medians over the recent window (None where nothing was measured)."""
+        recent = list(self.recent)
+        return {
+            "requests": self.requests,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "total_tokens": self.total_tokens,
+            "window": len(recent),
+            "prompt_build_ms": self._median([m.prompt_build_ms for m in recent]),
+            "connect_ms": self._median([m.connect_ms for m in recent]),
+            "ttft_ms": self._median([m.ttft_ms for m in recent]),
+            "tokens_per_s": self._median([m.tokens_per_s for m in recent]),
+            "duration_ms": self._median([m.duration_ms for m in recent]),
+            "ui_ms": self._median([m.ui_ms for m in recent]),
+        }
+
+    def format_summary(self) -> str:
+        """Multi-line summary (used as status bar tooltip and in the exit log)."""
+        summary = self.summary()
+        def value(key: str, unit: str, digits: int = 0) -> str:
+            number = summary[key]
+            return f"{number:.{digits}f}{unit}" if number is not None else "-"
+        return "\n".join([
+            f"セッション: {summary['requests']} リクエスト (キャンセル {summary['cancelled']}, エラー {summary['errors']}), "
+            f"合計 {summary['total_tokens']} トークン",
+            f"直近 {summary['window']} 件の中央値:",
+            f"  プロンプト構築 {value('prompt_build_ms', 'ms', 1)} / 接続 {value('connect_ms', 'ms')} / "
+            f"TTFT {value('ttft_ms', 'ms')}",
+            f"  生成速度 {value('tokens_per_s', ' tok/s', 1)} / 所要時間 {value('duration_ms', 'ms')} / "
+            f"描画 {value('ui_ms', 'ms', 1)}",
+        ])
+
+
+# Metrics of the request the current task is streaming. Set by the caller around
+# generate_stream() so that clients can record backend-side events without changing
+# the LLMClient interface; each asyncio task has its own value.
+_current_metrics: ContextVar[Optional[GenerationMetrics]] = ContextVar("current_generation_metrics", default=None)
+
+@contextmanager
+def track_generation(metrics: GenerationMetrics) -> Iterator[GenerationMetrics]:
+    """Makes 'metrics' the current request's metrics within the block."""
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+def record_connected():
+    """Called by clients when the response headers of a streaming request arrived."""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.mark_connected()
+
+def record_finish_reason(reason: Optional[str]):
+    """Called by clients with the finish_reason reported by the server."""
+    metrics = _current_metrics.get()
+    if metrics is not None and reason:
+        metrics.backend_stop_reason = reason
+
+
+if __name__ == "__main__":
+    session = SessionMetrics()
+    for i in range(3):
+        metrics = GenerationMetrics("example", "プロンプト" * 100, prompt_build_s=0.002, max_length=5)
+        with track_generation(metrics):
+            time.sleep(0.05)
+            record_connected()
+            for token in ["a", "b", "c", "d", "e"]:
+                time.sleep(0.01)
+                metrics.mark_token(token)
+        metrics.finish(cancelled=(i == 2))
+        print(metrics.format_log())
+        session.add(metrics)
+    print(session.format_summary())
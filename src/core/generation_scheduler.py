@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import itertools
+from typing import Any, Awaitable, Callable, List, Optional
+
+# Job priorities (lower runs first)
+PRIORITY_USER = 0 # Started by the user (single generation); preempts the others
+PRIORITY_BACKGROUND = 10 # Infinite generation
+PRIORITY_PREFETCH = 20 # Candidates generated ahead
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+class GenerationSchedulerError(Exception):
+    """Custom exception for GenerationScheduler errors."""
+    pass
+
+class GenerationJob:
+    """
+    One unit of work for the backend, usually one generation request.
+    Created by GenerationScheduler.submit(); await wait() for the result.
+    """
+    def __init__(self, run: Callable[[], Awaitable[Any]], priority: int, group: str, label: str,
+                 preemptible: bool, sequence: int):
+        self.run = run
+        self.priority = priority
+        self.group = group
+        self.label = label
+        self.preemptible = preemptible
+        self.sequence = sequence # Submission order, breaks priority ties (FIFO)
+        self.state = JOB_QUEUED
+        self.preempted = False # Cancelled to make room for a higher-priority job
+        self.task: Optional[asyncio.Task] = None
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._scheduler: Optional["GenerationScheduler"] = None
+
+    def __lt__(self, other: "GenerationJob") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def __repr__(self) -> str:
+        return f"GenerationJob({self.label or self.group!r}, priority={self.priority}, state={self.state})"
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self):
+        """Cancels the job; a queued job is dropped, a running job's task is cancelled."""
+        if self._scheduler is not None:
+            self._scheduler._cancel_job(self)
+
+    def add_done_callback(self, callback: Callable[["GenerationJob"], None]):
+        self._future.add_done_callback(lambda _: callback(self))
+
+    async def wait(self) -> Any:
+        """
+        Waits for the job and returns the result of its coroutine.
+
+        Raises:
+            asyncio.CancelledError: If the job was cancelled or preempted (see 'preempted').
+            Exception: The exception raised by the job.
+        """
+        return await asyncio.shield(self._future)
+
+
+class GenerationScheduler:
+    """
+    Runs generation jobs with priorities, a concurrency limit and cancellation.
+
+    Jobs wait in a priority queue until one of 'max_concurrency' slots is free. When a
+    job is submitted and all slots are taken by preemptible jobs of lower priority
+    (higher number), the lowest-priority of them, the newest first, is cancelled and
+    marked as preempted, so user requests never wait behind background work. Owners of
+    preempted jobs decide whether to resubmit them.
+
+    Listeners registered with subscribe() are called with the scheduler whenever a job
+    is queued, started or finished (e.g. to update the UI).
+    """
+    def __init__(self, max_concurrency: int = 1):
+        """
+        Args:
+            max_concurrency: Number of jobs allowed to run at the same time (at least 1).
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._queue: List[GenerationJob] = [] # Heap ordered by (priority, sequence)
+        self._running: List[GenerationJob] = []
+        self._sequence = itertools.count()
+        self._listeners: List[Callable[["GenerationScheduler"], None]] = []
+        self._closed = False
+
+    # --- Listeners ---
+    def subscribe(self, listener: Callable[["GenerationScheduler"], None]):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[["GenerationScheduler"], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self):
+        for listener in list(self._listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"Error in scheduler listener: {e}")
+
+    # --- Queries ---
+    def has_jobs(self, group: Optional[str] = None) -> bool:
+        """True if any job (of 'group', if given) is queued or running."""
+        return any(group is None or job.group == group for job in self._running + self._queue)
+
+    def jobs(self, group: Optional[str] = None) -> List[GenerationJob]:
+        """Running jobs first, then queued jobs in run order."""
+        return [job for job in self._running + sorted(self._queue) if group is None or job.group == group]
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    @property
+    def queued_count(self) -> int:
+        return len(self._queue)
+
+    # --- Submitting and cancelling ---
+    def set_max_concurrency(self, max_concurrency: int):
+        """Changes the limit. Lowering it lets running jobs finish; raising it starts queued jobs."""
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._dispatch()
+
+    def submit(self, run: Callable[[], Awaitable[Any]], priority: int = PRIORITY_BACKGROUND,
+               group: str = "", label: str = "", preemptible: Optional[bool] = None) -> GenerationJob:
+        """
+        Queues a job.
+
+        Args:
+            run: Coroutine function called (without arguments) when the job starts.
+            priority: PRIORITY_USER, PRIORITY_BACKGROUND, PRIORITY_PREFETCH or any int.
+            group: Name used by cancel_group() and has_jobs(), e.g. "single" or "infinite".
+            label: Name for logs.
+            preemptible: Whether higher-priority jobs may cancel this job.
+                Defaults to True for everything below PRIORITY_USER.
+
+        Returns:
+            GenerationJob: The queued job.
+
+        Raises:
+            GenerationSchedulerError: If the scheduler was closed.
+        """
+        if self._closed:
+            raise GenerationSchedulerError("GenerationScheduler is closed.")
+        if preemptible is None:
+            preemptible = priority > PRIORITY_USER
+        job = GenerationJob(run, priority, group, label, preemptible, next(self._sequence))
+        job._scheduler = self
+        heapq.heappush(self._queue, job)
+        if len(self._running) >= self.max_concurrency:
+            self._preempt_for(job)
+        self._dispatch()
+        self._notify()
+        return job
+
+    def set_priority(self, job: GenerationJob, priority: int):
+        """Changes the priority of a queued or running job (e.g. a prefetched candidate that became visible)."""
+        job.priority = priority
+        job.preemptible = job.preemptible and priority > PRIORITY_USER
+        if job.state == JOB_QUEUED:
+            heapq.heapify(self._queue)
+            if len(self._running) >= self.max_concurrency:
+                self._preempt_for(job)
+            self._dispatch()
+
+    def _preempt_for(self, job: GenerationJob):
+        """Cancels the least important running job if it ranks below 'job'."""
+        candidates = [running for running in self._running
+                      if running.preemptible and running.priority > job.priority and not running.preempted]
+        if not candidates:
+            return
+        victim = max(candidates, key=lambda running: (running.priority, running.sequence))
+        print(f"Scheduler: preempting {victim} for {job}")
+        victim.preempted = True
+        victim.task.cancel()
+
+    def _cancel_job(self, job: GenerationJob):
+        if job.state == JOB_QUEUED:
+            self._queue.remove(job)
+            heapq.heapify(self._queue)
+            job.state = JOB_CANCELLED
+            job._future.cancel()
+            self._notify()
+        elif job.state == JOB_RUNNING and job.task is not None:
+            job.task.cancel()
+
+    def cancel_group(self, group: str) -> int:
+        """Cancels all queued and running jobs of a group. Returns the number of jobs."""
+        jobs = self.jobs(group)
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def cancel_all(self) -> int:
+        jobs = self.jobs()
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    # --- Running ---
+    def _dispatch(self):
+        """Starts queued jobs while slots are free."""
+        while self._queue and len(self._running) < self.max_concurrency:
+            job = heapq.heappop(self._queue)
+            job.state = JOB_RUNNING
+            self._running.append(job)
+            job.task = asyncio.ensure_future(self._run_job(job))
+
+    async def _run_job(self, job: GenerationJob):
+        try:
+            result = await job.run()
+        except asyncio.CancelledError:
+            job.state = JOB_CANCELLED
+            if not job._future.done():
+                job._future.cancel()
+        except Exception as e:
+            job.state = JOB_FAILED
+            if not job._future.done():
+                job._future.set_exception(e)
+        else:
+            job.state = JOB_DONE
+            if not job._future.done():
+                job._future.set_result(result)
+        finally:
+            if job in self._running:
+                self._running.remove(job)
+            if not self._closed:
+                self._dispatch()
+            self._notify()
+
+    async def close(self):
+        """Cancels all jobs and waits for the running ones to finish."""
+        self._closed = True
+        running = [job.task for job in self._running if job.task is not None]
+        self.cancel_all()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+# Example Usage (for testing)
+async def main():
+    scheduler = GenerationScheduler(max_concurrency=2)
+    scheduler.subscribe(lambda s: print(f"  running={s.running_count} queued={s.queued_count}"))
+
+    async def fake_generation(name: str, seconds: float) -> str:
+        await asyncio.sleep(seconds)
+        return f"{name} finished"
+
+    background = [scheduler.submit(lambda i=i: fake_generation(f"background {i}", 0.2), PRIORITY_BACKGROUND,
+                                   group="infinite", label=f"background {i}") for i in range(2)]
+    prefetch = scheduler.submit(lambda: fake_generation("prefetch", 0.2), PRIORITY_PREFETCH, group="infinite", label="prefetch")
+    await asyncio.sleep(0.05)
+    user = scheduler.submit(lambda: fake_generation("user", 0.1), PRIORITY_USER, group="single", label="user")
+
+    for job in background + [prefetch, user]:
+        try:
+            print(f"{job.label}: {await job.wait()}")
+        except asyncio.CancelledError:
+            print(f"{job.label}: cancelled (preempted={job.preempted})")
+    await scheduler.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+import asyncio
+import httpx
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple
+
+from src.core.settings import load_settings, DEFAULT_SETTINGS
+
+# HTTP/2 support is optional (requires the 'h2' package, e.g. `pip install httpx[http2]`)
+try:
+    import h2  # noqa: F401
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+_h2_warning_shown = False # The missing-'h2' warning is printed only once
+
+PoolConfig = Tuple[int, int, float, bool]
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports when it is closed (read to the end or abandoned)."""
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class _TrackedTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps a connection pool and counts its in-flight requests; a request counts
+    until its response body is closed, so running streams are included.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport, on_idle: Callable[[], None]):
+        self._transport = transport
+        self._on_idle = on_idle
+        self.in_flight = 0
+
+    def _request_done(self):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._on_idle()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._request_done()
+            raise
+        response.stream = _TrackedStream(response.stream, self._request_done)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class HttpTransport:
+    """
+    Process-wide HTTP transport shared by all LLM clients.
+
+    Keeps one pooled httpx.AsyncClient per protocol (HTTP/1.1 and, if enabled, HTTP/2)
+    so that keep-alive connections stay warm across requests, parallel streams and
+    client re-creation. Clients register with acquire()/release(); the pools are
+    closed when the last client releases the transport.
+
+    When the pool settings change, the replaced client is retired: it stays open
+    until its in-flight requests and streams have finished, then it is closed.
+    """
+    def __init__(self):
+        self._clients: Dict[bool, Tuple[PoolConfig, httpx.AsyncClient]] = {}
+        self._trackers: Dict[httpx.AsyncClient, _TrackedTransport] = {}
+        self._retired_clients: List[httpx.AsyncClient] = []
+        self._closing: Set[asyncio.Task] = set() # Keeps close tasks of retired clients alive
+        self._users = 0
+
+    def _pool_config(self, settings: Dict[str, Any], http2: bool) -> PoolConfig:
+        """Reads the pool configuration from settings."""
+        return (
+            int(settings.get("http_max_connections", DEFAULT_SETTINGS["http_max_connections"])),
+            int(settings.get("http_max_keepalive_connections", DEFAULT_SETTINGS["http_max_keepalive_connections"])),
+            float(settings.get("http_keepalive_expiry", DEFAULT_SETTINGS["http_keepalive_expiry"])),
+            http2,
+        )
+
+    def get_client(self, http2: bool = False, settings: Optional[Dict[str, Any]] = None) -> httpx.AsyncClient:
+        """
+        Returns the shared AsyncClient for the requested protocol.
+
+        Args:
+            http2: Whether to negotiate HTTP/2 (falls back to HTTP/1.1 if 'h2' is not installed).
+            settings: Settings dict to read pool sizes from. Loaded from config if None.
+
+        Returns:
+            httpx.AsyncClient: A pooled client. A new one is only created when the pool
+            configuration changes; the previous one is kept open for in-flight streams
+            and closed when they have finished.
+        """
+        if http2 and not HAS_H2:
+            global _h2_warning_shown
+            if not _h2_warning_shown:
+                print("Warning: HTTP/2 requested but 'h2' is not installed (pip install httpx[http2]). Using HTTP/1.1.")
+                _h2_warning_shown = True
+            http2 = False
+        if settings is None:
+            settings = load_settings()
+
+        config = self._pool_config(settings, http2)
+        cached = self._clients.get(http2)
+        if cached is not None:
+            cached_config, cached_client = cached
+            if cached_config == config and not cached_client.is_closed:
+                return cached_client
+            # Pool settings changed: retire the old client without interrupting running streams
+            self._retired_clients.append(cached_client)
+            self._close_idle_retired_clients()
+
+        max_connections, max_keepalive, keepalive_expiry, _ = config
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        tracker = _TrackedTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2), self._close_idle_retired_clients)
+        client = httpx.AsyncClient(timeout=None, transport=tracker) # Allow long-running streams
+        self._clients[http2] = (config, client)
+        self._trackers[client] = tracker
+        print(f"HTTP transport created (http2={http2}, max_connections={max_connections}, keepalive={max_keepalive}).")
+        return client
+
+    def _close_idle_retired_clients(self):
+        """Closes the retired clients that have no requests in flight anymore."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # Closed by aclose() instead
+        for client in list(self._retired_clients):
+            tracker = self._trackers.get(client)
+            if tracker is not None and tracker.in_flight > 0:
+                continue
+            self._retired_clients.remove(client)
+            self._trackers.pop(client, None)
+            if not client.is_closed:
+                task = loop.create_task(client.aclose())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+                print("Retired HTTP client closed.")
+
+    def acquire(self):
+        """Registers a client that uses this transport."""
+        self._users += 1
+
+    async def release(self):
+        """Unregisters a client. Closes all pools when no clients remain."""
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await self.aclose()
+
+    async def aclose(self):
+        """Closes all pooled and retired clients."""
+        clients = [client for _, client in self._clients.values()] + self._retired_clients
+        self._clients.clear()
+        self._trackers.clear()
+        self._retired_clients = []
+        for client in clients:
+            if not client.is_closed:
+                await client.aclose()
+
+
+_shared_transport: Optional[HttpTransport] = None
+
+def get_shared_transport() -> HttpTransport:
+    """Returns the process-wide HttpTransport instance."""
+    global _shared_transport
+    if _shared_transport is None:
+        _shared_transport = HttpTransport()
+    return _shared_transport
@@ -0,0 +1,147 @@
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from src.core.generation_metrics import GenerationMetrics, STOP_REASON_SECTION
+from src.core.idea_processor import IdeaProcessor, IdeaSectionWatcher
+from src.core.idea_schema import IDEA_ITEM_ORDER, IDEA_ITEM_NAMES_JA, format_idea_section, idea_header
+from src.core.llm_client import LLMClient
+from src.core.prompt_builder import build_prompt, common_prefix_length
+
+class IdeaChainError(Exception):
+    """Custom exception for idea chain errors."""
+    pass
+
+def is_filled(value: Any) -> bool:
+    if isinstance(value, list):
+        return any(str(tag).strip() for tag in value)
+    return bool(str(value or "").strip())
+
+
+class IdeaChain:
+    """
+    Fills the empty IDEA items one after another with the fast-suffix method: each step
+    prompts with the items known so far (IdeaProcessor.generate_prompt_suffix()) plus
+    the header of its item, and stops at the next header (determine_stop_sequence()).
+
+    The base prompt is built once, and every step only appends the previous item to the
+    suffix, so each step prompt extends the previous one and the backend can reuse its
+    KV cache for the shared prefix. Chains are independent; run several at once for
+    many complete ideas.
+    """
+    def __init__(self, ui_data: Dict[str, Any]):
+        """
+        Args:
+            ui_data: The UI data as used by build_prompt() ({"metadata", "rating", "authors_note"}).
+                     Filled items are kept; the empty ones are generated in IDEA order.
+        """
+        self.ui_data = ui_data
+        self.metadata: Dict[str, Any] = dict(ui_data.get("metadata", {}) or {})
+        self.items = [key for key in IDEA_ITEM_ORDER if not is_filled(self.metadata.get(key))]
+        # Dynamic prompts are rolled here, once per chain; all steps share this prefix
+        self.base_prompt = build_prompt(current_mode="idea", main_text="", ui_data=ui_data,
+                                        cont_prompt_order="reference_first")
+        self.contents: Dict[str, str] = {} # Generated section text by item key
+        self._previous_prompt = ""
+
+    def step_prompt(self, item_key: str) -> str:
+        """The prompt of the step generating item_key (after the earlier steps have run)."""
+        suffix = IdeaProcessor(self.metadata).generate_prompt_suffix(item_key)
+        return self.base_prompt + suffix + idea_header(item_key) + "\n"
+
+    def stop_sequence(self, item_key: str) -> List[str]:
+        return IdeaProcessor(self.metadata).determine_stop_sequence(item_key) or []
+
+    async def run_step(self, client: LLMClient, item_key: str, max_length: Optional[int] = None,
+                       metrics: Optional[GenerationMetrics] = None) -> AsyncGenerator[str, None]:
+        """
+        Generates one item and yields the text to show: the section header, then the
+        streamed content. A line that may turn into another header is held back until
+        it is complete, so the output stops exactly before the next header.
+
+        Args:
+            metrics: Optional metrics of this request; records tokens and the early stop.
+
+        Raises:
+            IdeaChainError: If nothing was generated for the item (later steps would build on it).
+        """
+        prompt = self.step_prompt(item_key)
+        shared = common_prefix_length(self._previous_prompt, prompt)
+        self._previous_prompt = prompt
+        print(f"Idea chain step '{item_key}': prompt {len(prompt)} chars, {shared} shared with the previous step.")
+
+        header = idea_header(item_key) + "\n"
+        yield ("\n\n" if self.contents else "") + header
+        watcher = IdeaSectionWatcher(item_key)
+        watcher.feed(header) # The section starts in the prompt
+        shown = len(header) # Position in watcher.text up to which text was yielded
+        async with aclosing(client.generate_stream(prompt, max_length=max_length,
+                                                   stop_sequence=self.stop_sequence(item_key))) as stream:
+            async for token in stream:
+                if metrics is not None:
+                    metrics.mark_token(token)
+                if watcher.feed(token):
+                    # Another header started: show the rest of the section only
+                    rest = watcher.text[shown:watcher.sections[0].end].rstrip()
+                    if rest:
+                        yield rest
+                    shown = len(watcher.text)
+                    if metrics is not None:
+                        metrics.finish(STOP_REASON_SECTION)
+                    break
+                shown = max(shown, watcher.sections[0].content_start) # The model repeated the header
+                line_start = watcher.text.rfind("\n") + 1 # The header line always ends before it
+                last_line = watcher.text[line_start:]
+                end = len(watcher.text)
+                if not last_line.strip() or last_line.lstrip(" \t").startswith("#"):
+                    end = line_start # Could still become a header
+                end = len(watcher.text[:end].rstrip()) # Trailing line breaks wait for more content
+                if end > shown:
+                    yield watcher.text[shown:end]
+                    shown = end
+        rest = watcher.text[shown:].rstrip()
+        if rest:
+            yield rest
+
+        record = watcher.record()
+        content = record.content(item_key)
+        if not content:
+            raise IdeaChainError(f"No content was generated for '{IDEA_ITEM_NAMES_JA[item_key]}'.")
+        self.contents[item_key] = content
+        self.metadata[item_key] = record.value(item_key) # Typed, as generate_prompt_suffix() expects
+
+    async def run(self, client: LLMClient, max_length: Optional[int] = None) -> str:
+        """Runs all steps without showing them. Returns the complete idea in the IDEA output format."""
+        for item_key in self.items:
+            async for _ in self.run_step(client, item_key, max_length):
+                pass
+        return self.format()
+
+    def format(self) -> str:
+        """The generated sections in the IDEA output format."""
+        return "\n\n".join(format_idea_section(key, content) for key, content in self.contents.items())
+
+
+# Example Usage (for testing): three chains at once against the fake backend
+async def main():
+    from src.core.kobold_client import KoboldClient
+    from src.tools.fake_backend import FakeBackendServer, FakeBackendConfig
+
+    server = FakeBackendServer(port=0, config=FakeBackendConfig(rate=200, ttft=0.05, slots=3))
+    await server.start()
+    client = KoboldClient(base_url=server.base_url)
+    ui_data = {"metadata": {"title": "", "keywords": ["港町"], "genres": [], "synopsis": "", "setting": "", "plot": ""},
+               "rating": "general", "authors_note": ""}
+    try:
+        started = asyncio.get_running_loop().time()
+        ideas = await asyncio.gather(*(IdeaChain(ui_data).run(client, max_length=200) for _ in range(3)))
+        elapsed = asyncio.get_running_loop().time() - started
+        for number, idea in enumerate(ideas, 1):
+            print(f"--- Idea {number} ---\n{idea}")
+        print(f"{len(ideas)} ideas in {elapsed:.2f}s")
+    finally:
+        await client.close()
+        await server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
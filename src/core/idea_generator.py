@@ -1,17 +1,12 @@
 # src/core/idea_generator.py
 from typing import Dict, Optional, List, Tuple, Literal
-import re
-
-# メタデータの順序と日本語名の定義 (prompt_builder.py と共有または一元管理を検討)
-# Note: prompt_builder.py からも参照される可能性があるため、
-#       将来的には settings.py などで一元管理するのが望ましい。
-METADATA_ORDER = ["title", "keywords", "genres", "synopsis", "setting", "plot"]
-METADATA_MAP_JA = {
-    "title": "タイトル", "keywords": "キーワード", "genres": "ジャンル",
-    "synopsis": "あらすじ", "setting": "設定", "plot": "プロット",
-}
-# 逆引きマップも用意
-KEY_MAP_FROM_JA = {v: k for k, v in METADATA_MAP_JA.items()}
+
+from src.core.idea_schema import IDEA_ITEM_ORDER, IDEA_ITEM_NAMES_JA, IDEA_KEYS_FROM_JA, idea_header, parse_idea_output
+
+# メタデータの順序と日本語名の定義は idea_schema.py で一元管理
+METADATA_ORDER = IDEA_ITEM_ORDER
+METADATA_MAP_JA = IDEA_ITEM_NAMES_JA
+KEY_MAP_FROM_JA = IDEA_KEYS_FROM_JA
 
 GenerationMethod = Literal["safe", "fast"]
 
@@ -63,9 +58,8 @@ class IdeaGenerator:
                 return None # 最後の項目なら次はない
 
             next_item_key = METADATA_ORDER[current_index + 1]
-            next_item_ja = METADATA_MAP_JA.get(next_item_key)
             # KoboldCppのStop Sequenceは改行を含む必要がある場合が多い
-            return f"# {next_item_ja}:\n" if next_item_ja else None
+            return idea_header(next_item_key) + "\n"
         except (ValueError, IndexError):
             print(f"Error finding next item header for: {self.selected_item_key}")
             return None
@@ -164,24 +158,9 @@ class IdeaGenerator:
         if self.selected_item_key == "all" or self.selected_item_key not in METADATA_MAP_JA:
             return full_output.strip() # 全選択または不正キーなら全体を返す
 
-        target_ja_name = METADATA_MAP_JA[self.selected_item_key]
-
-        # 抽出ロジック:
-        # 1. ターゲットヘッダーを探す
-        # 2. 次のヘッダーを探す (または文字列終端)
-        # 3. その間の内容を抽出
-
-        # 正規表現でターゲットヘッダーとそれに続く内容を取得
-        # (?s) は DOTALL フラグ、.*? は非貪欲マッチ
-        # (?:^\s*#|\\Z) は次のヘッダーまたは文字列終端（非キャプチャグループ）
-        pattern_str = rf"^\s*#\s*{re.escape(target_ja_name)}\s*:\s*\n(.*?)(?=\s*^\s*#|\Z)"
-        match = re.search(pattern_str, full_output, re.MULTILINE | re.DOTALL | re.IGNORECASE)
-
-        if match:
-            extracted_content = match.group(1).strip()
-            # 元のヘッダーを付けて返す
-            return f"# {target_ja_name}:\n{extracted_content}"
-        else:
-            # マッチしない場合、空文字列を返すか、エラーを示すか
-            print(f"Warning: Could not extract '{target_ja_name}' section from output.")
+        # 一度の走査で全セクションを解析し、ターゲットのセクションをヘッダー付きで返す
+        section = parse_idea_output(full_output).section_text(self.selected_item_key)
+        if section is None:
+            print(f"Warning: Could not extract '{METADATA_MAP_JA[self.selected_item_key]}' section from output.")
             return "" # 空文字列を返す
+        return section
@@ -0,0 +1,211 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.core.idea_schema import IDEA_ITEM_ORDER, IDEA_TAG_ITEMS, IdeaRecord, parse_tags
+from src.core.similarity_filter import normalize_text
+
+# Inputs outside the IDEA items that also shape every section
+CONTEXT_FIELDS = ("rating", "authors_note")
+
+def normalize_field(key: str, value: Any) -> str:
+    """Comparison key of a field value (whitespace and tag order don't matter). "" = empty."""
+    if key in IDEA_TAG_ITEMS:
+        tags = value if isinstance(value, list) else parse_tags(value or "")
+        return "\n".join(sorted(normalize_text(str(tag)) for tag in tags if normalize_text(str(tag))))
+    return normalize_text(str(value or ""))
+
+def input_conditions(ui_data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    The filled inputs of a prompt, normalized: the IDEA items of ui_data["metadata"]
+    plus rating and author's note. Empty fields are left out.
+    """
+    conditions = {}
+    metadata = ui_data.get("metadata", {}) or {}
+    for key in IDEA_ITEM_ORDER:
+        value = normalize_field(key, metadata.get(key))
+        if value:
+            conditions[key] = value
+    for key in CONTEXT_FIELDS:
+        value = normalize_field(key, ui_data.get(key))
+        if value:
+            conditions[key] = value
+    return conditions
+
+
+class IdeaCandidate:
+    """One unshown section, with the fields it was conditioned on."""
+    __slots__ = ("item_key", "content", "conditions")
+
+    def __init__(self, item_key: str, content: str, conditions: Dict[str, str]):
+        self.item_key = item_key
+        self.content = content # Section text without the header
+        self.conditions = conditions # Normalized field values the section was generated after
+
+
+class IdeaCandidatePool:
+    """
+    Sections of IDEA outputs that were generated but not shown (e.g. the title and
+    keywords written before the requested あらすじ in safe mode), kept per project so
+    that a later request for that item can be answered without a generation.
+
+    A candidate is conditioned on the filled inputs of its prompt and on the sections
+    the model wrote before it. It fits a request if every field the user has filled
+    now (except the requested item) has the same value; fields left empty are free,
+    as they are for a generation. Candidates are indexed by (item, field, value), so a
+    lookup intersects a few id sets instead of comparing every candidate.
+    """
+    def __init__(self, max_per_item: int = 100):
+        """
+        Args:
+            max_per_item: Candidates kept per item; the oldest are dropped first (0 = pool disabled).
+        """
+        self.max_per_item = max(0, max_per_item)
+        self._candidates: Dict[str, "OrderedDict[int, IdeaCandidate]"] = {key: OrderedDict() for key in IDEA_ITEM_ORDER}
+        self._index: Dict[Tuple[str, str, str], Set[int]] = {}
+        self._keys: Dict[str, Set[Tuple]] = {key: set() for key in IDEA_ITEM_ORDER} # For exact duplicates
+        self._next_id = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_per_item > 0
+
+    def set_max_per_item(self, max_per_item: int):
+        """Changes the capacity; the oldest candidates beyond it are dropped (all of them for 0)."""
+        self.max_per_item = max(0, max_per_item)
+        for item_key, candidates in self._candidates.items():
+            while len(candidates) > self.max_per_item:
+                self._remove(item_key, next(iter(candidates)))
+
+    def __len__(self) -> int:
+        return sum(len(candidates) for candidates in self._candidates.values())
+
+    @staticmethod
+    def _duplicate_key(candidate: IdeaCandidate) -> Tuple:
+        # The same text generated under other conditions is a separate candidate
+        return (normalize_field(candidate.item_key, candidate.content), tuple(sorted(candidate.conditions.items())))
+
+    def add(self, item_key: str, content: str, conditions: Dict[str, str]) -> bool:
+        """
+        Adds a candidate. Returns False if it is empty, already pooled with the same
+        conditions, or the pool is disabled.
+        """
+        if not self.enabled or item_key not in self._candidates or not normalize_field(item_key, content):
+            return False
+        candidate = IdeaCandidate(item_key, content, dict(conditions))
+        duplicate_key = self._duplicate_key(candidate)
+        if duplicate_key in self._keys[item_key]:
+            return False
+        candidate_id = self._next_id
+        self._next_id += 1
+        self._candidates[item_key][candidate_id] = candidate
+        self._keys[item_key].add(duplicate_key)
+        for field, value in conditions.items():
+            self._index.setdefault((item_key, field, value), set()).add(candidate_id)
+        while len(self._candidates[item_key]) > self.max_per_item:
+            self._remove(item_key, next(iter(self._candidates[item_key])))
+        return True
+
+    def _remove(self, item_key: str, candidate_id: int) -> IdeaCandidate:
+        candidate = self._candidates[item_key].pop(candidate_id)
+        self._keys[item_key].discard(self._duplicate_key(candidate))
+        for field, value in candidate.conditions.items():
+            ids = self._index.get((item_key, field, value))
+            if ids is not None:
+                ids.discard(candidate_id)
+                if not ids:
+                    del self._index[(item_key, field, value)]
+        return candidate
+
+    def harvest(self, record: IdeaRecord, ui_data: Dict[str, Any], exclude: Iterable[str] = ()) -> int:
+        """
+        Adds the sections of a parsed output.
+
+        Args:
+            record: The parsed output.
+            ui_data: The UI data the prompt was built from (see MainWindow._get_metadata_from_ui()).
+            exclude: Items not to keep (the one that was shown).
+
+        Returns:
+            int: Number of candidates added. Items filled in the inputs are skipped (the
+            model only repeats them).
+        """
+        if not self.enabled:
+            return 0
+        inputs = input_conditions(ui_data)
+        conditions = dict(inputs)
+        excluded = set(exclude)
+        added = 0
+        for item_key in record.contents: # In output order
+            if item_key in inputs:
+                continue
+            if item_key not in excluded and self.add(item_key, record.contents[item_key], conditions):
+                added += 1
+            value = normalize_field(item_key, record.value(item_key))
+            if value:
+                conditions[item_key] = value # Later sections were written after this one
+        return added
+
+    def _matching_ids(self, item_key: str, ui_data: Dict[str, Any]) -> Set[int]:
+        required = [(field, value) for field, value in input_conditions(ui_data).items() if field != item_key]
+        if not required:
+            return set(self._candidates[item_key])
+        id_sets = [self._index.get((item_key, field, value), set()) for field, value in required]
+        id_sets.sort(key=len)
+        return id_sets[0].intersection(*id_sets[1:])
+
+    def count(self, item_key: str, ui_data: Dict[str, Any]) -> int:
+        """Number of candidates that fit a request for item_key with the given inputs."""
+        if item_key not in self._candidates:
+            return 0
+        return len(self._matching_ids(item_key, ui_data))
+
+    def take(self, item_key: str, ui_data: Dict[str, Any]) -> Optional[IdeaCandidate]:
+        """Removes and returns the oldest candidate that fits, or None if the pool has none."""
+        if not self.enabled or item_key not in self._candidates:
+            return None
+        ids = self._matching_ids(item_key, ui_data)
+        if not ids:
+            return None
+        return self._remove(item_key, min(ids))
+
+    def clear(self):
+        for item_key in IDEA_ITEM_ORDER:
+            self._candidates[item_key].clear()
+            self._keys[item_key].clear()
+        self._index.clear()
+
+    def to_data(self) -> List[Dict[str, Any]]:
+        """Candidates as JSON-serializable dicts, oldest first (stored in the project file)."""
+        candidates = [(candidate_id, candidate) for item_candidates in self._candidates.values()
+                      for candidate_id, candidate in item_candidates.items()]
+        candidates.sort(key=lambda entry: entry[0])
+        return [{"item": candidate.item_key, "content": candidate.content, "conditions": candidate.conditions}
+                for _, candidate in candidates]
+
+    def load_data(self, data: Optional[List[Dict[str, Any]]]):
+        """Replaces the pool with candidates from to_data(). Malformed entries are skipped."""
+        self.clear()
+        for entry in data or []:
+            if not isinstance(entry, dict) or not isinstance(entry.get("conditions", {}), dict):
+                continue
+            self.add(str(entry.get("item", "")), str(entry.get("content", "")),
+                     {str(field): str(value) for field, value in entry.get("conditions", {}).items()})
+
+
+if __name__ == "__main__":
+    from src.core.idea_schema import parse_idea_output
+
+    pool = IdeaCandidatePool()
+    # Safe-mode request for あらすじ with only the rating set: title/keywords/genres were written first
+    output = ("# タイトル:\n星降る港町\n\n# キーワード:\n港町\n流れ星\n\n# ジャンル:\nファンタジー\n\n"
+              "# あらすじ:\n少年は流れ星を追って旅に出る。\n")
+    inputs = {"metadata": {}, "rating": "general", "authors_note": ""}
+    print(f"Harvested {pool.harvest(parse_idea_output(output), inputs, exclude=['synopsis'])} candidates")
+
+    # Later: the user has adopted the title and asks for keywords
+    later = {"metadata": {"title": "星降る港町"}, "rating": "general", "authors_note": ""}
+    candidate = pool.take("keywords", later)
+    print(f"keywords for '星降る港町': {candidate.content if candidate else None!r}")
+    other = {"metadata": {"title": "別のタイトル"}, "rating": "general", "authors_note": ""}
+    print(f"genres for another title: {pool.count('genres', other)} candidates")
+    print(f"title: {pool.take('title', inputs).content!r}, left: {len(pool)}")
@@ -1,13 +1,38 @@
 from typing import Dict, List, Optional, Tuple, Literal
 
-# 定数を定義 (prompt_builder.py との重複を避けるため、ここで定義)
-METADATA_MAP = {
-    "title": "タイトル", "keywords": "キーワード", "genres": "ジャンル",
-    "synopsis": "あらすじ", "setting": "設定", "plot": "プロット",
-}
-# IDEAモードで考慮する項目の順序
-IDEA_ITEM_ORDER = ["title", "keywords", "genres", "synopsis", "setting", "plot"]
-IDEA_ITEM_ORDER_JA = [METADATA_MAP[key] for key in IDEA_ITEM_ORDER]
+from src.core.idea_schema import (
+    IDEA_ITEM_ORDER, IDEA_ITEM_ORDER_JA, IDEA_ITEM_NAMES_JA,
+    IdeaOutputParser, IdeaRecord, idea_header, parse_idea_output
+)
+
+# Kept under the old name for callers that map keys to Japanese item names
+METADATA_MAP = IDEA_ITEM_NAMES_JA
+
+class IdeaSectionWatcher(IdeaOutputParser):
+    """
+    Parses streamed IDEA output and reports when the selected section is complete,
+    i.e. as soon as a '# 見出し:' header of another item starts after the selected one.
+    The parsed record can be passed to IdeaProcessor.filter_record() without parsing again.
+    """
+
+    def __init__(self, selected_item_key: str):
+        """
+        Args:
+            selected_item_key: The internal key of the item being generated (e.g. 'synopsis').
+        """
+        super().__init__()
+        self.selected_item_key = selected_item_key
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Adds a streamed chunk. Returns True once the selected section is complete.
+        Always False for 'all' or unknown keys (nothing to cut).
+        """
+        closed = super().feed(chunk)
+        if not self.complete and self.selected_item_key in IDEA_ITEM_NAMES_JA:
+            self.complete = any(section.key == self.selected_item_key for section in closed)
+        return self.complete
 
 class IdeaProcessor:
     """
@@ -80,7 +105,7 @@ class IdeaProcessor:
             else:
                 next_item_key = IDEA_ITEM_ORDER[current_index + 1]
                 # Stop sequence should match the exact format AI might generate
-                next_item_header = f"\n# {METADATA_MAP[next_item_key]}:"
+                next_item_header = "\n" + idea_header(next_item_key)
                 return [next_item_header]
         except ValueError:
              print(f"Warning: Invalid key '{selected_item_key}' encountered in determine_stop_sequence.")
@@ -133,7 +158,7 @@ class IdeaProcessor:
     def filter_output(self, full_output: str, selected_item_key: str) -> str:
         """
         Filters the full AI output (safe mode or potentially incomplete fast mode)
-        to extract only the selected item's content.
+        to extract only the selected item's section.
 
         Args:
             full_output: The complete text generated by the AI.
@@ -141,50 +166,20 @@ class IdeaProcessor:
         """
         if selected_item_key == 'all' or selected_item_key not in IDEA_ITEM_ORDER:
             return full_output # Return everything if 'all' or invalid key
+        return self.filter_record(parse_idea_output(full_output), selected_item_key)
+
+    def filter_record(self, record: IdeaRecord, selected_item_key: str) -> str:
+        """
+        Same as filter_output() for output that is already parsed (e.g. by IdeaSectionWatcher).
 
-        selected_name_ja = METADATA_MAP[selected_item_key]
-        start_header = f"# {selected_name_ja}:"
-        # Find the header, allowing for potential leading newline added by AI
-        start_index = full_output.find(start_header)
-        if start_index == -1:
-             # Try finding without leading newline just in case
-             start_header_no_nl = f"# {selected_name_ja}:"
-             start_index = full_output.find(start_header_no_nl)
-             if start_index == -1:
-                  print(f"Filter Warning: Header '{start_header}' not found in output.")
-                  return "" # Selected header not found at all
-
-        # Determine where the content actually starts (after the header and potential newline)
-        content_start_index = start_index + len(start_header)
-        if content_start_index < len(full_output) and full_output[content_start_index] == '\n':
-            content_start_index += 1
-
-        # Find the start of the *next* header to determine the end of the current section
-        end_index = len(full_output) # Default to end of string
-        current_item_order_index = IDEA_ITEM_ORDER.index(selected_item_key)
-
-        for i in range(current_item_order_index + 1, len(IDEA_ITEM_ORDER)):
-            next_key = IDEA_ITEM_ORDER[i]
-            next_name_ja = METADATA_MAP[next_key]
-            # Look for the next header after the start of the current content
-            # Check with and without leading newline for robustness
-            next_header_nl = f"\n# {next_name_ja}:"
-            next_header_no_nl = f"# {next_name_ja}:"
-
-            # Search starting from content_start_index
-            found_next_header_index_nl = full_output.find(next_header_nl, content_start_index)
-            found_next_header_index_no_nl = full_output.find(next_header_no_nl, content_start_index)
-
-            # Find the earliest occurrence of the next header
-            found_next_header_index = -1
-            indices = [idx for idx in [found_next_header_index_nl, found_next_header_index_no_nl] if idx != -1]
-            if indices:
-                found_next_header_index = min(indices)
-
-            if found_next_header_index != -1:
-                end_index = found_next_header_index
-                break # Stop at the first subsequent header found
-
-        # Extract the content including the header itself
-        extracted_content = full_output[start_index:end_index].strip()
-        return extracted_content
+        Returns:
+            str: The selected section as generated, from its header up to the header of the
+            next other item (stripped), or "" if the section was not generated.
+        """
+        if selected_item_key == 'all' or selected_item_key not in IDEA_ITEM_ORDER:
+            return record.text
+        section = record.raw_section_text(selected_item_key)
+        if section is None:
+            print(f"Filter Warning: Header '{idea_header(selected_item_key)}' not found in output.")
+            return ""
+        return section
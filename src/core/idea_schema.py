@@ -0,0 +1,175 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# IDEA output format: one '# 日本語名:' header per item, in this order
+IDEA_ITEM_ORDER = ["title", "keywords", "genres", "synopsis", "setting", "plot"]
+IDEA_ITEM_NAMES_JA = {
+    "title": "タイトル", "keywords": "キーワード", "genres": "ジャンル",
+    "synopsis": "あらすじ", "setting": "設定", "plot": "プロット",
+}
+IDEA_ITEM_ORDER_JA = [IDEA_ITEM_NAMES_JA[key] for key in IDEA_ITEM_ORDER]
+IDEA_KEYS_FROM_JA = {name_ja: key for key, name_ja in IDEA_ITEM_NAMES_JA.items()}
+# Items whose value is a list of tags, one per line
+IDEA_TAG_ITEMS = ("keywords", "genres")
+
+# Matches any IDEA section header line such as "# あらすじ:"; content may follow on the same line
+IDEA_HEADER_PATTERN = re.compile(
+    r"^[ \t]*#[ \t]*(" + "|".join(re.escape(name) for name in IDEA_ITEM_ORDER_JA) + r")[ \t]*:",
+    re.MULTILINE
+)
+
+def idea_header(item_key: str) -> str:
+    """Returns the header as written in prompts and outputs, e.g. '# あらすじ:'."""
+    return f"# {IDEA_ITEM_NAMES_JA[item_key]}:"
+
+def format_idea_section(item_key: str, content: str) -> str:
+    """Formats one section the way the model writes it (header line, then the content)."""
+    return f"{idea_header(item_key)}\n{content}"
+
+def parse_tags(content: str) -> List[str]:
+    """Splits tag section content into tags (one per line, optional '- ' list markers removed)."""
+    tags = []
+    for line in content.splitlines():
+        tag = line.strip().lstrip("-").strip()
+        if tag:
+            tags.append(tag)
+    return tags
+
+
+class IdeaSection:
+    """Position of one section in the parsed text. 'end' is None while the section is still open."""
+    __slots__ = ("key", "header_start", "content_start", "end")
+
+    def __init__(self, key: str, header_start: int, content_start: int):
+        self.key = key
+        self.header_start = header_start
+        self.content_start = content_start
+        self.end: Optional[int] = None
+
+
+class IdeaRecord:
+    """
+    The items found in an IDEA output. Only the first section of each item counts;
+    items without a section are missing (value() returns an empty value).
+    """
+    def __init__(self, text: str, contents: Dict[str, str], spans: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.text = text
+        self.contents = contents # Stripped section text by item key, in output order
+        self.spans = spans or {} # (header start, section end) in text by item key
+
+    def __contains__(self, item_key: str) -> bool:
+        return item_key in self.contents
+
+    def content(self, item_key: str) -> Optional[str]:
+        """Section text as generated (stripped), or None if the section is missing."""
+        return self.contents.get(item_key)
+
+    def value(self, item_key: str) -> str | List[str]:
+        """
+        Typed value of an item as the detail fields hold it: a tag list for keywords and
+        genres, the first line for the title, the text otherwise.
+        """
+        content = self.contents.get(item_key, "")
+        if item_key in IDEA_TAG_ITEMS:
+            return parse_tags(content)
+        if item_key == "title":
+            lines = content.splitlines()
+            return lines[0].strip() if lines else ""
+        return content
+
+    def section_text(self, item_key: str) -> Optional[str]:
+        """The section with a normalized header (see format_idea_section()), or None if missing."""
+        content = self.contents.get(item_key)
+        return format_idea_section(item_key, content) if content is not None else None
+
+    def raw_section_text(self, item_key: str) -> Optional[str]:
+        """The section as the model wrote it, header included (stripped), or None if missing."""
+        span = self.spans.get(item_key)
+        return self.text[span[0]:span[1]].strip() if span is not None else None
+
+    def to_metadata(self) -> Dict[str, str | List[str]]:
+        """Values of all found items, keyed like the 'metadata' dict of the UI data."""
+        return {key: self.value(key) for key in IDEA_ITEM_ORDER if key in self.contents}
+
+
+class IdeaOutputParser:
+    """
+    Incremental single-pass parser for IDEA output. Streamed chunks are appended with
+    feed(); only the last (possibly incomplete) line is scanned again, so headers split
+    across chunks are found and no text is scanned more than once otherwise.
+
+    A header closes the open section only if it names a different item (a repeated
+    header of the same item is part of the section, or restarts it while it is still
+    empty). Text before the first header is ignored.
+    """
+    def __init__(self):
+        self.text = ""
+        self.sections: List[IdeaSection] = [] # In output order
+        self._scan_pos = 0 # Start of the last line; headers before it are final
+        self._last_header_start = -1
+
+    @property
+    def current(self) -> Optional[IdeaSection]:
+        """The open (last) section, or None before the first header."""
+        return self.sections[-1] if self.sections else None
+
+    def feed(self, chunk: str) -> List[IdeaSection]:
+        """
+        Adds a chunk of output.
+
+        Returns:
+            List[IdeaSection]: The sections closed by this chunk (usually none).
+        """
+        self.text += chunk
+        closed = []
+        for match in IDEA_HEADER_PATTERN.finditer(self.text, self._scan_pos):
+            if match.start() <= self._last_header_start:
+                continue # Found again while rescanning the last line
+            self._last_header_start = match.start()
+            key = IDEA_KEYS_FROM_JA[match.group(1)]
+            current = self.current
+            if current is not None:
+                if current.key == key:
+                    if not self.text[current.content_start:match.start()].strip():
+                        current.content_start = match.end() # Header written twice; the content follows the second one
+                    continue
+                current.end = match.start()
+                closed.append(current)
+            self.sections.append(IdeaSection(key, match.start(), match.end()))
+        # Headers can be split across chunks; rescan the last line next time
+        self._scan_pos = self.text.rfind("\n") + 1
+        return closed
+
+    def record(self) -> IdeaRecord:
+        """Builds the record from the text so far (an open last section runs to the end)."""
+        contents: Dict[str, str] = {}
+        spans: Dict[str, Tuple[int, int]] = {}
+        for section in self.sections:
+            if section.key not in contents:
+                end = section.end if section.end is not None else len(self.text)
+                contents[section.key] = self.text[section.content_start:end].strip()
+                spans[section.key] = (section.header_start, end)
+        return IdeaRecord(self.text, contents, spans)
+
+
+def parse_idea_output(text: str) -> IdeaRecord:
+    """Parses a complete IDEA output."""
+    parser = IdeaOutputParser()
+    parser.feed(text)
+    return parser.record()
+
+
+if __name__ == "__main__":
+    output = (
+        "# タイトル: 星降る港町\n\n# キーワード:\n- 港町\n- 流れ星\n\n# ジャンル:\nファンタジー\n\n"
+        "# あらすじ:\n少年は流れ星を追って旅に出る。\n\n# 設定:\n霧の深い港町。\n\n# プロット:\n1. 出会い\n2. 別れ\n"
+    )
+    record = parse_idea_output(output)
+    for key, value in record.to_metadata().items():
+        print(f"{key}: {value!r}")
+    print(record.section_text("synopsis"))
+
+    parser = IdeaOutputParser()
+    for chunk in ["# あら", "すじ:\n少年は", "旅に出る。\n", "# 設", "定:\n霧の"]:
+        for section in parser.feed(chunk):
+            print(f"Section '{section.key}' closed at {section.end}: {parser.text[section.content_start:section.end].strip()!r}")
@@ -1,36 +1,77 @@
 import httpx
 import json
 import asyncio
+import uuid
 from typing import AsyncGenerator, Dict, Any, Optional, List
 
-from src.core.settings import load_settings
+from src.core.settings import load_settings, get_settings_store
+from src.core.http_transport import get_shared_transport
+from src.core.generation_metrics import record_connected, record_finish_reason, STOP_REASON_STOP, STOP_REASON_REPETITION
+from src.core.repetition_detector import create_repetition_detector
+from src.core.stop_matcher import StopSequenceMatcher
 
 class KoboldClientError(Exception):
     """Custom exception for KoboldClient errors."""
-    pass
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code # HTTP status of an API error response, if any
 
 class KoboldClient:
     """
     Asynchronous client for interacting with the KoboldCpp API,
     specifically for streaming generation.
     """
-    def __init__(self):
-        self.client = httpx.AsyncClient(timeout=None) # Allow long-running streams
+    def __init__(self, base_url: Optional[str] = None):
+        """
+        Args:
+            base_url: Optional fixed backend address. If None, 'base_url' from settings is used.
+        """
+        self._base_url_override = base_url # Used by LoadBalancingClient for per-backend clients
         self._current_settings = load_settings() # Load initial settings
+        get_settings_store().subscribe(self._on_settings_changed) # Follow settings changes automatically
+        self._transport = get_shared_transport() # Pooled connections shared with other clients
+        self._transport.acquire()
+        self._pending_aborts: set = set() # Abort requests sent for cancelled streams
+        self._active_streams = 0 # Streams of this client currently running
+        self._needs_idle_check = False # True after an abort until the server reports idle
 
-    def _get_api_url(self) -> str:
-        """Constructs the API URL from settings."""
-        base_url = self._current_settings.get("base_url", "127.0.0.1:5001")
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared, pooled HTTP client (KoboldCpp speaks HTTP/1.1)."""
+        return self._transport.get_client(http2=False, settings=self._current_settings)
+
+    def _get_base_url(self) -> str:
+        """Returns the backend base URL (override or settings) with a scheme prefix."""
+        base_url = self._base_url_override or self._current_settings.get("base_url", "127.0.0.1:5001")
         # Handle URL prefix if not present
         if not base_url.startswith(("http://", "https://")):
             base_url = f"http://{base_url}"
-        return f"{base_url}/api/extra/generate/stream"
+        return base_url.rstrip("/")
+
+    def _get_api_url(self) -> str:
+        """Constructs the API URL from settings."""
+        return f"{self._get_base_url()}/api/extra/generate/stream"
+
+    async def check_health(self) -> bool:
+        """Returns True if the KoboldCpp server answers its model info endpoint."""
+        try:
+            response = await self.client.get(f"{self._get_base_url()}/api/v1/model", timeout=5.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
 
     def reload_settings(self):
-        """Reloads settings from the config file."""
+        """
+        Reloads settings from the config file.
+        A changed base_url takes effect on the next request; pooled connections are kept.
+        """
         self._current_settings = load_settings()
         print("KoboldClient settings reloaded.") # For debugging
 
+    def _on_settings_changed(self, settings: Dict[str, Any], changed_keys: set):
+        """Settings store listener: applies new settings to the next request."""
+        self._current_settings = settings
+
     async def generate_stream(
         self,
         prompt: str,
@@ -88,16 +129,27 @@ class KoboldClient:
         # Filter out None values if KoboldCpp doesn't like them
         payload = {k: v for k, v in payload.items() if v is not None}
 
+        # Unique key so this request can be aborted individually (required in multi-user mode)
+        genkey = f"KCPP{uuid.uuid4().hex[:8].upper()}"
+        payload["genkey"] = genkey
+
         print(f"Sending request to {api_url} with payload: {json.dumps(payload, indent=2)}") # Debug log
 
+        self._active_streams += 1
         try:
             async with self.client.stream("POST", api_url, json=payload) as response:
                 # Check for non-200 status codes which indicate an immediate error
                 if response.status_code != 200:
                      error_content = await response.aread()
                      raise KoboldClientError(
-                         f"API Error: Status {response.status_code} - {error_content.decode()}"
+                         f"API Error: Status {response.status_code} - {error_content.decode()}",
+                         status_code=response.status_code
                      )
+                record_connected() # For the caller's per-request metrics, if any
+                repetition = create_repetition_detector(self._current_settings)
+                # Stops are also matched here: they can span tokens, and trimming must not depend on the server
+                stop_matcher = StopSequenceMatcher(payload.get("stop_sequence"))
+                looping = False # Set when the repetition guard cut the stream
 
                 # Process the SSE stream
                 async for line in response.aiter_lines():
@@ -109,8 +161,25 @@ class KoboldClient:
                         try:
                             data = json.loads(data_str)
                             token = data.get("token")
+                            record_finish_reason(data.get("finish_reason")) # Sent with the last event
                             if token:
-                                yield token
+                                stopped = False
+                                if stop_matcher:
+                                    token, stopped = stop_matcher.feed(token) # Cut before the stop sequence
+                                if token:
+                                    if repetition is not None and repetition.feed(token):
+                                        # Degenerate loop: stop here instead of streaming it until max_length
+                                        print(f"Repetition detected ({repetition.reason}); stopping the stream.")
+                                        record_finish_reason(STOP_REASON_REPETITION)
+                                        self._schedule_abort(genkey)
+                                        looping = True
+                                        break
+                                    yield token
+                                if stopped:
+                                    print(f"Stop sequence {stop_matcher.matched!r} reached; stopping the stream.")
+                                    record_finish_reason(STOP_REASON_STOP)
+                                    self._schedule_abort(genkey) # Ends the generation even if the server missed the stop
+                                    break
                             # Handle potential errors within the stream if KoboldCpp sends them
                             elif "error" in data:
                                 print(f"Error in stream data: {data['error']}")
@@ -120,20 +189,107 @@ class KoboldClient:
                         except Exception as e:
                              print(f"Error processing stream line: {line}, Error: {e}")
 
+                # Text that turned out not to start a stop sequence (dropped if the stream was cut for looping)
+                held_back = stop_matcher.flush()
+                if held_back and not looping:
+                    yield held_back
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # The reader stopped (task cancelled or generator closed). The response is already
+            # closed by the context manager; tell KoboldCpp to stop generating for nobody.
+            self._schedule_abort(genkey)
+            raise
         except httpx.ConnectError as e:
             raise KoboldClientError(f"Connection Error: Could not connect to {api_url}. Is KoboldCpp running? Details: {e}")
         except httpx.TimeoutException as e:
             raise KoboldClientError(f"Timeout Error: Request to {api_url} timed out. Details: {e}")
         except httpx.RequestError as e:
              raise KoboldClientError(f"Request Error: An error occurred during the request to {api_url}. Details: {e}")
+        except KoboldClientError:
+            raise # API errors keep their status code
         except Exception as e:
             # Catch unexpected errors during streaming
             raise KoboldClientError(f"An unexpected error occurred during streaming: {e}")
+        finally:
+            self._active_streams -= 1
+
+    async def get_max_context_length(self) -> Optional[int]:
+        """Returns the context size the KoboldCpp model was loaded with, or None if unknown."""
+        try:
+            response = await self.client.get(f"{self._get_base_url()}/api/extra/true_max_context_length", timeout=5.0)
+            if response.status_code == 200:
+                return int(response.json().get("value"))
+        except (httpx.HTTPError, ValueError, TypeError) as e:
+            print(f"Warning: Could not query max context length: {e}")
+        return None
+
+    def _schedule_abort(self, genkey: Optional[str]):
+        """Sends an abort request in the background and remembers it for wait_until_ready()."""
+        try:
+            task = asyncio.ensure_future(self.abort(genkey))
+        except RuntimeError as e: # Event loop already closed (application shutdown)
+            print(f"Could not send abort request: {e}")
+            return
+        self._pending_aborts.add(task)
+        task.add_done_callback(self._pending_aborts.discard)
+        self._needs_idle_check = True
+
+    async def abort(self, genkey: Optional[str] = None) -> bool:
+        """
+        Asks KoboldCpp to stop the running generation.
+
+        Args:
+            genkey: Key of the request to abort. Without it, KoboldCpp aborts the current generation.
+
+        Returns:
+            bool: True if the server confirmed the abort.
+        """
+        abort_url = f"{self._get_base_url()}/api/extra/abort"
+        try:
+            response = await self.client.post(abort_url, json={"genkey": genkey} if genkey else {}, timeout=5.0)
+            success = response.status_code == 200 and response.json().get("success") in (True, "true")
+            print(f"Abort request sent (genkey={genkey}): {'OK' if success else response.text}")
+            return success
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Warning: Abort request to {abort_url} failed: {e}")
+            return False
+
+    async def wait_until_ready(self, timeout: float = 5.0) -> bool:
+        """
+        Waits until pending aborts are done and, after an abort, until KoboldCpp reports idle.
+        Streams of this client that are still running are expected to occupy slots, so the
+        idle check is skipped while any of them is active.
+
+        Returns:
+            bool: True if the backend is ready for the next request (False on timeout).
+        """
+        if self._pending_aborts:
+            await asyncio.gather(*list(self._pending_aborts), return_exceptions=True)
+        if not self._needs_idle_check or self._active_streams > 0:
+            return True
+
+        perf_url = f"{self._get_base_url()}/api/extra/perf"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                response = await self.client.get(perf_url, timeout=2.0)
+                if response.status_code != 200 or response.json().get("idle", 1) in (1, True):
+                    self._needs_idle_check = False # Older servers without 'idle' are treated as ready
+                    return True
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"Warning: Could not query {perf_url}: {e}")
+                return False
+            await asyncio.sleep(0.1)
+        print("Warning: KoboldCpp did not report idle after abort.")
+        return False
 
     async def close(self):
-        """Closes the underlying HTTP client."""
-        await self.client.aclose()
+        """Releases the shared HTTP transport (closed when no client uses it anymore)."""
+        if self._pending_aborts:
+            await asyncio.gather(*list(self._pending_aborts), return_exceptions=True)
+        get_settings_store().unsubscribe(self._on_settings_changed)
+        await self._transport.release()
 
 
 # Example Usage (for testing)
@@ -23,5 +23,42 @@ class LLMClient(Protocol):
 
         Returns:
             AsyncGenerator yielding generated text chunks (tokens)
+
+        Note:
+            Cancelling the consuming task (or closing the generator) must close the
+            response and stop the generation on the server side.
+        """
+        ...
+
+    async def get_max_context_length(self) -> Optional[int]:
+        """
+        Returns the context size (in tokens) reported by the backend.
+
+        Returns:
+            The context size, or None if the backend does not report it
+        """
+        ...
+
+    async def abort(self, genkey: Optional[str] = None) -> bool:
+        """
+        Asks the backend to stop generating.
+
+        Args:
+            genkey: Optional key of the request to abort (KoboldCpp multi-user mode)
+
+        Returns:
+            True if the backend confirmed the abort
+        """
+        ...
+
+    async def wait_until_ready(self, timeout: float = 5.0) -> bool:
+        """
+        Waits until aborts of cancelled streams are finished and the backend slot is free.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            True if the backend is ready for the next request
         """
         ...
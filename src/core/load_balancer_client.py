@@ -0,0 +1,317 @@
+import asyncio
+import time
+import httpx
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, Any, Optional, List
+
+from src.core.settings import load_settings, get_settings_store, DEFAULT_SETTINGS
+from src.core.kobold_client import KoboldClient
+from src.core.openai_compatible_client import OpenAICompatibleClient
+
+class LoadBalancerError(Exception):
+    """Custom exception for LoadBalancingClient errors."""
+    pass
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    True if an error means the backend is down or failing (connection or transport
+    errors, HTTP 5xx), so the request may succeed elsewhere. API errors such as 4xx
+    for a bad parameter or an oversized prompt would fail on every backend.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500
+    # The clients wrap httpx errors in their own exception; look down the chain
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, httpx.TransportError):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class Backend:
+    """State of one backend behind the load balancer."""
+    def __init__(self, client_type: str, base_url: str):
+        self.client_type = client_type
+        self.base_url = base_url
+        if client_type == "kobold":
+            self.client = KoboldClient(base_url=base_url)
+        elif client_type == "openai_compatible":
+            self.client = OpenAICompatibleClient(base_url=base_url)
+        else:
+            raise LoadBalancerError(f"Unknown backend client type: {client_type}")
+        self.outstanding = 0 # Requests currently streaming from this backend
+        self.healthy = True
+        self.unhealthy_until = 0.0 # monotonic time until which the backend is skipped
+
+    @property
+    def key(self) -> tuple:
+        return (self.client_type, self.base_url)
+
+    def is_available(self) -> bool:
+        """True if the backend is healthy or its cooldown has expired."""
+        return self.healthy or time.monotonic() >= self.unhealthy_until
+
+    def mark_unhealthy(self, cooldown: float):
+        self.healthy = False
+        self.unhealthy_until = time.monotonic() + cooldown
+
+    def mark_healthy(self):
+        self.healthy = True
+        self.unhealthy_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"Backend({self.client_type}, {self.base_url}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+class LoadBalancingClient:
+    """
+    LLMClient implementation that distributes requests over several backends.
+
+    Backends are read from the 'backends' setting, a list of
+    {"client_type": "kobold" | "openai_compatible", "base_url": "host:port"}.
+    Supports "least_outstanding" and "round_robin" policies, a per-backend
+    concurrency cap, periodic health checks and failover to the next backend when
+    a backend fails (see is_backend_failure()) before the first token.
+    """
+    def __init__(self):
+        self._current_settings = load_settings()
+        self._backends: List[Backend] = []
+        self._round_robin_index = 0 # Position in _backends where the next round-robin search starts
+        self._retired_backends: List[Backend] = [] # Removed backends with requests still streaming
+        self._slot_freed: Optional[asyncio.Condition] = None # Created lazily inside the event loop
+        self._health_task: Optional[asyncio.Task] = None
+        self._build_backends()
+        get_settings_store().subscribe(self._on_settings_changed)
+
+    def _build_backends(self):
+        """Creates backend clients from settings, reusing clients for unchanged entries."""
+        configured = self._current_settings.get("backends", DEFAULT_SETTINGS["backends"]) or []
+        if not configured:
+            # Fall back to the single base_url so the balancer works before backends are configured
+            configured = [{"client_type": "kobold", "base_url": self._current_settings.get("base_url", DEFAULT_SETTINGS["base_url"])}]
+        existing = {backend.key: backend for backend in self._backends}
+        backends = []
+        for entry in configured:
+            client_type = entry.get("client_type", "kobold")
+            base_url = entry.get("base_url", "").strip()
+            if not base_url:
+                continue
+            backend = existing.pop((client_type, base_url), None)
+            if backend is None:
+                backend = Backend(client_type, base_url)
+            else:
+                backend.client.reload_settings()
+            backends.append(backend)
+        # Close clients of removed backends; ones with running streams are closed when those finish
+        for removed in existing.values():
+            if removed.outstanding > 0:
+                self._retired_backends.append(removed)
+            else:
+                asyncio.ensure_future(removed.client.close())
+        self._backends = backends
+
+    def reload_settings(self):
+        """Reloads settings and the backend list from the config file."""
+        self._current_settings = load_settings()
+        self._build_backends()
+        print(f"LoadBalancingClient settings reloaded ({len(self._backends)} backends).")
+
+    def _on_settings_changed(self, settings: Dict[str, Any], changed_keys: set):
+        """Settings store listener: rebuilds the backend list if it changed."""
+        self._current_settings = settings
+        if changed_keys & {"backends", "base_url"}:
+            self._build_backends() # Backend clients follow the store themselves
+
+    def _max_concurrency(self) -> int:
+        return max(1, int(self._current_settings.get("lb_max_concurrency_per_backend", DEFAULT_SETTINGS["lb_max_concurrency_per_backend"])))
+
+    def _select_backend(self, exclude: List[Backend]) -> Optional[Backend]:
+        """Picks a backend with a free slot according to the configured policy."""
+        max_concurrency = self._max_concurrency()
+
+        def eligible(backend: Backend) -> bool:
+            return backend not in exclude and backend.is_available() and backend.outstanding < max_concurrency
+
+        policy = self._current_settings.get("lb_policy", DEFAULT_SETTINGS["lb_policy"])
+        if policy == "round_robin":
+            # Next eligible backend after the one picked last, in configured order
+            count = len(self._backends)
+            for offset in range(count):
+                index = (self._round_robin_index + offset) % count
+                if eligible(self._backends[index]):
+                    self._round_robin_index = index + 1
+                    return self._backends[index]
+            return None
+        candidates = [backend for backend in self._backends if eligible(backend)]
+        if not candidates:
+            return None
+        # least_outstanding (default): fewest running requests, ties go to the earlier backend
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    async def _acquire_backend(self, exclude: List[Backend]) -> Optional[Backend]:
+        """
+        Waits for a backend slot. Returns None if no backend outside 'exclude'
+        is available at all (every remaining backend is unhealthy).
+        """
+        if self._slot_freed is None:
+            self._slot_freed = asyncio.Condition()
+        async with self._slot_freed:
+            while True:
+                backend = self._select_backend(exclude)
+                if backend is not None:
+                    backend.outstanding += 1
+                    return backend
+                remaining = [b for b in self._backends if b not in exclude and b.is_available()]
+                if not remaining:
+                    return None
+                await self._slot_freed.wait() # All remaining backends are at their cap
+
+    async def _release_backend(self, backend: Backend):
+        backend.outstanding = max(0, backend.outstanding - 1)
+        if backend.outstanding == 0 and backend in self._retired_backends:
+            # Its last stream has finished; the backend was removed from the settings meanwhile
+            self._retired_backends.remove(backend)
+            await backend.client.close()
+        if self._slot_freed is not None:
+            async with self._slot_freed:
+                self._slot_freed.notify_all()
+
+    def _ensure_health_task(self):
+        """Starts the periodic health check loop if it is not running."""
+        interval = float(self._current_settings.get("lb_health_check_interval", DEFAULT_SETTINGS["lb_health_check_interval"]))
+        if interval > 0 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            interval = float(self._current_settings.get("lb_health_check_interval", DEFAULT_SETTINGS["lb_health_check_interval"]))
+            await self.check_health()
+            await asyncio.sleep(max(1.0, interval))
+
+    async def check_health(self) -> bool:
+        """Probes all backends concurrently. Returns True if at least one is healthy."""
+        if not self._backends:
+            return False
+        cooldown = float(self._current_settings.get("lb_unhealthy_cooldown", DEFAULT_SETTINGS["lb_unhealthy_cooldown"]))
+        results = await asyncio.gather(*(backend.client.check_health() for backend in self._backends), return_exceptions=True)
+        for backend, result in zip(self._backends, results):
+            if result is True:
+                if not backend.healthy:
+                    print(f"Backend {backend.base_url} is healthy again.")
+                backend.mark_healthy()
+            else:
+                if backend.healthy:
+                    print(f"Backend {backend.base_url} failed health check.")
+                backend.mark_unhealthy(cooldown)
+        if self._slot_freed is not None:
+            async with self._slot_freed:
+                self._slot_freed.notify_all()
+        return any(backend.healthy for backend in self._backends)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        max_length: Optional[int] = None,
+        generation_params: Optional[Dict[str, Any]] = None,
+        stop_sequence: Optional[List[str]] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Streams tokens from one of the backends.
+
+        If a backend fails before yielding its first token (connection refused, HTTP 5xx),
+        it is marked unhealthy and the request is retried on the next backend. Other
+        errors (e.g. HTTP 4xx for a bad request) and errors after the first token are
+        raised to the caller unchanged.
+
+        Raises:
+            LoadBalancerError: If no backend is configured or available.
+            KoboldClientError / OpenAICompatibleClientError: Error from the last backend tried.
+        """
+        if not self._backends:
+            raise LoadBalancerError("No backends configured for the load balancer.")
+        self._ensure_health_task()
+        cooldown = float(self._current_settings.get("lb_unhealthy_cooldown", DEFAULT_SETTINGS["lb_unhealthy_cooldown"]))
+
+        tried: List[Backend] = []
+        last_error: Optional[Exception] = None
+        while True:
+            backend = await self._acquire_backend(tried)
+            if backend is None:
+                if last_error is not None:
+                    raise last_error
+                raise LoadBalancerError("No healthy backend is available.")
+            tried.append(backend)
+            received_token = False
+            try:
+                # aclosing: when the caller closes this stream early, close the backend
+                # stream right away so that the backend client aborts the request
+                async with aclosing(backend.client.generate_stream(
+                    prompt,
+                    max_length=max_length,
+                    generation_params=generation_params,
+                    stop_sequence=stop_sequence
+                )) as stream:
+                    async for token in stream:
+                        received_token = True
+                        yield token
+                backend.mark_healthy()
+                return
+            except Exception as e:
+                if received_token:
+                    raise # Output already reached the caller; cannot fail over mid-stream
+                if not is_backend_failure(e):
+                    raise # The request itself was rejected; other backends would reject it too
+                print(f"Backend {backend.base_url} failed, trying next backend: {e}")
+                backend.mark_unhealthy(cooldown)
+                last_error = e
+            finally:
+                await self._release_backend(backend)
+
+    async def get_max_context_length(self) -> Optional[int]:
+        """Returns the smallest context size reported by the backends, so prompts fit everywhere."""
+        results = await asyncio.gather(*(backend.client.get_max_context_length() for backend in self._backends), return_exceptions=True)
+        lengths = [result for result in results if isinstance(result, int) and result > 0]
+        return min(lengths) if lengths else None
+
+    async def abort(self, genkey: Optional[str] = None) -> bool:
+        """
+        Aborts generation on all backends. Cancelled streams are aborted by their
+        backend client automatically; this is only needed for a manual global stop.
+        """
+        results = await asyncio.gather(*(backend.client.abort(genkey) for backend in self._backends), return_exceptions=True)
+        return all(result is True for result in results)
+
+    async def wait_until_ready(self, timeout: float = 5.0) -> bool:
+        """Waits until every backend has finished its pending aborts."""
+        results = await asyncio.gather(*(backend.client.wait_until_ready(timeout) for backend in self._backends), return_exceptions=True)
+        return all(result is True for result in results)
+
+    async def close(self):
+        """Stops health checks and closes all backend clients."""
+        get_settings_store().unsubscribe(self._on_settings_changed)
+        if self._health_task and not self._health_task.done():
+            self._health_task.cancel()
+        for backend in self._backends + self._retired_backends:
+            await backend.client.close()
+        self._retired_backends = []
+
+
+# Example Usage (for testing)
+async def main():
+    client = LoadBalancingClient()
+    print("Backends:", client._backends)
+    print("Healthy:", await client.check_health())
+    try:
+        async for token in client.generate_stream("<s>[INST]自由に小説を生成してください。 レーティング: general[/INST]", max_length=50):
+            print(token, end="", flush=True)
+        print("\n--- Stream finished ---")
+    except Exception as e:
+        print(f"\n--- Error during generation: {e} ---")
+    finally:
+        await client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
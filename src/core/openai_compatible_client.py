@@ -3,34 +3,72 @@ import json
 import asyncio
 from typing import AsyncGenerator, Dict, Any, Optional, List
 
-from src.core.settings import load_settings
+from src.core.settings import load_settings, get_settings_store, DEFAULT_SETTINGS
+from src.core.http_transport import get_shared_transport
+from src.core.generation_metrics import record_connected, record_finish_reason, STOP_REASON_STOP, STOP_REASON_REPETITION
+from src.core.repetition_detector import create_repetition_detector
+from src.core.stop_matcher import StopSequenceMatcher
 
 class OpenAICompatibleClientError(Exception):
     """Custom exception for OpenAICompatibleClient errors."""
-    pass
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code # HTTP status of an API error response, if any
 
 class OpenAICompatibleClient:
     """
     Asynchronous client for interacting with OpenAI-compatible API endpoints,
     specifically for streaming text generation.
     """
-    def __init__(self):
-        self.client = httpx.AsyncClient(timeout=None)
+    def __init__(self, base_url: Optional[str] = None):
+        """
+        Args:
+            base_url: Optional fixed backend address. If None, 'base_url' from settings is used.
+        """
+        self._base_url_override = base_url # Used by LoadBalancingClient for per-backend clients
         self._current_settings = load_settings()
-
-    def _get_api_url(self) -> str:
-        """Constructs the API URL from settings."""
-        base_url = self._current_settings.get("base_url", "127.0.0.1:5001")
+        get_settings_store().subscribe(self._on_settings_changed) # Follow settings changes automatically
+        self._transport = get_shared_transport() # Pooled connections shared with other clients
+        self._transport.acquire()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared, pooled HTTP client (HTTP/2 if enabled in settings)."""
+        use_http2 = bool(self._current_settings.get("openai_http2", DEFAULT_SETTINGS["openai_http2"]))
+        return self._transport.get_client(http2=use_http2, settings=self._current_settings)
+
+    def _get_base_url(self) -> str:
+        """Returns the backend base URL (override or settings) with a scheme prefix."""
+        base_url = self._base_url_override or self._current_settings.get("base_url", "127.0.0.1:5001")
         # Handle URL prefix if not present
         if not base_url.startswith(("http://", "https://")):
             base_url = f"http://{base_url}"
-        return f"{base_url}/v1/completions"
+        return base_url.rstrip("/")
+
+    def _get_api_url(self) -> str:
+        """Constructs the API URL from settings."""
+        return f"{self._get_base_url()}/v1/completions"
+
+    async def check_health(self) -> bool:
+        """Returns True if the server answers its model list endpoint."""
+        try:
+            response = await self.client.get(f"{self._get_base_url()}/v1/models", timeout=5.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
 
     def reload_settings(self):
-        """Reloads settings from the config file."""
+        """
+        Reloads settings from the config file.
+        A changed base_url takes effect on the next request; pooled connections are kept.
+        """
         self._current_settings = load_settings()
         print("OpenAICompatibleClient settings reloaded.")
 
+    def _on_settings_changed(self, settings: Dict[str, Any], changed_keys: set):
+        """Settings store listener: applies new settings to the next request."""
+        self._current_settings = settings
+
     async def generate_stream(
         self,
         prompt: str,
@@ -87,8 +125,14 @@ class OpenAICompatibleClient:
                 if response.status_code != 200:
                     error_content = await response.aread()
                     raise OpenAICompatibleClientError(
-                        f"API Error: Status {response.status_code} - {error_content.decode()}"
+                        f"API Error: Status {response.status_code} - {error_content.decode()}",
+                        status_code=response.status_code
                     )
+                record_connected() # For the caller's per-request metrics, if any
+                repetition = create_repetition_detector(self._current_settings)
+                # Some servers ignore or cap the stop list, and stops can span tokens: match them here too
+                stop_matcher = StopSequenceMatcher(payload.get("stop"))
+                looping = False # Set when the repetition guard cut the stream
 
                 async for line in response.aiter_lines():
                     if line.startswith("data: "):
@@ -99,13 +143,33 @@ class OpenAICompatibleClient:
                         try:
                             data = json.loads(data_str)
                             token = data["choices"][0]["text"]
+                            record_finish_reason(data["choices"][0].get("finish_reason"))
+                            stopped = False
+                            if token and stop_matcher:
+                                token, stopped = stop_matcher.feed(token) # Cut before the stop sequence
                             if token:
+                                if repetition is not None and repetition.feed(token):
+                                    # Degenerate loop: leaving the response context closes the connection,
+                                    # which stops the generation on the server
+                                    print(f"Repetition detected ({repetition.reason}); stopping the stream.")
+                                    record_finish_reason(STOP_REASON_REPETITION)
+                                    looping = True
+                                    break
                                 yield token
+                            if stopped:
+                                print(f"Stop sequence {stop_matcher.matched!r} reached; stopping the stream.")
+                                record_finish_reason(STOP_REASON_STOP)
+                                break # Closing the connection ends the generation
                         except json.JSONDecodeError:
                             print(f"Warning: Could not decode JSON data: {data_str}")
                         except Exception as e:
                             print(f"Error processing stream line: {line}, Error: {e}")
 
+                # Text that turned out not to start a stop sequence (dropped if the stream was cut for looping)
+                held_back = stop_matcher.flush()
+                if held_back and not looping:
+                    yield held_back
+
         except httpx.ConnectError as e:
             raise OpenAICompatibleClientError(
                 f"Connection Error: Could not connect to {api_url}. Is the server running? Details: {e}"
@@ -118,14 +182,44 @@ class OpenAICompatibleClient:
             raise OpenAICompatibleClientError(
                 f"Request Error: An error occurred during the request to {api_url}. Details: {e}"
             )
+        except OpenAICompatibleClientError:
+            raise # API errors keep their status code
         except Exception as e:
             raise OpenAICompatibleClientError(
                 f"An unexpected error occurred during streaming: {e}"
             )
 
+    async def get_max_context_length(self) -> Optional[int]:
+        """
+        Returns the server's context size, or None if unknown.
+        Uses the llama.cpp server '/props' endpoint; other servers usually don't report it.
+        """
+        try:
+            response = await self.client.get(f"{self._get_base_url()}/props", timeout=5.0)
+            if response.status_code == 200:
+                props = response.json()
+                n_ctx = props.get("n_ctx") or props.get("default_generation_settings", {}).get("n_ctx")
+                return int(n_ctx) if n_ctx else None
+        except (httpx.HTTPError, ValueError, TypeError, AttributeError) as e:
+            print(f"Warning: Could not query max context length: {e}")
+        return None
+
+    async def abort(self, genkey: Optional[str] = None) -> bool:
+        """
+        OpenAI-compatible servers have no abort endpoint. llama.cpp, vLLM and similar servers
+        stop generating when the client disconnects, which happens as soon as a cancelled
+        stream leaves generate_stream (the response context manager closes the connection).
+        """
+        return True
+
+    async def wait_until_ready(self, timeout: float = 5.0) -> bool:
+        """Nothing to wait for; a closed stream frees the server slot."""
+        return True
+
     async def close(self):
-        """Closes the underlying HTTP client."""
-        await self.client.aclose()
+        """Releases the shared HTTP transport (closed when no client uses it anymore)."""
+        get_settings_store().unsubscribe(self._on_settings_changed)
+        await self._transport.release()
 
 
 # Example Usage (for testing)
@@ -0,0 +1,118 @@
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+class OutputArchiveError(Exception):
+    """Custom exception for OutputArchive errors."""
+    pass
+
+class OutputArchive:
+    """
+    Append-only on-disk store for output blocks that were spilled out of the output area.
+
+    Text is written to a temporary UTF-8 file; only (offset, length, label) is kept in
+    memory per block, so memory use stays flat during long infinite generation sessions.
+    Blocks are read back in pages (newest page last).
+    """
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: Where to create the archive file. Defaults to the system temp directory.
+        """
+        self._directory = directory
+        self._file = None
+        self.path: Optional[str] = None
+        self._entries: List[Tuple[int, int, str]] = [] # (byte offset, byte length, label)
+
+    def _ensure_file(self):
+        if self._file is None:
+            try:
+                fd, self.path = tempfile.mkstemp(prefix="wannabe_output_", suffix=".txt", dir=self._directory)
+                self._file = os.fdopen(fd, "w+b")
+            except OSError as e:
+                raise OutputArchiveError(f"Failed to create output archive: {e}")
+
+    def append(self, text: str, label: str = ""):
+        """
+        Stores one spilled block.
+
+        Args:
+            text: The block text (separator line included).
+            label: Short description shown when browsing (e.g. the separator line).
+        """
+        if not text:
+            return
+        self._ensure_file()
+        data = text.encode("utf-8")
+        try:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            raise OutputArchiveError(f"Failed to write output archive {self.path}: {e}")
+        if not label:
+            stripped = text.strip()
+            label = stripped.splitlines()[0] if stripped else ""
+        self._entries.append((offset, len(data), label))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def page_count(self, page_size: int) -> int:
+        """Number of pages for the given page size (blocks per page)."""
+        page_size = max(1, page_size)
+        return (len(self._entries) + page_size - 1) // page_size
+
+    def read_page(self, page_index: int, page_size: int) -> Tuple[str, List[str]]:
+        """
+        Reads one page of archived blocks in their original order.
+
+        Args:
+            page_index: 0-based page index (0 = oldest).
+            page_size: Blocks per page.
+
+        Returns:
+            Tuple[str, List[str]]: The concatenated text and the labels of the blocks on the page.
+
+        Raises:
+            OutputArchiveError: If the page does not exist or the file cannot be read.
+        """
+        page_size = max(1, page_size)
+        if not 0 <= page_index < self.page_count(page_size):
+            raise OutputArchiveError(f"Page {page_index} does not exist.")
+        entries = self._entries[page_index * page_size:(page_index + 1) * page_size]
+        try:
+            self._file.seek(entries[0][0])
+            data = self._file.read(entries[-1][0] + entries[-1][1] - entries[0][0]) # Blocks are contiguous
+        except OSError as e:
+            raise OutputArchiveError(f"Failed to read output archive {self.path}: {e}")
+        return data.decode("utf-8"), [label for _, _, label in entries]
+
+    def clear(self):
+        """Removes all archived blocks and deletes the file."""
+        self.close()
+        self._entries = []
+
+    def close(self):
+        """Closes and deletes the archive file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"Warning: Could not remove output archive {self.path}: {e}")
+        self.path = None
+
+
+if __name__ == "__main__":
+    archive = OutputArchive()
+    for number in range(1, 6):
+        archive.append(f"\n--- 生成ブロック {number} ---\n本文{number}。\n")
+    print(f"Archive: {archive.path}, blocks: {len(archive)}, pages: {archive.page_count(2)}")
+    text, labels = archive.read_page(2, 2)
+    print(labels)
+    print(text)
+    archive.close()
@@ -0,0 +1,208 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, List, Optional
+
+from src.core.generation_scheduler import GenerationScheduler, GenerationJob, PRIORITY_BACKGROUND, PRIORITY_PREFETCH
+
+class PrefetchQueueError(Exception):
+    """Custom exception for PrefetchQueue errors."""
+    pass
+
+class PrefetchCandidate:
+    """
+    Output of one background generation. The chunks can be read with stream() while
+    the generation is still running; chunks already received are returned at once.
+    """
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self.job: Optional[GenerationJob] = None # Set instead of 'task' when run through a scheduler
+        self._changed = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def _push(self, chunk: str):
+        self.chunks.append(chunk)
+        self._changed.set()
+
+    def _finish(self, error: Optional[BaseException] = None):
+        self.finished = True
+        self.error = error
+        self._changed.set()
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        Yields all chunks in order, waiting for new ones until the generation is finished.
+
+        Raises:
+            The exception the generation failed with, after the chunks received before it.
+            PrefetchQueueError: If the candidate was cancelled (e.g. by invalidate()).
+        """
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+        elif self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class PrefetchQueue:
+    """
+    Generates the next candidates in the background while the current one is shown.
+
+    'generate' is called once per candidate and returns an async iterator of text
+    chunks (e.g. a wrapper around LLMClient.generate_stream). next() hands out the
+    oldest candidate and keeps 'depth' further candidates running behind it, so the
+    following block is usually partly or fully generated when the current one is done.
+    Closing a candidate's iterator (cancel/invalidate) aborts its request on the server.
+
+    With a GenerationScheduler, candidates run as scheduler jobs: queued candidates get
+    'priority', the one handed out by next() is raised to 'shown_priority', so that
+    other jobs preempt the invisible candidates first.
+    """
+    def __init__(self, generate: Callable[[], AsyncIterator[str]], depth: int = 1,
+                 scheduler: Optional[GenerationScheduler] = None, group: str = "",
+                 priority: int = PRIORITY_PREFETCH, shown_priority: int = PRIORITY_BACKGROUND):
+        """
+        Args:
+            generate: Factory returning the chunk iterator of one new generation.
+            depth: Number of candidates generated ahead of the one being shown.
+            scheduler: Optional scheduler to run the candidates through.
+            group: Scheduler job group of the candidates.
+            priority: Scheduler priority of queued candidates.
+            shown_priority: Scheduler priority of the candidate returned by next().
+        """
+        self._generate = generate
+        self.depth = max(0, int(depth))
+        self._scheduler = scheduler
+        self.group = group
+        self.priority = priority
+        self.shown_priority = shown_priority
+        self._queued: List[PrefetchCandidate] = [] # Oldest first
+        self._handed_out: List[PrefetchCandidate] = [] # Returned by next() and still running
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    async def _run(self, candidate: PrefetchCandidate):
+        try:
+            async with aclosing(self._generate()) as stream:
+                async for chunk in stream:
+                    candidate._push(chunk)
+        except asyncio.CancelledError:
+            candidate._finish(PrefetchQueueError("Candidate was cancelled."))
+            raise
+        except Exception as e:
+            candidate._finish(e)
+        else:
+            candidate._finish()
+        finally:
+            if candidate in self._handed_out:
+                self._handed_out.remove(candidate)
+
+    def _start_candidate(self, priority: int) -> PrefetchCandidate:
+        candidate = PrefetchCandidate()
+        if self._scheduler is None:
+            candidate.task = asyncio.ensure_future(self._run(candidate))
+            return candidate
+        candidate.job = self._scheduler.submit(lambda: self._run(candidate), priority, group=self.group, label="prefetch")
+        # A job cancelled while still queued never runs _run(); end the candidate here instead
+        candidate.job.add_done_callback(
+            lambda job: None if candidate.finished else candidate._finish(PrefetchQueueError("Candidate was cancelled."))
+        )
+        return candidate
+
+    def fill(self):
+        """Starts candidates until 'depth' of them are queued."""
+        if self._closed:
+            return
+        while len(self._queued) < self.depth:
+            self._queued.append(self._start_candidate(self.priority))
+
+    def next(self) -> PrefetchCandidate:
+        """
+        Returns the oldest queued candidate (or starts one if none is queued) and
+        refills the queue behind it.
+
+        Raises:
+            PrefetchQueueError: If the queue was closed.
+        """
+        if self._closed:
+            raise PrefetchQueueError("PrefetchQueue is closed.")
+        if self._queued:
+            candidate = self._queued.pop(0)
+            if candidate.job is not None:
+                self._scheduler.set_priority(candidate.job, self.shown_priority)
+        else:
+            candidate = self._start_candidate(self.shown_priority)
+        if not candidate.finished:
+            self._handed_out.append(candidate)
+        self.fill()
+        return candidate
+
+    def invalidate(self):
+        """
+        Cancels and drops all queued candidates (e.g. because the prompt changed).
+        Candidates already returned by next() keep running. The queue is refilled
+        on the next call to next() or fill().
+        """
+        for candidate in self._queued:
+            candidate.cancel()
+        self._queued = []
+
+    async def close(self):
+        """Cancels all running candidates, including handed-out ones, and waits for them."""
+        self._closed = True
+        candidates = self._queued + self._handed_out
+        self._queued, self._handed_out = [], []
+        for candidate in candidates:
+            candidate.cancel()
+        waits = [candidate.job.wait() if candidate.job is not None else candidate.task
+                 for candidate in candidates if candidate.job is not None or candidate.task is not None]
+        if waits:
+            await asyncio.gather(*waits, return_exceptions=True)
+
+
+# Example Usage (for testing)
+async def main():
+    counter = 0
+
+    async def fake_generation():
+        nonlocal counter
+        counter += 1
+        number = counter
+        for i in range(5):
+            await asyncio.sleep(0.02)
+            yield f"[{number}:{i}]"
+
+    queue = PrefetchQueue(fake_generation, depth=2)
+    loop = asyncio.get_running_loop()
+    for block in range(4):
+        started = loop.time()
+        candidate = queue.next()
+        text = "".join([chunk async for chunk in candidate.stream()])
+        print(f"Block {block + 1}: {text} ({(loop.time() - started) * 1000:.0f} ms, queued {len(queue)})")
+        await asyncio.sleep(0.05) # Reading time; the queue keeps generating
+        if block == 1:
+            queue.invalidate()
+            print("Queue invalidated")
+    await queue.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -16,7 +16,7 @@ def save_project_data(filepath: str, data: ProjectData):
     Args:
         filepath: The path to save the JSON file.
         data: A dictionary containing the project data.
-              Expected keys: 'details', 'main_text', 'memo_text'.
+              Expected keys: 'details', 'main_text', 'memo_text' (optional: 'idea_pool').
 
     Raises:
         ProjectIOError: If an error occurs during saving.
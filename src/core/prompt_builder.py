@@ -1,3 +1,4 @@
+import math
 from typing import Dict, Optional, Tuple, List # Add List
 from .settings import load_settings, DEFAULT_SETTINGS # Import settings functions
 from .dynamic_prompts import evaluate_dynamic_prompt # Import the new function
@@ -121,6 +122,144 @@ def split_main_text(text: str) -> tuple[str, str]:
     return main_part_text, tail_text
 
 
+# --- Context Budget ---
+# Order in which continuation blocks receive their token allowance.
+# The tail (last lines) matters most for a natural continuation, the older 本文 least.
+CONTEXT_BLOCK_PRIORITY = ["tail", "authors_note", "reference", "main_part"]
+
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+    """
+    Estimates the token count of a text from its character count.
+    A low chars_per_token (e.g. 1.0 for Japanese) overestimates and keeps the prompt safely inside the context.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / max(chars_per_token, 0.1))
+
+
+def trim_text_front(text: str, max_tokens: int, chars_per_token: float) -> str:
+    """
+    Removes text from the front so that the rest fits into max_tokens.
+    Cuts at a paragraph boundary if that keeps at least half of the allowance,
+    otherwise at a 「。」 sentence boundary, otherwise at the exact character.
+    """
+    max_chars = int(max_tokens * chars_per_token)
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 0:
+        return ""
+
+    earliest_start = len(text) - max_chars # Keeping text[earliest_start:] is exactly max_chars
+    min_kept = max_chars // 2
+
+    paragraph_break = text.find("\n", earliest_start - 1)
+    if paragraph_break != -1 and len(text) - (paragraph_break + 1) >= min_kept:
+        return text[paragraph_break + 1:].lstrip("\n")
+
+    sentence_end = text.find("。", earliest_start - 1)
+    if sentence_end != -1 and len(text) - (sentence_end + 1) >= min_kept:
+        return text[sentence_end + 1:].lstrip()
+
+    return text[earliest_start:]
+
+
+def trim_text_front_aligned(text: str, max_tokens: int, chars_per_token: float, step_tokens: int) -> str:
+    """
+    Cache-friendly variant of trim_text_front.
+    The cut position only moves in coarse steps aligned to the start of the text, so while
+    the manuscript grows at its end, consecutive prompts keep the same beginning (and the
+    backend can reuse its cached prefix) until the next step boundary is crossed.
+    """
+    max_chars = int(max_tokens * chars_per_token)
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 0:
+        return ""
+    step_chars = max(1, min(int(step_tokens * chars_per_token), max_chars // 2))
+    earliest_start = len(text) - max_chars
+    start = math.ceil(earliest_start / step_chars) * step_chars
+    # Snap to the next paragraph start within the step (deterministic for an unchanged prefix)
+    paragraph_break = text.find("\n", start - 1, start + step_chars)
+    if paragraph_break != -1:
+        start = paragraph_break + 1
+    return text[start:].lstrip("\n")
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Returns the number of leading characters shared by a and b."""
+    limit = min(len(a), len(b))
+    low, high = 0, limit
+    # Binary search over slice comparisons (C-speed compares instead of a per-character loop)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PrefixReuseTracker:
+    """
+    Remembers the previous prompt and reports how much of each new prompt's beginning
+    matches it, i.e. how much of the backend's KV cache can be reused.
+    """
+    def __init__(self):
+        self.previous_prompt = ""
+
+    def record(self, prompt: str, chars_per_token: float = 1.0) -> Dict[str, int | float]:
+        """
+        Compares prompt with the previous one and stores it as the new reference.
+
+        Returns:
+            dict: {"matched_chars", "total_chars", "matched_tokens", "total_tokens", "ratio"}
+        """
+        matched = common_prefix_length(self.previous_prompt, prompt)
+        self.previous_prompt = prompt
+        return {
+            "matched_chars": matched,
+            "total_chars": len(prompt),
+            "matched_tokens": int(matched / max(chars_per_token, 0.1)), # Only fully matched tokens count
+            "total_tokens": estimate_tokens(prompt, chars_per_token),
+            "ratio": matched / len(prompt) if prompt else 0.0,
+        }
+
+
+def trim_text_back(text: str, max_tokens: int, chars_per_token: float) -> str:
+    """Removes text from the end so that the rest fits into max_tokens, preferring a paragraph boundary."""
+    max_chars = int(max_tokens * chars_per_token)
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 0:
+        return ""
+    paragraph_break = text.rfind("\n", 0, max_chars + 1)
+    if paragraph_break >= max_chars // 2:
+        return text[:paragraph_break].rstrip()
+    return text[:max_chars]
+
+
+def allocate_context_budget(budget_tokens: int, block_tokens: Dict[str, int]) -> Dict[str, int]:
+    """
+    Gives each continuation block a token allowance.
+    Blocks are served in CONTEXT_BLOCK_PRIORITY order; each receives what it needs
+    until the budget runs out, so the 本文 block gets whatever is left.
+
+    Args:
+        budget_tokens: Tokens available for the blocks (prompt budget minus instruction overhead).
+        block_tokens: Estimated tokens needed per block name.
+
+    Returns:
+        Dict mapping block name to its allowance in tokens.
+    """
+    allowances = {}
+    remaining = max(0, budget_tokens)
+    for name in CONTEXT_BLOCK_PRIORITY:
+        allowances[name] = min(block_tokens.get(name, 0), remaining)
+        remaining -= allowances[name]
+    return allowances
+
+
 def determine_task_and_instruction(
     current_mode: str,
     main_text: str,
@@ -133,7 +272,7 @@ def determine_task_and_instruction(
     Returns:
         Tuple[str, str]: (task_type, instruction_text)
     """
-    has_main_text = bool(main_text.strip())
+    has_main_text = bool(main_text) and not main_text.isspace() # Same as bool(main_text.strip()) without copying
 
     # --- Determine Metadata Presence Explicitly ---
     has_title = bool(metadata.get("title", "").strip())
@@ -181,7 +320,9 @@ def build_prompt(
     current_mode: str,
     main_text: str,
     ui_data: dict, # Changed from metadata and rating_override
-    cont_prompt_order: str = "reference_first" # Keep this setting
+    cont_prompt_order: str = "reference_first", # Keep this setting
+    context_budget: Optional[int] = None,
+    cache_stable: bool = False
 ) -> str:
     """
     Builds the final prompt string based on UI state, settings, and the new format.
@@ -191,6 +332,11 @@ def build_prompt(
         main_text: The main text input from the UI.
         ui_data: Dictionary containing metadata, rating, and authors_note from the UI.
         cont_prompt_order: The desired order for continuation prompts ('text_first' or 'reference_first').
+        context_budget: Optional token budget for the whole prompt (backend context minus max_length_generate).
+                        If given, continuation blocks are trimmed to fit; the 本文 block is cut from the front.
+        cache_stable: Lay out continuation prompts so consecutive prompts share a long prefix
+                      (KV cache reuse): reference info containing dynamic prompts is placed after
+                      the 本文 block, and front trimming advances in coarse aligned steps.
     """
     # --- Extract data from ui_data and apply dynamic prompts ---
     raw_metadata = ui_data.get("metadata", {})
@@ -198,6 +344,27 @@ def build_prompt(
     raw_authors_note = ui_data.get("authors_note", "")
 
     # Apply dynamic prompts to relevant fields BEFORE further processing
+    metadata = evaluate_metadata(raw_metadata)
+    authors_note = evaluate_dynamic_prompt(raw_authors_note)
+
+    return assemble_prompt(
+        current_mode,
+        main_text,
+        metadata,
+        authors_note,
+        rating_override,
+        cont_prompt_order=cont_prompt_order,
+        context_budget=context_budget,
+        cache_stable=cache_stable,
+        dynamic_reference=has_dynamic_metadata(raw_metadata)
+    )
+
+
+def evaluate_metadata(raw_metadata: Dict[str, str | List[str]]) -> Dict[str, str | List[str]]:
+    """
+    Applies dynamic prompts to the free-text metadata fields.
+    Keywords and genres are evaluated later in format_metadata.
+    """
     metadata = {
         "title": evaluate_dynamic_prompt(raw_metadata.get("title", "")),
         "keywords": raw_metadata.get("keywords", []), # Evaluate keywords in format_metadata
@@ -211,9 +378,41 @@ def build_prompt(
     # Filter out dialogue_level if it's None (wasn't present in raw_metadata)
     if metadata["dialogue_level"] is None:
         del metadata["dialogue_level"]
+    return metadata
 
-    authors_note = evaluate_dynamic_prompt(raw_authors_note)
 
+def has_dynamic_metadata(raw_metadata: Dict[str, str | List[str]]) -> bool:
+    """True if any metadata field contains dynamic prompt syntax (re-rolled on every build)."""
+    return any(
+        "{" in (" ".join(value) if isinstance(value, list) else str(value or ""))
+        for value in raw_metadata.values()
+    )
+
+
+def assemble_prompt(
+    current_mode: str,
+    main_text: str,
+    metadata: Dict[str, str | List[str]],
+    authors_note: str,
+    rating_override: Optional[str],
+    cont_prompt_order: str = "reference_first",
+    context_budget: Optional[int] = None,
+    cache_stable: bool = False,
+    dynamic_reference: bool = False,
+    metadata_input_string: Optional[str] = None,
+    split_parts: Optional[Tuple[str, str]] = None
+) -> str:
+    """
+    Builds the final prompt from already evaluated inputs (see build_prompt).
+
+    Args:
+        metadata: Metadata with dynamic prompts already applied (evaluate_metadata).
+        authors_note: Author's note with dynamic prompts already applied.
+        rating_override: Rating from the UI, or None to use the default rating.
+        dynamic_reference: True if the reference info contains dynamic prompts (cache-stable layout).
+        metadata_input_string: Precomputed format_metadata() result, computed if None.
+        split_parts: Precomputed split_main_text(main_text) result, computed if None.
+    """
     # --- Determine rating to use ---
     if rating_override:
         rating_to_use = rating_override
@@ -229,7 +428,8 @@ def build_prompt(
 
     # --- Format metadata string ---
     # Pass current_mode to format_metadata to handle exclusion logic
-    metadata_input_string = format_metadata(metadata, mode=current_mode)
+    if metadata_input_string is None:
+        metadata_input_string = format_metadata(metadata, mode=current_mode)
     internal_input = ""
 
     # --- Build internal_input based on task type ---
@@ -239,20 +439,48 @@ def build_prompt(
     elif task_type.startswith("CONT"):
         # CONT tasks use the new complex structure
         try:
-            main_part, tail = split_main_text(main_text)
+            main_part, tail = split_parts if split_parts is not None else split_main_text(main_text)
         except Exception as e:
             print(f"Error splitting main text: {e}")
             # Fallback: Use the original main_text as the main part, empty tail
             main_part = main_text.strip()
             tail = ""
 
+        reference_text = metadata_input_string
+        authors_note_text = authors_note.strip()
+
+        # --- Apply context budget (trim blocks to their token allowance) ---
+        if context_budget is not None:
+            budget_settings = load_settings()
+            chars_per_token = float(budget_settings.get("context_chars_per_token", DEFAULT_SETTINGS["context_chars_per_token"]))
+            # Instruction, wrapper and block headers are always sent
+            overhead = estimate_tokens(f"<s>[INST]{base_instruction_text} レーティング: {rating_to_use}\n[/INST]", chars_per_token)
+            overhead += estimate_tokens("【参考情報】\n```\n\n```\n【本文】\n```\n\n```\n【オーサーズノート】\n```\n\n```\n", chars_per_token)
+            block_texts = {"tail": tail, "authors_note": authors_note_text, "reference": reference_text, "main_part": main_part}
+            allowances = allocate_context_budget(
+                context_budget - overhead,
+                {name: estimate_tokens(text, chars_per_token) for name, text in block_texts.items()}
+            )
+            if cache_stable:
+                step_tokens = int(budget_settings.get("cache_trim_step_tokens", DEFAULT_SETTINGS["cache_trim_step_tokens"]))
+                main_part = trim_text_front_aligned(main_part, allowances["main_part"], chars_per_token, step_tokens)
+            else:
+                main_part = trim_text_front(main_part, allowances["main_part"], chars_per_token)
+            tail = trim_text_front(tail, allowances["tail"], chars_per_token)
+            reference_text = trim_text_back(reference_text, allowances["reference"], chars_per_token)
+            authors_note_text = trim_text_back(authors_note_text, allowances["authors_note"], chars_per_token)
+
         # Create blocks (handle empty cases by setting to None)
         main_part_block = f"【本文】\n```\n{main_part}\n```" if main_part else None
-        reference_block = f"【参考情報】\n```\n{metadata_input_string}\n```" if metadata_input_string else None
-        authors_note_block = f"【オーサーズノート】\n```\n{authors_note.strip()}\n```" if authors_note.strip() else None
+        reference_block = f"【参考情報】\n```\n{reference_text}\n```" if reference_text else None
+        authors_note_block = f"【オーサーズノート】\n```\n{authors_note_text}\n```" if authors_note_text else None
 
         input_parts = []
 
+        # Dynamic prompts re-roll on every build; in cache-stable mode keep them out of the prefix
+        if cache_stable and dynamic_reference:
+            cont_prompt_order = "text_first"
+
         # 1. Add Reference and Main Part based on order
         if cont_prompt_order == 'reference_first':
             if reference_block: input_parts.append(reference_block)
@@ -286,6 +514,121 @@ def build_prompt(
 
     return prompt
 
+
+class IncrementalPromptBuilder:
+    """
+    Prompt builder for infinite generation with immediate updates.
+
+    Keeps the UI inputs and derived parts (evaluated metadata, formatted reference
+    block, 本文/tail split) between builds and only recomputes the parts that were
+    invalidated since the previous build, so per-cycle overhead does not grow with
+    the manuscript. Inputs containing dynamic prompts are re-evaluated on every
+    build so that each cycle still gets a fresh roll.
+    """
+    MAIN_TEXT = "main_text"
+    UI_DATA = "ui_data" # Metadata, rating and author's note
+
+    def __init__(self):
+        self._dirty = {self.MAIN_TEXT, self.UI_DATA}
+        self._main_text = ""
+        self._main_text_dynamic = False
+        self._split_parts: Optional[Tuple[str, str]] = None
+        self._ui_data: dict = {}
+        self._metadata_dynamic = False
+        self._authors_note_dynamic = False
+        self._metadata: Optional[Dict[str, str | List[str]]] = None
+        self._authors_note: Optional[str] = None
+        self._metadata_strings: Dict[str, str] = {} # Formatted reference block per mode
+
+    def invalidate(self, part: Optional[str] = None):
+        """Marks MAIN_TEXT, UI_DATA or (if None) everything as changed."""
+        if part is None:
+            self._dirty = {self.MAIN_TEXT, self.UI_DATA}
+        else:
+            self._dirty.add(part)
+
+    def get_ui_data(self, read_ui_data) -> dict:
+        """Returns the cached UI data, calling read_ui_data() only if it changed."""
+        if self.UI_DATA in self._dirty:
+            self._ui_data = read_ui_data()
+            self._dirty.discard(self.UI_DATA)
+            raw_metadata = self._ui_data.get("metadata", {})
+            self._metadata_dynamic = has_dynamic_metadata(raw_metadata)
+            self._authors_note_dynamic = "{" in (self._ui_data.get("authors_note") or "")
+            self._metadata = None
+            self._authors_note = None
+            self._metadata_strings = {}
+        return self._ui_data
+
+    def _get_main_text(self, read_main_text) -> Tuple[str, Tuple[str, str]]:
+        """Returns the (evaluated) main text and its 本文/tail split."""
+        if self.MAIN_TEXT in self._dirty:
+            self._main_text = read_main_text()
+            self._dirty.discard(self.MAIN_TEXT)
+            self._main_text_dynamic = "{" in self._main_text
+            self._split_parts = None if self._main_text_dynamic else split_main_text(self._main_text)
+        if self._main_text_dynamic:
+            main_text = evaluate_dynamic_prompt(self._main_text)
+            return main_text, split_main_text(main_text)
+        return self._main_text, self._split_parts
+
+    def build(
+        self,
+        current_mode: str,
+        read_main_text,
+        read_ui_data,
+        cont_prompt_order: str = "reference_first",
+        context_budget: Optional[int] = None,
+        cache_stable: bool = False
+    ) -> str:
+        """
+        Builds a prompt like build_prompt(), reusing unchanged parts.
+
+        Args:
+            read_main_text: Callable returning the raw main text (only called when invalidated).
+            read_ui_data: Callable returning the ui_data dict (only called when invalidated).
+        """
+        ui_data = self.get_ui_data(read_ui_data)
+
+        if self._metadata is None or self._metadata_dynamic:
+            metadata = evaluate_metadata(ui_data.get("metadata", {}))
+            metadata_input_string = format_metadata(metadata, mode=current_mode)
+            if not self._metadata_dynamic:
+                self._metadata = metadata
+                self._metadata_strings[current_mode] = metadata_input_string
+        else:
+            metadata = self._metadata
+            metadata_input_string = self._metadata_strings.get(current_mode)
+            if metadata_input_string is None:
+                metadata_input_string = format_metadata(metadata, mode=current_mode)
+                self._metadata_strings[current_mode] = metadata_input_string
+
+        if self._authors_note is None or self._authors_note_dynamic:
+            authors_note = evaluate_dynamic_prompt(ui_data.get("authors_note", ""))
+            if not self._authors_note_dynamic:
+                self._authors_note = authors_note
+        else:
+            authors_note = self._authors_note
+
+        if current_mode == "generate":
+            main_text, split_parts = self._get_main_text(read_main_text)
+        else:
+            main_text, split_parts = "", None # IDEA mode does not use the main text
+
+        return assemble_prompt(
+            current_mode,
+            main_text,
+            metadata,
+            authors_note,
+            ui_data.get("rating"),
+            cont_prompt_order=cont_prompt_order,
+            context_budget=context_budget,
+            cache_stable=cache_stable,
+            dynamic_reference=self._metadata_dynamic,
+            metadata_input_string=metadata_input_string,
+            split_parts=split_parts
+        )
+
 # --- Example Usage (Updated for new build_prompt signature) ---
 if __name__ == "__main__":
     # Example ui_data structure
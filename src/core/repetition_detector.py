@@ -0,0 +1,115 @@
+from typing import Any, Dict, Optional
+
+from src.core.settings import DEFAULT_SETTINGS
+
+# Digits are compared as '0', so that loops with counting numbers ("1日目…", "2日目…") repeat exactly
+DIGIT_TRANSLATION = str.maketrans("0123456789０１２３４５６７８９", "0" * 20)
+
+class RepetitionDetector:
+    """
+    Detects degenerate repetition at the end of a text stream, e.g. a sentence or a
+    「……」 line that repeats until max_length.
+
+    Two checks run on the tail of the stream:
+      - Period (every 'check_interval' characters): the last 'min_span' characters (or
+        more) consist of one unit of up to 'max_period' characters repeated at least
+        'min_repeats' times.
+      - Diversity (every window/8 characters): among the n-grams of the last 'window'
+        characters, too few are distinct (loops with small variations, e.g. alternating
+        names, are not exactly periodic).
+    Digits are normalized, and only the tail is kept, so memory and cost per check are bounded.
+    """
+    def __init__(self, min_span: int = 120, min_repeats: int = 3, max_period: int = 200,
+                 ngram: int = 8, window: int = 400, min_distinct_ratio: float = 0.3, check_interval: int = 8):
+        """
+        Args:
+            min_span: Shortest repeated tail (characters) that counts as a loop.
+            min_repeats: How often the repeating unit must occur.
+            max_period: Longest repeating unit (characters) looked for.
+            ngram: n-gram length of the diversity check.
+            window: Characters of the tail used by the diversity check (0 disables it).
+            min_distinct_ratio: Distinct/total n-gram ratio below which the tail is a loop.
+            check_interval: Characters between two checks.
+        """
+        self.min_span = min_span
+        self.min_repeats = min_repeats
+        self.max_period = max_period
+        self.ngram = ngram
+        self.window = window
+        self.min_distinct_ratio = min_distinct_ratio
+        self.check_interval = max(1, check_interval)
+        self._keep = max(window, max_period * min_repeats, min_span) + check_interval
+        self._tail = ""
+        self._unchecked = 0
+        self._diversity_unchecked = 0
+        self.length = 0 # Characters fed in total
+        self.reason: Optional[str] = None # Description of the detected loop
+
+    def feed(self, chunk: str) -> bool:
+        """Adds streamed text. Returns True once a loop was detected (and from then on)."""
+        if self.reason is not None:
+            return True
+        if not chunk:
+            return False
+        self.length += len(chunk)
+        self._tail = (self._tail + chunk.translate(DIGIT_TRANSLATION))[-self._keep:]
+        self._unchecked += len(chunk)
+        self._diversity_unchecked += len(chunk)
+        if self._unchecked >= self.check_interval:
+            self._unchecked = 0
+            self.reason = self._check_period()
+        if self.reason is None and self._diversity_unchecked >= max(self.check_interval, self.window // 8):
+            self._diversity_unchecked = 0
+            self.reason = self._check_diversity()
+        return self.reason is not None
+
+    def _check_period(self) -> Optional[str]:
+        text = self._tail
+        last = len(text) - 1
+        for period in range(1, min(self.max_period, len(text) // self.min_repeats) + 1):
+            if text[last] != text[last - period]:
+                continue # Cheap rejection before comparing slices
+            span = max(self.min_span, period * self.min_repeats)
+            if span > len(text):
+                break
+            # The tail of length 'span' is periodic if it equals itself shifted by one period
+            if text[-span + period:] == text[-span:-period]:
+                return f"period {period} x {span // period}"
+        return None
+
+    def _check_diversity(self) -> Optional[str]:
+        if self.window <= 0 or len(self._tail) < self.window:
+            return None
+        text = self._tail[-self.window:]
+        ngrams = {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+        ratio = len(ngrams) / (len(text) - self.ngram + 1)
+        if ratio < self.min_distinct_ratio:
+            return f"distinct {self.ngram}-grams {ratio:.2f}"
+        return None
+
+
+def create_repetition_detector(settings: Dict[str, Any]) -> Optional[RepetitionDetector]:
+    """Returns a detector configured from settings, or None if the repetition guard is off."""
+    if not settings.get("repetition_guard", DEFAULT_SETTINGS["repetition_guard"]):
+        return None
+    min_span = int(settings.get("repetition_guard_min_chars", DEFAULT_SETTINGS["repetition_guard_min_chars"]))
+    return RepetitionDetector(min_span=max(16, min_span))
+
+
+if __name__ == "__main__":
+    samples = {
+        "prose": "彼女は扉を開けた。冷たい風が吹き込み、廊下の灯りが揺れた。誰もいないはずの部屋から足音が聞こえる。"
+                 "振り返ると、窓の外に見知らぬ男が立っていた。男は何も言わず、ただこちらを見つめている。",
+        "sentence loop": "彼女は扉を開けた。" + "「どうして？」と彼は言った。" * 20,
+        "ellipsis loop": "沈黙が続いた。\n" + "「……」\n" * 60,
+        "counting loop": "".join(f"{i}日目、彼は待った。" for i in range(1, 60)),
+    }
+    for name, text in samples.items():
+        detector = RepetitionDetector()
+        tripped = False
+        for i in range(0, len(text), 3): # Feed in token-sized chunks
+            if detector.feed(text[i:i + 3]):
+                tripped = True
+                break
+        print(f"{name}: {'loop after ' + str(detector.length) + ' chars (' + detector.reason + ')' if tripped else 'no loop'} "
+              f"/ {len(text)} chars")
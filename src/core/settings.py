@@ -1,11 +1,19 @@
+import copy
 import json
 import os
-from typing import Any, Dict, List
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
 
 CONFIG_FILE = "config.json"
 DEFAULT_SETTINGS = {
-    "client_type": "kobold",
+    "client_type": "kobold", # "kobold", "openai_compatible" or "load_balancer"
     "base_url": "127.0.0.1:5001",  # Unified base URL setting
+    # Load balancer (client_type "load_balancer")
+    "backends": [], # List of {"client_type": "kobold" | "openai_compatible", "base_url": "host:port"}
+    "lb_policy": "least_outstanding", # "least_outstanding" or "round_robin"
+    "lb_max_concurrency_per_backend": 1, # Parallel requests per backend (KoboldCpp slots)
+    "lb_health_check_interval": 15.0, # Seconds between health checks (0 disables)
+    "lb_unhealthy_cooldown": 10.0, # Seconds a failed backend is skipped before retrying
     # "max_length": 250, # Removed old setting
     "max_length_idea": 500, # Default for idea mode
     "max_length_generate": 250, # Default for generate mode
@@ -15,14 +23,36 @@ DEFAULT_SETTINGS = {
     "top_k": 0, # Add Top-K setting (0 means disabled in many Kobold setups)
     "rep_pen": 1.0,
     "stop_sequences": ["[INST]", "[/INST]"], # Default stop sequences
+    "repetition_guard": True, # Cut streams that fall into a loop (repeated sentence or line) and abort the request
+    "repetition_guard_min_chars": 120, # Length of the repeated tail that counts as a loop
     "infinite_generation_behavior": { # Add new setting for infinite generation behavior
         "idea": "manual", # "immediate" or "manual"
         "generate": "manual" # "immediate" or "manual"
     },
+    "infinite_parallel_streams": 1, # Number of concurrent streams in infinite generation
+    "infinite_prefetch_depth": 0, # Candidates generated ahead of the shown block in manual infinite mode (0 = off)
+    "generation_max_concurrency": 0, # Generation requests running at once (0 = parallel streams / prefetch depth + 1)
+    "infinite_dedup_threshold": 0.0, # Similarity (0-1) from which an infinite generation block counts as a near-duplicate (0 = off)
+    "infinite_dedup_action": "collapse", # "collapse" (replace the text with a note) or "drop" (remove the block)
+    "infinite_dedup_abort_chars": 0, # Abort a stream once its first N characters duplicate a recent block (0 = never)
+    "output_refresh_rate": 30, # Output area updates per second while streaming (0 = every token)
+    "output_max_blocks": 0, # Blocks kept in the output area; older ones move to a disk archive (0 = unlimited)
     "transfer_to_main_mode": "cursor", # "cursor", "next_line_always", "next_line_eol"
     "transfer_newlines_before": 0, # Number of empty lines to insert before transfer in next_line modes
     "cont_prompt_order": "reference_first", # "text_first" or "reference_first" (Default: reference first)
-    "default_rating": "general" # Add default rating setting: "general" or "r18"
+    "default_rating": "general", # Add default rating setting: "general" or "r18"
+    "dynamic_prompt_seed": -1, # Seed for Dynamic Prompts, reapplied at each generation start (-1 = random)
+    "idea_candidate_pool_size": 100, # Unshown IDEA sections kept per item and answered before generating (0 = off)
+    # Context budget for continuation prompts
+    "max_context_length": 0, # Model context in tokens (0 = ask the backend, no trimming if unknown)
+    "context_chars_per_token": 1.0, # Token estimate for Japanese text (lower = safer)
+    "cache_stable_prompt": False, # Keep continuation prompt prefixes stable for KV cache reuse
+    "cache_trim_step_tokens": 512, # Granularity of front trimming in cache-stable mode
+    # HTTP transport (shared connection pool for all LLM clients)
+    "http_max_connections": 32, # Upper bound of simultaneous connections
+    "http_max_keepalive_connections": 16, # Idle connections kept warm for reuse
+    "http_keepalive_expiry": 30.0, # Seconds an idle connection is kept alive
+    "openai_http2": False # Use HTTP/2 for OpenAI-compatible servers (requires 'h2')
 }
 
 def get_config_path() -> str:
@@ -32,7 +62,7 @@ def get_config_path() -> str:
     project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     return os.path.join(project_root, CONFIG_FILE)
 
-def load_settings() -> Dict[str, Any]:
+def _read_settings_file() -> Dict[str, Any]:
     """Loads settings from the config file or returns defaults."""
     config_path = get_config_path()
     settings = DEFAULT_SETTINGS.copy() # Start with defaults
@@ -67,18 +97,118 @@ def load_settings() -> Dict[str, Any]:
         return DEFAULT_SETTINGS.copy() # Return fresh defaults on error
     return settings
 
-def save_settings(settings: Dict[str, Any]):
-    """Saves the provided settings dictionary to the config file."""
-    config_path = get_config_path()
-    try:
+SettingsListener = Callable[[Dict[str, Any], Set[str]], None]
+
+class SettingsStore:
+    """
+    Process-wide, in-memory copy of config.json.
+
+    The file is parsed once; later reads are served from memory. External edits are
+    picked up by comparing the file's mtime (checked at most every 'check_interval'
+    seconds). Listeners registered with subscribe() are called with the new settings
+    and the set of changed keys whenever settings change, either through
+    save_settings() or an external edit.
+    """
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._settings: Optional[Dict[str, Any]] = None
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._listeners: List[SettingsListener] = []
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(get_config_path())
+        except OSError:
+            return None
+
+    def get(self) -> Dict[str, Any]:
+        """
+        Returns the current settings. The returned dict is a copy and may be modified freely.
+        """
+        now = time.monotonic()
+        if self._settings is None:
+            self._mtime = self._file_mtime()
+            self._settings = _read_settings_file()
+            self._last_check = now
+        elif now - self._last_check >= self.check_interval:
+            self.check_for_changes()
+        return copy.deepcopy(self._settings)
+
+    def check_for_changes(self) -> bool:
+        """
+        Reloads the config file if it was modified outside this process.
+
+        Returns:
+            bool: True if the file changed and listeners were notified.
+        """
+        self._last_check = time.monotonic()
+        mtime = self._file_mtime()
+        if self._settings is None or mtime == self._mtime:
+            return False
+        print(f"{CONFIG_FILE} was modified externally. Reloading settings.")
+        self._mtime = mtime
+        self._apply(_read_settings_file())
+        return True
+
+    def save(self, settings: Dict[str, Any]):
+        """Writes settings to the config file and updates the in-memory copy."""
+        config_path = get_config_path()
         # Ensure all default keys are present before saving
-        settings_to_save = DEFAULT_SETTINGS.copy()
-        settings_to_save.update(settings)
+        settings_to_save = copy.deepcopy(DEFAULT_SETTINGS)
+        settings_to_save.update(copy.deepcopy(settings))
+        try:
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(settings_to_save, f, indent=4, ensure_ascii=False)
+        except IOError as e:
+            print(f"Error saving settings to {config_path}: {e}")
+            return
+        self._mtime = self._file_mtime()
+        self._last_check = time.monotonic()
+        self._apply(settings_to_save)
+
+    def _apply(self, new_settings: Dict[str, Any]):
+        """Replaces the in-memory settings and notifies listeners of changed keys."""
+        old_settings = self._settings or {}
+        self._settings = new_settings
+        changed_keys = {
+            key for key in set(old_settings) | set(new_settings)
+            if old_settings.get(key) != new_settings.get(key)
+        }
+        if not changed_keys:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(copy.deepcopy(new_settings), changed_keys)
+            except Exception as e:
+                print(f"Error in settings listener {listener}: {e}")
+
+    def subscribe(self, listener: SettingsListener):
+        """Registers a callback called as listener(settings, changed_keys) on every change."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: SettingsListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
 
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(settings_to_save, f, indent=4, ensure_ascii=False)
-    except IOError as e:
-        print(f"Error saving settings to {config_path}: {e}")
+_settings_store: Optional[SettingsStore] = None
+
+def get_settings_store() -> SettingsStore:
+    """Returns the process-wide SettingsStore instance."""
+    global _settings_store
+    if _settings_store is None:
+        _settings_store = SettingsStore()
+    return _settings_store
+
+def load_settings() -> Dict[str, Any]:
+    """Returns the current settings from the in-memory store (the file is read only when it changes)."""
+    return get_settings_store().get()
+
+def save_settings(settings: Dict[str, Any]):
+    """Saves the provided settings dictionary to the config file and notifies listeners."""
+    get_settings_store().save(settings)
 
 # Example usage (optional, for testing)
 if __name__ == "__main__":
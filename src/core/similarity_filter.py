@@ -0,0 +1,158 @@
+import re
+import zlib
+from collections import deque
+from typing import Deque, FrozenSet, List, Optional
+
+# Whitespace is ignored when comparing blocks (line breaks vary between otherwise equal outputs)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    return WHITESPACE_PATTERN.sub("", text or "")
+
+def char_shingles(text: str, ngram: int = 4) -> FrozenSet[int]:
+    """
+    Hashed character n-grams of the normalized text. Character n-grams work for
+    Japanese without a tokenizer; texts shorter than 'ngram' give a single shingle.
+    """
+    text = normalize_text(text)
+    if not text:
+        return frozenset()
+    if len(text) <= ngram:
+        return frozenset([zlib.crc32(text.encode("utf-8"))])
+    return frozenset(zlib.crc32(text[i:i + ngram].encode("utf-8")) for i in range(len(text) - ngram + 1))
+
+
+class DuplicateMatch:
+    """An earlier block the checked text is similar to."""
+    __slots__ = ("similarity", "label")
+
+    def __init__(self, similarity: float, label: str):
+        self.similarity = similarity
+        self.label = label
+
+
+class _RecentBlock:
+    __slots__ = ("shingles", "label")
+
+    def __init__(self, shingles: FrozenSet[int], label: str):
+        self.shingles = shingles
+        self.label = label
+
+
+class NearDuplicateFilter:
+    """
+    Detects blocks that are nearly identical to one of the recent blocks of a session.
+
+    Finished blocks are compared by the Jaccard similarity of their character n-gram
+    sets. Blocks are a few hundred characters and the window is small, so exact set
+    intersections (done in C) are cheaper than computing MinHash signatures in Python.
+    While a block is streaming, stream_check() tells when the prefix generated so far
+    is almost entirely contained in an earlier block, so the request can be aborted
+    before it reaches max_length.
+    """
+    def __init__(self, threshold: float = 0.8, window: int = 50, ngram: int = 4):
+        """
+        Args:
+            threshold: Similarity (0-1) from which a block counts as a near-duplicate.
+            window: Number of recent blocks compared against.
+            ngram: Characters per shingle.
+        """
+        self.threshold = threshold
+        self.ngram = ngram
+        self._recent: Deque[_RecentBlock] = deque(maxlen=max(1, window))
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def find_duplicate(self, text: str) -> Optional[DuplicateMatch]:
+        """
+        Returns the most similar recent block if its similarity reaches the threshold,
+        otherwise None. Empty text is never a duplicate.
+        """
+        shingles = char_shingles(text, self.ngram)
+        if not shingles or not self._recent:
+            return None
+        best: Optional[DuplicateMatch] = None
+        for block in self._recent:
+            common = len(shingles & block.shingles)
+            similarity = common / (len(shingles) + len(block.shingles) - common)
+            if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                best = DuplicateMatch(similarity, block.label)
+        return best
+
+    def add(self, text: str, label: str = ""):
+        """Remembers a shown block (the oldest one is forgotten when the window is full)."""
+        shingles = char_shingles(text, self.ngram)
+        if shingles:
+            self._recent.append(_RecentBlock(shingles, label))
+
+    def clear(self):
+        self._recent.clear()
+
+    def stream_check(self, min_prefix_chars: int = 100) -> "DuplicateStreamCheck":
+        """Starts checking a new stream against the current recent blocks."""
+        return DuplicateStreamCheck(self, min_prefix_chars)
+
+
+class DuplicateStreamCheck:
+    """
+    Incremental containment check of a streaming block: for every new shingle, counts
+    how many of the prefix's shingles occur in each recent block. Costs one set lookup
+    per recent block and character.
+    """
+    def __init__(self, owner: NearDuplicateFilter, min_prefix_chars: int):
+        self.threshold = owner.threshold
+        self.ngram = owner.ngram
+        self.min_prefix_chars = max(owner.ngram, min_prefix_chars)
+        self._blocks: List[_RecentBlock] = list(owner._recent) # Snapshot; blocks added later are not compared
+        self._hits = [0] * len(self._blocks)
+        self._seen = set()
+        self._tail = "" # Last ngram-1 normalized characters
+        self.length = 0 # Normalized characters fed
+        self.match: Optional[DuplicateMatch] = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Adds streamed text. Returns True once the prefix (at least min_prefix_chars)
+        duplicates an earlier block; 'match' then holds that block.
+        """
+        if self.match is not None:
+            return True
+        if not self._blocks:
+            return False
+        text = self._tail + normalize_text(chunk)
+        self.length += len(text) - len(self._tail)
+        for i in range(len(text) - self.ngram + 1):
+            shingle = zlib.crc32(text[i:i + self.ngram].encode("utf-8"))
+            if shingle in self._seen:
+                continue # Count repeated n-grams once, as the block sets do
+            self._seen.add(shingle)
+            for index, block in enumerate(self._blocks):
+                if shingle in block.shingles:
+                    self._hits[index] += 1
+        self._tail = text[-(self.ngram - 1):] if self.ngram > 1 else ""
+        if self.length < self.min_prefix_chars or not self._seen:
+            return False
+        best = max(range(len(self._blocks)), key=lambda index: self._hits[index])
+        containment = self._hits[best] / len(self._seen)
+        if containment >= self.threshold:
+            self.match = DuplicateMatch(containment, self._blocks[best].label)
+            return True
+        return False
+
+
+if __name__ == "__main__":
+    duplicate_filter = NearDuplicateFilter(threshold=0.8)
+    duplicate_filter.add("彼女は扉を開けた。冷たい風が吹き込み、廊下の灯りが揺れた。誰もいないはずの部屋から足音が聞こえる。", "ブロック 1")
+    duplicate_filter.add("雨の音で目が覚めた。窓の外では、見知らぬ男が傘も差さずに立っていた。", "ブロック 2")
+
+    for text in ["彼女は扉を開けた。冷たい風が吹き込み、廊下の灯りが揺れた。誰もいないはずの部屋から足音が聞こえた。",
+                 "朝の市場は人であふれていた。少年は果物屋の前で立ち止まり、財布の中身を数えた。"]:
+        match = duplicate_filter.find_duplicate(text)
+        print(f"{text[:20]}... -> {f'{match.label} ({match.similarity:.2f})' if match else 'unique'}")
+
+    check = duplicate_filter.stream_check(min_prefix_chars=20)
+    for chunk in ["彼女は", "扉を開けた。", "冷たい風が", "吹き込み、", "廊下の灯りが", "揺れた。"]:
+        if check.feed(chunk):
+            print(f"Stream aborted after {check.length} chars: duplicates {check.match.label} ({check.match.similarity:.2f})")
+            break
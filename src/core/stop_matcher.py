@@ -0,0 +1,125 @@
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+class StopSequenceAutomaton:
+    """
+    Aho-Corasick automaton over a set of stop sequences. Immutable; shared by all
+    matchers with the same stop list (see compile_stop_sequences()).
+    """
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = tuple(pattern for pattern in patterns if pattern)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.depth: List[int] = [0] # Length of the prefix a node stands for
+        self.match_length: List[int] = [0] # Longest pattern ending at the node (via fail links), 0 = none
+
+        for pattern in self.patterns:
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.depth.append(self.depth[node] + 1)
+                    self.match_length.append(0)
+                node = next_node
+            self.match_length[node] = max(self.match_length[node], len(pattern))
+
+        # Breadth-first: fail links point to the longest proper suffix that is also a prefix
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0) # Children of the root keep 0
+                self.match_length[child] = max(self.match_length[child], self.match_length[self.fail[child]])
+                queue.append(child)
+
+    def step(self, node: int, char: str) -> int:
+        while node and char not in self.goto[node]:
+            node = self.fail[node]
+        return self.goto[node].get(char, 0)
+
+
+@lru_cache(maxsize=32)
+def compile_stop_sequences(patterns: Tuple[str, ...]) -> StopSequenceAutomaton:
+    """Builds (or returns the cached) automaton for a stop list."""
+    return StopSequenceAutomaton(patterns)
+
+
+class StopSequenceMatcher:
+    """
+    Finds stop sequences in a token stream, also when they span several tokens.
+
+    feed() returns the text that can be passed on: characters that could still be the
+    start of a stop sequence are held back until the next token decides. At a match,
+    the text is cut before the stop sequence (like the servers do) and 'stopped' is set.
+    Call flush() at the end of the stream to get the held-back rest.
+    """
+    def __init__(self, stop_sequences: Optional[Sequence[str]]):
+        self.automaton = compile_stop_sequences(tuple(stop_sequences or ()))
+        self._node = 0
+        self._held = "" # Unreleased text; always the last depth[_node] characters fed
+        self.stopped = False
+        self.matched: Optional[str] = None # The stop sequence that was found
+
+    def __bool__(self) -> bool:
+        return bool(self.automaton.patterns)
+
+    def feed(self, chunk: str) -> Tuple[str, bool]:
+        """
+        Adds a streamed chunk.
+
+        Returns:
+            Tuple[str, bool]: Text to pass on, and True if a stop sequence was found
+            (nothing after it is returned, and further chunks are ignored).
+        """
+        if self.stopped or not chunk:
+            return "", self.stopped
+        automaton = self.automaton
+        text = self._held + chunk
+        offset = len(self._held) # Characters of 'text' already processed by the automaton
+        node = self._node
+        for index in range(offset, len(text)):
+            node = automaton.step(node, text[index])
+            length = automaton.match_length[node]
+            if length:
+                start = index + 1 - length
+                self.stopped = True
+                self.matched = text[start:index + 1]
+                self._held = ""
+                self._node = 0
+                return text[:start], True
+        self._node = node
+        keep = automaton.depth[node]
+        self._held = text[len(text) - keep:] if keep else ""
+        return text[:len(text) - keep], False
+
+    def flush(self) -> str:
+        """Returns the held-back text at the end of the stream (no stop sequence followed)."""
+        rest, self._held, self._node = self._held, "", 0
+        return "" if self.stopped else rest
+
+
+if __name__ == "__main__":
+    stops = ["\n# 設定:", "# 設定:\n", "[INST]", "[/INST]"]
+    tokens = ["# あら", "すじ:\n少年は", "旅に出る。", "\n", "# ", "設", "定", ":\n", "港町..."]
+    matcher = StopSequenceMatcher(stops)
+    output = []
+    for token in tokens:
+        text, stopped = matcher.feed(token)
+        output.append(text)
+        print(f"{token!r:12} -> {text!r}{' (stop: ' + repr(matcher.matched) + ')' if stopped else ''}")
+        if stopped:
+            break
+    output.append(matcher.flush())
+    print(f"Output: {''.join(output)!r}")
+
+    matcher = StopSequenceMatcher(stops)
+    text = "".join(matcher.feed(token)[0] for token in ["普通の", "文章[", "IN", "T]ではない"]) + matcher.flush()
+    print(f"No stop: {text!r}")
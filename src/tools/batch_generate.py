@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional
+
+from src.core.settings import load_settings, DEFAULT_SETTINGS
+from src.core.project_io import load_project_data, ProjectIOError
+from src.core.prompt_builder import build_prompt
+from src.core.dynamic_prompts import evaluate_dynamic_prompt, set_dynamic_prompt_seed, PromptVariantSpace
+from src.core.idea_processor import IdeaProcessor, IdeaSectionWatcher, IDEA_ITEM_ORDER
+from src.core.kobold_client import KoboldClient
+from src.core.openai_compatible_client import OpenAICompatibleClient
+from src.core.load_balancer_client import LoadBalancingClient
+from src.core.generation_scheduler import GenerationScheduler
+from src.core.generation_metrics import GenerationMetrics, STOP_REASON_SECTION, track_generation
+
+# Headless batch generation: loads a project file saved by the GUI, builds the prompts
+# the same way the GUI does and writes one JSON line per generation. Re-running with
+# the same output file skips the jobs that already completed (resume).
+#   python -m src.tools.batch_generate project.json --mode generate --count 50 -o out.jsonl
+#   python -m src.tools.batch_generate project.json --mode idea --items title synopsis --count 20 -o ideas.jsonl
+# With --expand, every combination of the {..} choices in the project (cartesian) or a
+# stratified sample of them (--variants N) is generated instead of random rolls:
+#   python -m src.tools.batch_generate project.json --mode idea --expand cartesian -o sweep.jsonl
+
+IDEA_ITEMS = ["all"] + IDEA_ITEM_ORDER
+EXPAND_MODES = ["cartesian", "stratified"]
+# Free-text fields expanded with --expand (keywords and genres are expanded per tag)
+EXPANDED_TEXT_FIELDS = ["title", "synopsis", "setting", "plot"]
+
+class BatchGenerateError(Exception):
+    """Custom exception for batch generation errors."""
+    pass
+
+def project_to_ui_data(project_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts the 'details' of a saved project into the ui_data dictionary that
+    build_prompt() expects (same as MainWindow._get_metadata_from_ui()).
+    """
+    details = project_data.get("details", {}) or {}
+    metadata = {
+        "title": details.get("title", "") or "",
+        "keywords": details.get("keywords", []) or [],
+        "genres": details.get("genres", []) or [],
+        "synopsis": details.get("synopsis", "") or "",
+        "setting": details.get("setting", "") or "",
+        "plot": details.get("plot", "") or "",
+    }
+    dialogue_level = details.get("dialogue_level", "指定なし") or "指定なし"
+    if dialogue_level != "指定なし":
+        metadata["dialogue_level"] = dialogue_level
+    return {
+        "metadata": metadata,
+        "rating": details.get("rating", "general") or "general",
+        "authors_note": details.get("authors_note", "") or "",
+    }
+
+def create_client(settings: Dict[str, Any]):
+    """Creates the LLM client configured in settings (like MainWindow)."""
+    client_type = settings.get("client_type", DEFAULT_SETTINGS["client_type"])
+    if client_type == "kobold":
+        return KoboldClient()
+    if client_type == "openai_compatible":
+        return OpenAICompatibleClient()
+    if client_type == "load_balancer":
+        return LoadBalancingClient()
+    raise BatchGenerateError(f"Unknown client type: {client_type}")
+
+def expand_project(ui_data: Dict[str, Any], main_text: str, mode: str, expand: str, variants: int,
+                   rng: random.Random) -> List[Dict[str, str]]:
+    """
+    Expands the {..} choices of the prompt fields into concrete variants.
+
+    Args:
+        expand: "cartesian" (all combinations, at most 'variants') or "stratified"
+                (a sample of 'variants' combinations covering every option).
+
+    Returns:
+        list: Per variant, a dict of field name -> expanded text for the fields that
+              contain choices ("keywords.0", "genres.1", ... for tags).
+    """
+    fields = {name: ui_data["metadata"].get(name, "") for name in EXPANDED_TEXT_FIELDS}
+    for name in ("keywords", "genres"):
+        fields.update({f"{name}.{i}": tag for i, tag in enumerate(ui_data["metadata"].get(name, []))})
+    fields["authors_note"] = ui_data.get("authors_note", "")
+    if mode == "generate":
+        fields["main_text"] = main_text # Not part of IDEA prompts
+    fields = {name: text for name, text in fields.items() if isinstance(text, str) and "{" in text}
+
+    names = list(fields)
+    space = PromptVariantSpace([fields[name] for name in names])
+    print(f"{len(names)} fields with choices, {space.size} combinations.")
+    if expand == "cartesian":
+        if space.size > variants:
+            print(f"Warning: only the first {variants} combinations are used (raise --variants or use --expand stratified).")
+        expanded = space.variants(limit=variants)
+    else:
+        expanded = space.stratified_sample(variants, rng)
+    return [dict(zip(names, values)) for values in expanded]
+
+def apply_variant(ui_data: Dict[str, Any], main_text: str, variant: Dict[str, str]):
+    """Returns (ui_data, main_text) with the expanded field values of a variant filled in."""
+    metadata = dict(ui_data["metadata"], keywords=list(ui_data["metadata"].get("keywords", [])),
+                    genres=list(ui_data["metadata"].get("genres", [])))
+    ui_data = dict(ui_data, metadata=metadata)
+    for name, text in variant.items():
+        if name == "authors_note":
+            ui_data["authors_note"] = text
+        elif name == "main_text":
+            main_text = text
+        elif "." in name:
+            field, index = name.split(".")
+            metadata[field][int(index)] = text
+        else:
+            metadata[name] = text
+    return ui_data, main_text
+
+def plan_jobs(mode: str, items: List[str], count: int, fast: bool, base_seed: Optional[int],
+              variants: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+    """
+    Lists the jobs of a batch. Job ids depend only on mode, item, variant and index,
+    so a resumed run recognizes the jobs of the interrupted one.
+
+    Args:
+        count: Generations per item (and per variant).
+        base_seed: Dynamic Prompts seed of the first job (job i uses base_seed + i).
+                   None draws a random seed per job; it is recorded in the output.
+        variants: Expanded field values (see expand_project()); None rolls the choices randomly.
+    """
+    jobs = []
+    for item in (items if mode == "idea" else ["text"]):
+        for variant in (variants if variants is not None else [None]):
+            variant_key = ""
+            if variant is not None:
+                digest = hashlib.sha1(json.dumps(variant, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+                variant_key = f"-v{digest.hexdigest()[:12]}"
+            for index in range(count):
+                job_id = f"{mode}-{item}{'-fast' if fast and mode == 'idea' else ''}{variant_key}-{index:05d}"
+                seed = base_seed + index if base_seed is not None else random.randrange(2**31)
+                job = {"id": job_id, "mode": mode, "item": item, "index": index, "fast": fast, "seed": seed}
+                if variant is not None:
+                    job["variant"] = variant
+                jobs.append(job)
+    return jobs
+
+def read_completed(path: str) -> List[Dict[str, Any]]:
+    """
+    Returns the records of jobs already written to 'path' without an error. Failed and
+    cancelled jobs are retried on resume; a line cut off by an interruption is ignored.
+    """
+    completed = []
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("id") and not record.get("error"):
+                completed.append(record)
+    return completed
+
+
+class BatchGenerator:
+    """
+    Runs the jobs of a batch through a GenerationScheduler with 'concurrency' slots
+    and appends each finished job to a JSONL file (flushed per line, so an interrupted
+    batch loses at most the jobs that were running).
+    """
+    def __init__(self, client, project_data: Dict[str, Any], settings: Dict[str, Any], concurrency: int = 1):
+        self.client = client
+        self.settings = settings
+        self.ui_data = project_to_ui_data(project_data)
+        self.main_text = project_data.get("main_text", "") or ""
+        self.scheduler = GenerationScheduler(concurrency)
+        self.backend_max_context: Optional[int] = None
+        self.finished = 0
+        self.failed = 0
+
+    def _build_job_prompt(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Builds the prompt of a job with its Dynamic Prompts seed.
+
+        Returns:
+            dict: 'prompt', 'max_length', 'stop_sequence', 'safe_item' (IDEA item collected
+            in safe mode, else None) and 'prompt_build_s'.
+        """
+        started = time.perf_counter()
+        set_dynamic_prompt_seed(job["seed"]) # build_prompt() evaluates with the default RNG
+        ui_data, main_text = self.ui_data, self.main_text
+        if "variant" in job:
+            ui_data, main_text = apply_variant(ui_data, main_text, job["variant"])
+        if job["mode"] == "idea":
+            item = job["item"]
+            processor = IdeaProcessor(ui_data["metadata"])
+            stop_sequence = processor.determine_stop_sequence(item)
+            suffix = ""
+            if job["fast"]:
+                prereqs_met, warning_msg = processor.check_fast_mode_prerequisites(item)
+                if warning_msg and job["index"] == 0:
+                    print(f"Warning ({item}): {warning_msg}")
+                suffix = processor.generate_prompt_suffix(item)
+            prompt = build_prompt(current_mode="idea", main_text="", ui_data=ui_data) + suffix
+            max_length = self.settings.get("max_length_idea", DEFAULT_SETTINGS["max_length_idea"])
+            safe_item = item if item != "all" and not job["fast"] else None
+        else:
+            max_length = self.settings.get("max_length_generate", DEFAULT_SETTINGS["max_length_generate"])
+            max_context = self.settings.get("max_context_length", DEFAULT_SETTINGS["max_context_length"]) or self.backend_max_context
+            prompt = build_prompt(
+                current_mode="generate",
+                main_text=evaluate_dynamic_prompt(main_text),
+                ui_data=ui_data,
+                cont_prompt_order=self.settings.get("cont_prompt_order", DEFAULT_SETTINGS["cont_prompt_order"]),
+                context_budget=max(0, max_context - max_length) if max_context else None,
+                cache_stable=self.settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"])
+            )
+            stop_sequence = None # Client default from settings
+            safe_item = None
+        return {"prompt": prompt, "max_length": max_length, "stop_sequence": stop_sequence,
+                "safe_item": safe_item, "metadata": ui_data["metadata"], "prompt_build_s": time.perf_counter() - started}
+
+    async def prepare(self):
+        """Asks the backend for its context size if the settings leave it to the backend."""
+        if self.settings.get("max_context_length", DEFAULT_SETTINGS["max_context_length"]) == 0:
+            try:
+                self.backend_max_context = await self.client.get_max_context_length()
+            except Exception as e:
+                print(f"Could not get the backend context length: {e}")
+
+    def dedupe(self, jobs: List[Dict[str, Any]], completed: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        Drops jobs whose prompt equals the prompt of an earlier job with the same index
+        (e.g. variants that expand to the same text), so no prompt is sent twice per
+        repetition. Prompts are built once here and rebuilt from the seed when the job runs.
+
+        Args:
+            completed: Records of an earlier run (resume); their jobs and prompts count as done.
+        """
+        completed = completed or []
+        done_ids = {record["id"] for record in completed}
+        seen = {(record.get("prompt_sha1"), record.get("item"), record.get("index")) for record in completed}
+        unique = []
+        for job in jobs:
+            if job["id"] in done_ids:
+                continue
+            prompt = self._build_job_prompt(job)["prompt"]
+            key = (hashlib.sha1(prompt.encode("utf-8")).hexdigest(), job["item"], job["index"])
+            if key not in seen:
+                seen.add(key)
+                unique.append(job)
+        skipped = len(jobs) - len(unique) - len(done_ids.intersection(job["id"] for job in jobs))
+        if skipped:
+            print(f"Skipped {skipped} jobs with duplicate prompts.")
+        return unique
+
+    async def _run_job(self, job: Dict[str, Any], output) -> Dict[str, Any]:
+        request = self._build_job_prompt(job)
+        prompt, safe_item = request["prompt"], request["safe_item"]
+        metrics = GenerationMetrics(job["id"], prompt, request["prompt_build_s"], request["max_length"])
+        watcher = IdeaSectionWatcher(safe_item) if safe_item else None
+        chunks = []
+        record = dict(job, prompt_sha1=hashlib.sha1(prompt.encode("utf-8")).hexdigest())
+        try:
+            with track_generation(metrics):
+                async with aclosing(self.client.generate_stream(
+                    prompt,
+                    max_length=request["max_length"],
+                    stop_sequence=request["stop_sequence"]
+                )) as stream:
+                    async for token in stream:
+                        metrics.mark_token(token)
+                        chunks.append(token)
+                        if watcher is not None and watcher.feed(token):
+                            metrics.finish(STOP_REASON_SECTION) # Same early stop as the GUI safe mode
+                            break
+            raw_text = "".join(chunks)
+            if safe_item:
+                # The watcher has parsed the sections while streaming
+                record["text"] = IdeaProcessor(request["metadata"]).filter_record(watcher.record(), safe_item)
+                record["raw_text"] = raw_text
+            else:
+                record["text"] = raw_text
+            metrics.finish()
+            record["error"] = None
+        except asyncio.CancelledError:
+            metrics.finish(cancelled=True)
+            raise # Not written: the job is retried on resume
+        except Exception as e:
+            metrics.finish(error=str(e))
+            record["text"] = "".join(chunks)
+            record["error"] = str(e)
+        record["metrics"] = metrics.to_dict()
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+        self.finished += 1
+        self.failed += int(record["error"] is not None)
+        print(metrics.format_log() + (f" error={record['error']}" if record["error"] else ""))
+        return record
+
+    async def run(self, jobs: List[Dict[str, Any]], output_path: str):
+        """Runs all jobs (after prepare()) and appends their records to output_path."""
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "a", encoding="utf-8") as output:
+            scheduled = [self.scheduler.submit(lambda job=job: self._run_job(job, output), group="batch", label=job["id"])
+                         for job in jobs]
+            try:
+                await asyncio.gather(*(job.wait() for job in scheduled), return_exceptions=True)
+            finally:
+                await self.scheduler.close() # Aborts running streams on Ctrl+C
+
+
+async def main(args: argparse.Namespace) -> int:
+    try:
+        project_data = load_project_data(args.project)
+    except ProjectIOError as e:
+        print(f"Error: {e}")
+        return 1
+    settings = load_settings()
+    base_seed = args.seed
+    if base_seed is None:
+        configured_seed = settings.get("dynamic_prompt_seed", DEFAULT_SETTINGS["dynamic_prompt_seed"])
+        base_seed = configured_seed if configured_seed >= 0 else None
+
+    if not args.resume and os.path.exists(args.output) and os.path.getsize(args.output) > 0:
+        print(f"Error: {args.output} already exists. Use --resume to continue it or choose another file.")
+        return 1
+
+    client = create_client(settings)
+    generator = BatchGenerator(client, project_data, settings, concurrency=args.concurrency)
+    try:
+        variants = None
+        if args.expand:
+            # A fixed sample seed, so that a resumed run draws the same variants
+            sample_rng = random.Random(args.seed if args.seed is not None else 0)
+            variants = expand_project(generator.ui_data, generator.main_text, args.mode, args.expand,
+                                      args.variants, sample_rng)
+        count = args.count if args.count is not None else (1 if args.expand else 10)
+        await generator.prepare()
+        jobs = plan_jobs(args.mode, args.items, count, args.fast, base_seed, variants)
+        completed = read_completed(args.output) if args.resume else []
+        pending = generator.dedupe(jobs, completed)
+        print(f"{len(jobs)} jobs planned, {len(pending)} to run ({len(completed)} completed records in the output, "
+              f"concurrency {args.concurrency}).")
+        if not pending:
+            return 0
+        started = time.perf_counter()
+        await generator.run(pending, args.output)
+    finally:
+        await client.close()
+    print(f"Finished {generator.finished}/{len(pending)} jobs ({generator.failed} failed) "
+          f"in {time.perf_counter() - started:.1f}s. Results: {args.output}")
+    return 0 if generator.failed == 0 and generator.finished == len(pending) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run generations for a Project Wannabe project without the GUI and write them to JSONL.")
+    parser.add_argument("project", help="Project JSON file saved by the GUI")
+    parser.add_argument("--mode", choices=["generate", "idea"], default="generate")
+    parser.add_argument("--items", nargs="+", choices=IDEA_ITEMS, default=["all"], help="IDEA items to generate (idea mode)")
+    parser.add_argument("--fast", action="store_true", help="IDEA fast mode (prompt suffix, no section filtering)")
+    parser.add_argument("--count", type=int, help="Generations per item and variant (default: 10, or 1 with --expand)")
+    parser.add_argument("--expand", choices=EXPAND_MODES, help="Generate combinations of the {..} choices instead of random rolls")
+    parser.add_argument("--variants", type=int, default=1000, help="Sample size for stratified, maximum for cartesian expansion")
+    parser.add_argument("--concurrency", type=int, default=1, help="Requests running at the same time")
+    parser.add_argument("--seed", type=int, help="Dynamic Prompts seed of the first job (default: dynamic_prompt_seed setting)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--resume", action="store_true", help="Skip jobs already completed in the output file")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(main(args)))
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run again with --resume to continue.")
+        sys.exit(130)
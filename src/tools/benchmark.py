@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional
+
+from src.core.kobold_client import KoboldClient
+from src.core.openai_compatible_client import OpenAICompatibleClient
+from src.core.http_transport import get_shared_transport
+from src.tools.fake_backend import FakeBackendServer, FakeBackendConfig
+
+# End-to-end benchmark of the streaming path (client + shared HTTP transport) against
+# the fake backend. Results can be saved as a JSON baseline and compared later:
+#   python -m src.tools.benchmark --save bench/baseline.json
+#   python -m src.tools.benchmark --compare bench/baseline.json
+
+CLIENT_TYPES = {"kobold": KoboldClient, "openai_compatible": OpenAICompatibleClient}
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32]
+BENCH_PROMPT = "<s>[INST]本文を踏まえ、最後の文章の自然な続きとなるように小説を生成してください。 レーティング: general\n彼女は扉を開けた。[/INST]"
+
+# Metrics where a higher value is better; all others are latencies/costs (lower is better)
+HIGHER_IS_BETTER = {"tokens_per_s_stream", "tokens_per_s_total"}
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Mean, median and p95 of a list of measurements (in the unit given)."""
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0}
+    ordered = sorted(values)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+class StreamTiming:
+    """Timestamps of one stream."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.tokens = 0
+
+    def token(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        self.last_token = now
+        self.tokens += 1
+
+    @property
+    def ttft(self) -> float:
+        return (self.first_token or time.perf_counter()) - self.start
+
+    @property
+    def stream_rate(self) -> Optional[float]:
+        """Tokens/s after the first token (steady state)."""
+        if self.tokens < 2 or self.last_token == self.first_token:
+            return None
+        return (self.tokens - 1) / (self.last_token - self.first_token)
+
+
+async def run_stream(client, max_length: int, stop_after: Optional[int] = None) -> StreamTiming:
+    """Consumes one stream. With stop_after, closes it after that many tokens (cancel)."""
+    timing = StreamTiming()
+    async with aclosing(client.generate_stream(BENCH_PROMPT, max_length=max_length, stop_sequence=[])) as stream:
+        async for _ in stream:
+            timing.token()
+            if stop_after is not None and timing.tokens >= stop_after:
+                break
+    return timing
+
+
+async def bench_throughput(client, concurrency: int, max_length: int, rounds: int) -> Dict[str, Any]:
+    """TTFT and tokens/s with 'concurrency' simultaneous streams."""
+    timings: List[StreamTiming] = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        timings += await asyncio.gather(*(run_stream(client, max_length) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total_tokens = sum(timing.tokens for timing in timings)
+    return {
+        "ttft_ms": {k: v * 1000 for k, v in summarize([t.ttft for t in timings]).items()},
+        "tokens_per_s_stream": summarize([rate for rate in (t.stream_rate for t in timings) if rate])["mean"],
+        "tokens_per_s_total": total_tokens / elapsed if elapsed > 0 else 0.0,
+        "tokens": total_tokens,
+    }
+
+
+async def bench_overhead(client, max_length: int, rounds: int) -> Dict[str, Any]:
+    """Per-token cost of the client loop with a server that sends as fast as it can."""
+    per_token = []
+    for _ in range(rounds):
+        timing = await run_stream(client, max_length)
+        if timing.tokens > 1:
+            per_token.append((timing.last_token - timing.first_token) / (timing.tokens - 1))
+    return {"per_token_us": {k: v * 1e6 for k, v in summarize(per_token).items()}}
+
+
+async def bench_cancel(client, rounds: int) -> Dict[str, Any]:
+    """Cost of cancelling a stream: close until the backend is ready, and TTFT of the next request."""
+    cancel_ms, next_ttft_ms = [], []
+    for _ in range(rounds):
+        await run_stream(client, max_length=10000, stop_after=5)
+        started = time.perf_counter()
+        await client.wait_until_ready()
+        cancel_ms.append((time.perf_counter() - started) * 1000)
+        timing = await run_stream(client, max_length=2)
+        next_ttft_ms.append(timing.ttft * 1000)
+    return {"cancel_to_ready_ms": summarize(cancel_ms), "ttft_after_cancel_ms": summarize(next_ttft_ms)}
+
+
+async def bench_reconnect(client, rounds: int) -> Dict[str, Any]:
+    """TTFT on a warm keep-alive connection vs. after the connection pool was closed."""
+    warm_ms, cold_ms = [], []
+    await run_stream(client, max_length=2) # Warm up the pool
+    for _ in range(rounds):
+        warm_ms.append((await run_stream(client, max_length=2)).ttft * 1000)
+        await get_shared_transport().aclose() # Drop pooled connections; the next request reconnects
+        cold_ms.append((await run_stream(client, max_length=2)).ttft * 1000)
+    return {"ttft_warm_ms": summarize(warm_ms), "ttft_reconnect_ms": summarize(cold_ms)}
+
+
+async def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    concurrency_levels = [c for c in args.concurrency if c > 0]
+    config = FakeBackendConfig(rate=args.rate, ttft=args.ttft, jitter=args.jitter, slots=max(concurrency_levels), seed=0)
+    server = FakeBackendServer(port=0, config=config)
+    await server.start()
+    results: Dict[str, Any] = {}
+    try:
+        for client_type in args.clients:
+            client = CLIENT_TYPES[client_type](base_url=server.base_url)
+            try:
+                # Client debug output is part of the measured cost but not of the report
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for concurrency in concurrency_levels:
+                        results[f"{client_type}/throughput/c{concurrency}"] = await bench_throughput(
+                            client, concurrency, args.max_length, args.rounds)
+                    server.config.rate, server.config.ttft = 0.0, 0.0 # Unthrottled for overhead
+                    results[f"{client_type}/overhead"] = await bench_overhead(client, args.max_length * 4, args.rounds)
+                    server.config.rate, server.config.ttft = args.rate, args.ttft
+                    results[f"{client_type}/cancel"] = await bench_cancel(client, args.rounds)
+                    results[f"{client_type}/reconnect"] = await bench_reconnect(client, args.rounds)
+            finally:
+                await client.close()
+            print(f"{client_type}: done")
+    finally:
+        await server.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "server": {"rate": args.rate, "ttft": args.ttft, "jitter": args.jitter},
+            "max_length": args.max_length,
+            "rounds": args.rounds,
+        },
+        "results": results,
+    }
+
+
+def flatten_metrics(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Flattens nested results into {"kobold/cancel/cancel_to_ready_ms/p50": value}."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, path))
+        elif isinstance(value, (int, float)):
+            flat[path] = float(value)
+    return flat
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Returns a list of regressions: metrics that got worse than the baseline by more than
+    'tolerance' (relative). Token counts are ignored.
+    """
+    regressions = []
+    current_flat = flatten_metrics(current["results"])
+    for path, base_value in flatten_metrics(baseline["results"]).items():
+        if path.endswith("/tokens") or path not in current_flat or base_value == 0:
+            continue
+        value = current_flat[path]
+        parts = path.split("/")
+        metric = parts[-2] if parts[-1] in ("mean", "p50", "p95") else parts[-1]
+        change = (value - base_value) / base_value
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append(f"{path}: {base_value:.3f} -> {value:.3f} ({change:+.0%})")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    for name, metrics in report["results"].items():
+        parts = []
+        for key, value in metrics.items():
+            if isinstance(value, dict):
+                parts.append(f"{key}={value['p50']:.2f} (p95 {value['p95']:.2f})")
+            elif key != "tokens":
+                parts.append(f"{key}={value:.1f}")
+        print(f"{name:36s} " + ", ".join(parts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark KoboldClient/OpenAICompatibleClient streaming against the fake backend.")
+    parser.add_argument("--clients", nargs="+", choices=list(CLIENT_TYPES), default=list(CLIENT_TYPES))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=200.0, help="Server tokens/s per stream")
+    parser.add_argument("--ttft", type=float, default=0.05, help="Server time to first token (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--max-length", type=int, default=100, help="Tokens per stream")
+    parser.add_argument("--rounds", type=int, default=3, help="Repetitions per scenario")
+    parser.add_argument("--save", help="Write results to this JSON file (baseline)")
+    parser.add_argument("--compare", help="Compare with a saved baseline; exit code 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+    print_report(report)
+
+    if args.save:
+        directory = os.path.dirname(args.save)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Results saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("server") != report["meta"]["server"]:
+            print("Warning: the baseline was recorded with different server settings; results are not comparable.")
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) compared to {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions compared to {args.compare} (tolerance {args.tolerance:.0%}).")
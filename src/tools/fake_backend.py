@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# Deterministic stand-in for KoboldCpp / OpenAI-compatible servers, for benchmarking and
+# testing the clients and UI loops without a GPU:
+#   python -m src.tools.fake_backend --port 5001 --rate 50 --ttft 0.2 --slots 4
+
+IDEA_SECTIONS = ["タイトル", "キーワード", "ジャンル", "あらすじ", "設定", "プロット"]
+
+PROSE_SENTENCES = [
+    "夜明け前の港町には、まだ潮の匂いが濃く残っていた。",
+    "彼女は古びた地図を広げ、指先で赤い印をなぞった。",
+    "「本当に行くつもりなのか」と、少年は小さな声で尋ねた。",
+    "風が止むと、遠くで鐘の音が三度だけ鳴った。",
+    "石畳の路地を抜けた先に、見覚えのない扉があった。",
+    "彼は答えの代わりに、懐から銀色の鍵を取り出した。",
+    "雨上がりの空には、淡い虹がかすかに架かっていた。",
+    "灯台の光が、黒い海面を静かに撫でていく。",
+    "誰もいないはずの図書館で、ページをめくる音がした。",
+    "「約束は守る」と彼女は言い、振り返らずに歩き出した。",
+]
+
+IDEA_CONTENT = {
+    "タイトル": ["星降る港の地図職人", "灯台守と銀の鍵", "雨上がりの図書館"],
+    "キーワード": ["地図\n港町\n約束", "灯台\n鍵\n秘密", "図書館\n雨\n再会"],
+    "ジャンル": ["ファンタジー\n冒険", "ミステリー\n青春", "ヒューマンドラマ"],
+    "あらすじ": [
+        "港町で地図を描く少女が、存在しない島を示す古地図を手に入れる。\n仲間とともに島を探すうち、町に隠された約束が明らかになっていく。",
+        "灯台守の青年は、嵐の夜に流れ着いた銀の鍵を拾う。\n鍵が開く扉を探す旅は、彼自身の過去へと続いていた。",
+    ],
+    "設定": [
+        "潮風の吹く港町エルマ。古い地図と航海の記録が町の財産とされている。",
+        "海に囲まれた小さな島国。灯台ごとに守り手の一族が代々仕えている。",
+    ],
+    "プロット": [
+        "1. 古地図との出会い\n2. 仲間集め\n3. 嵐の航海\n4. 島の真実\n5. 約束の果たし方",
+        "1. 嵐の夜\n2. 鍵の持ち主探し\n3. 失われた扉\n4. 過去との対面",
+    ],
+}
+
+
+def tokenize(text: str, rng: random.Random) -> List[str]:
+    """Splits text into pseudo tokens of 1-3 characters (multibyte aware, deterministic)."""
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        size = rng.choice((1, 1, 2, 2, 3))
+        tokens.append(text[pos:pos + size])
+        pos += size
+    return tokens
+
+
+def generate_text(prompt: str, max_tokens: int) -> List[str]:
+    """
+    Returns a deterministic token list for a prompt.
+    IDEA prompts get '# 見出し:' sections (continuing from a trailing header if the prompt
+    ends with one), other prompts get Japanese prose.
+    """
+    rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+    prompt_tail = prompt.rstrip().rsplit("[/INST]", 1)[-1]
+
+    if "アイデア" in prompt or prompt_tail.lstrip().startswith("#"):
+        # Continue after the last header in the prompt (fast mode suffix), or start from the top
+        start_index = 0
+        text = ""
+        for index, name in enumerate(IDEA_SECTIONS):
+            if prompt_tail.rstrip().endswith(f"# {name}:"):
+                text = rng.choice(IDEA_CONTENT[name]) + "\n\n"
+                start_index = index + 1
+                break
+        for name in IDEA_SECTIONS[start_index:]:
+            text += f"# {name}:\n{rng.choice(IDEA_CONTENT[name])}\n\n"
+    else:
+        text = ""
+        while len(text) < max_tokens * 3:
+            text += rng.choice(PROSE_SENTENCES)
+            if rng.random() < 0.3:
+                text += "\n"
+    return tokenize(text, rng)[:max_tokens]
+
+
+def apply_stop_sequences(tokens: List[str], stop_sequences: List[str]) -> List[str]:
+    """Cuts the token list before the first stop sequence, like the real servers do."""
+    text = "".join(tokens)
+    cut = min((text.find(stop) for stop in stop_sequences if stop and stop in text), default=-1)
+    if cut < 0:
+        return tokens
+    kept = []
+    consumed = 0
+    for token in tokens:
+        if consumed + len(token) >= cut:
+            if cut > consumed:
+                kept.append(token[:cut - consumed])
+            break
+        kept.append(token)
+        consumed += len(token)
+    return kept
+
+
+class FakeBackendConfig:
+    """Behaviour of the fake server."""
+    def __init__(
+        self,
+        rate: float = 50.0,
+        ttft: float = 0.2,
+        jitter: float = 0.1,
+        slots: int = 1,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        max_context: int = 4096,
+        seed: int = 0
+    ):
+        """
+        Args:
+            rate: Tokens per second per stream.
+            ttft: Seconds before the first token (prompt processing).
+            jitter: Relative random variation of each token interval (0.1 = +-10%).
+            slots: Number of generations processed at once; further requests wait.
+            error_rate: Probability that a request fails with HTTP 503 before streaming.
+            drop_rate: Probability that a stream is cut off midway (connection closed).
+            max_context: Context size reported to the clients.
+            seed: Seed for timing jitter and error injection.
+        """
+        self.rate = rate
+        self.ttft = ttft
+        self.jitter = jitter
+        self.slots = slots
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.max_context = max_context
+        self.seed = seed
+
+
+class FakeBackendServer:
+    """
+    Minimal asyncio HTTP/1.1 server (keep-alive, chunked SSE) emulating the endpoints
+    used by KoboldClient and OpenAICompatibleClient:
+    /api/extra/generate/stream, /api/extra/abort, /api/extra/tokencount, /api/extra/perf,
+    /api/extra/true_max_context_length, /api/v1/model, /v1/completions, /v1/models and /props.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 5001, config: Optional[FakeBackendConfig] = None):
+        self.host = host
+        self.port = port
+        self.config = config or FakeBackendConfig()
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._rng = random.Random(self.config.seed)
+        self._active: Dict[str, asyncio.Event] = {} # genkey -> abort event
+        self._queued = 0
+        self.stats = {"requests": 0, "completed": 0, "aborted": 0, "disconnected": 0, "errors": 0, "tokens": 0}
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def start(self):
+        """Starts listening. With port 0 a free port is chosen and stored in self.port."""
+        self._slots = asyncio.Semaphore(max(1, self.config.slots))
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Fake backend listening on http://{self.base_url} (rate={self.config.rate}/s, ttft={self.config.ttft}s, slots={self.config.slots})")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # --- HTTP plumbing ---
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        if int(headers.get("content-length", 0)) > 0:
+            body = await reader.readexactly(int(headers["content-length"]))
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _send_json(self, writer: asyncio.StreamWriter, data: dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _start_stream(self, writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await writer.drain()
+
+    async def _send_chunk(self, writer: asyncio.StreamWriter, data: str):
+        payload = data.encode("utf-8")
+        writer.write(f"{len(payload):x}\r\n".encode("latin-1") + payload + b"\r\n")
+        await writer.drain()
+
+    async def _end_stream(self, writer: asyncio.StreamWriter):
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    payload = json.loads(body) if body else {}
+                except json.JSONDecodeError:
+                    await self._send_json(writer, {"error": "invalid json"}, 400)
+                    continue
+                keep_open = await self._route(method, path, payload, reader, writer)
+                if not keep_open or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Client went away
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, payload: dict,
+                     reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Dispatches a request. Returns False if the connection must be closed."""
+        if method == "POST" and path == "/api/extra/generate/stream":
+            return await self._stream_generation(payload, reader, writer, openai=False)
+        if method == "POST" and path == "/v1/completions":
+            return await self._stream_generation(payload, reader, writer, openai=True)
+        if method == "POST" and path == "/api/extra/abort":
+            return await self._abort(payload, writer)
+        if method == "POST" and path == "/api/extra/tokencount":
+            tokens = tokenize(payload.get("prompt", ""), random.Random(0))
+            await self._send_json(writer, {"value": len(tokens), "ids": list(range(len(tokens)))})
+        elif method == "GET" and path == "/api/extra/perf":
+            await self._send_json(writer, {"idle": 0 if self._active else 1, "queue": self._queued, **self.stats})
+        elif method == "GET" and path == "/api/extra/true_max_context_length":
+            await self._send_json(writer, {"value": self.config.max_context})
+        elif method == "GET" and path == "/api/v1/model":
+            await self._send_json(writer, {"result": "fake/wannabe-bench"})
+        elif method == "GET" and path == "/v1/models":
+            await self._send_json(writer, {"object": "list", "data": [{"id": "fake/wannabe-bench", "object": "model"}]})
+        elif method == "GET" and path == "/props":
+            await self._send_json(writer, {"n_ctx": self.config.max_context, "default_generation_settings": {"n_ctx": self.config.max_context}})
+        else:
+            await self._send_json(writer, {"error": f"unknown endpoint {method} {path}"}, 404)
+        return True
+
+    async def _abort(self, payload: dict, writer: asyncio.StreamWriter) -> bool:
+        genkey = payload.get("genkey")
+        targets = [genkey] if genkey else list(self._active)
+        found = False
+        for key in targets:
+            event = self._active.get(key)
+            if event is not None:
+                event.set()
+                found = True
+        await self._send_json(writer, {"success": "true" if found or not genkey else "false", "done": "true"})
+        return True
+
+    def _token_interval(self) -> float:
+        interval = 1.0 / self.config.rate if self.config.rate > 0 else 0.0
+        if self.config.jitter:
+            interval *= 1.0 + self._rng.uniform(-self.config.jitter, self.config.jitter)
+        return max(0.0, interval)
+
+    async def _stream_generation(self, payload: dict, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter, openai: bool) -> bool:
+        self.stats["requests"] += 1
+        if self.config.error_rate and self._rng.random() < self.config.error_rate:
+            self.stats["errors"] += 1
+            await self._send_json(writer, {"error": "injected error"}, 503)
+            return True
+
+        prompt = payload.get("prompt", "")
+        max_tokens = int(payload.get("max_tokens" if openai else "max_length") or 100)
+        stop_sequences = payload.get("stop" if openai else "stop_sequence") or []
+        if isinstance(stop_sequences, str):
+            stop_sequences = [stop_sequences]
+        tokens = apply_stop_sequences(generate_text(prompt, max_tokens), stop_sequences)
+        drop_at = None
+        if self.config.drop_rate and tokens and self._rng.random() < self.config.drop_rate:
+            drop_at = self._rng.randrange(len(tokens))
+
+        genkey = payload.get("genkey") or f"anon-{id(writer)}-{time.monotonic_ns()}"
+        aborted = asyncio.Event()
+
+        self._queued += 1
+        async with self._slots:
+            self._queued -= 1
+            self._active[genkey] = aborted
+            try:
+                await asyncio.sleep(self.config.ttft) # Prompt processing
+                await self._start_stream(writer)
+                for index, token in enumerate(tokens):
+                    if aborted.is_set():
+                        self.stats["aborted"] += 1
+                        break
+                    if reader.at_eof():
+                        # Client closed the connection (e.g. OpenAI-style cancel by disconnect)
+                        self.stats["disconnected"] += 1
+                        return False
+                    if drop_at is not None and index == drop_at:
+                        self.stats["errors"] += 1
+                        return False # Close the connection mid-stream
+                    if openai:
+                        data = {"object": "text_completion", "choices": [{"text": token, "index": 0, "finish_reason": None}]}
+                    else:
+                        data = {"token": token}
+                    await self._send_chunk(writer, f"event: message\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" if not openai else f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+                    self.stats["tokens"] += 1
+                    await asyncio.sleep(self._token_interval())
+                else:
+                    self.stats["completed"] += 1
+                    # Final event with the finish reason, like KoboldCpp and OpenAI-compatible servers
+                    finish_reason = "length" if len(tokens) >= max_tokens else "stop"
+                    if openai:
+                        data = {"object": "text_completion", "choices": [{"text": "", "index": 0, "finish_reason": finish_reason}]}
+                        await self._send_chunk(writer, f"data: {json.dumps(data)}\n\n")
+                    else:
+                        await self._send_chunk(writer, f"event: message\ndata: {json.dumps({'token': '', 'finish_reason': finish_reason})}\n\n")
+                if openai:
+                    await self._send_chunk(writer, "data: [DONE]\n\n")
+                await self._end_stream(writer)
+                return True
+            except (ConnectionError, OSError):
+                self.stats["disconnected"] += 1 # Client stopped reading; the slot is freed like on abort
+                return False
+            finally:
+                self._active.pop(genkey, None)
+
+
+async def serve(args: argparse.Namespace):
+    config = FakeBackendConfig(
+        rate=args.rate, ttft=args.ttft, jitter=args.jitter, slots=args.slots,
+        error_rate=args.error_rate, drop_rate=args.drop_rate, max_context=args.max_context, seed=args.seed
+    )
+    server = FakeBackendServer(args.host, args.port, config)
+    await server.start()
+    try:
+        await asyncio.Event().wait() # Run until interrupted
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake KoboldCpp / OpenAI-compatible backend for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--rate", type=float, default=50.0, help="Tokens per second per stream (0 = as fast as possible)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative variation of token intervals")
+    parser.add_argument("--slots", type=int, default=1, help="Concurrent generations; further requests are queued")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of HTTP 503 before streaming")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability of closing a stream midway")
+    parser.add_argument("--max-context", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        print("Fake backend stopped.")
@@ -1,9 +1,12 @@
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QSpinBox,
                                QDoubleSpinBox, QTextEdit, QFormLayout, QComboBox,
                                QDialogButtonBox, QWidget, QGroupBox, QRadioButton,
-                               QSpacerItem, QSizePolicy, QLineEdit)
+                               QSpacerItem, QSizePolicy, QLineEdit, QCheckBox,
+                               QPlainTextEdit, QPushButton)
 from PySide6.QtCore import Slot
+from typing import Callable, Optional
 from src.core.settings import load_settings, save_settings, DEFAULT_SETTINGS
+from src.core.output_archive import OutputArchive, OutputArchiveError
 
 class ClientConfigDialog(QDialog):
     """Dialog for configuring LLM client connection settings."""
@@ -21,6 +24,7 @@ class ClientConfigDialog(QDialog):
         self.client_type_combo = QComboBox()
         self.client_type_combo.addItem("KoboldCpp", "kobold")
         self.client_type_combo.addItem("OpenAI Compatible", "openai_compatible")
+        self.client_type_combo.addItem("Load Balancer (複数バックエンド)", "load_balancer")
         client_type_layout.addWidget(client_type_label)
         client_type_layout.addWidget(self.client_type_combo)
         layout.addLayout(client_type_layout)
@@ -40,6 +44,32 @@ class ClientConfigDialog(QDialog):
         base_url_layout.addWidget(self.base_url_edit)
         layout.addLayout(base_url_layout)
 
+        # --- Load Balancer Settings (only for client_type "load_balancer") ---
+        self.lb_group = QGroupBox("ロードバランサー設定")
+        lb_layout = QFormLayout(self.lb_group)
+        self.backends_edit = QTextEdit()
+        self.backends_edit.setAcceptRichText(False)
+        self.backends_edit.setPlaceholderText("1行に1つ (種類 アドレス):\nkobold 127.0.0.1:5001\nkobold 127.0.0.1:5002\nopenai_compatible 127.0.0.1:1234")
+        backends = self.current_settings.get("backends", DEFAULT_SETTINGS["backends"]) or []
+        self.backends_edit.setText("\n".join(f"{b.get('client_type', 'kobold')} {b.get('base_url', '')}" for b in backends))
+        lb_layout.addRow("バックエンド:", self.backends_edit)
+
+        self.lb_policy_combo = QComboBox()
+        self.lb_policy_combo.addItem("処理中リクエストが最少のバックエンド", "least_outstanding")
+        self.lb_policy_combo.addItem("ラウンドロビン", "round_robin")
+        policy_index = self.lb_policy_combo.findData(self.current_settings.get("lb_policy", DEFAULT_SETTINGS["lb_policy"]))
+        if policy_index != -1:
+            self.lb_policy_combo.setCurrentIndex(policy_index)
+        lb_layout.addRow("振り分け方式:", self.lb_policy_combo)
+
+        self.lb_concurrency_spinbox = QSpinBox()
+        self.lb_concurrency_spinbox.setRange(1, 64)
+        self.lb_concurrency_spinbox.setValue(self.current_settings.get("lb_max_concurrency_per_backend", DEFAULT_SETTINGS["lb_max_concurrency_per_backend"]))
+        lb_layout.addRow("バックエンド毎の同時リクエスト数:", self.lb_concurrency_spinbox)
+        layout.addWidget(self.lb_group)
+        self.lb_group.setVisible(current_client_type == "load_balancer")
+        # --- End Load Balancer Settings ---
+
         # Client type change event handler
         self.client_type_combo.currentIndexChanged.connect(self._on_client_type_changed)
 
@@ -57,11 +87,24 @@ class ClientConfigDialog(QDialog):
             self.base_url_edit.setText("127.0.0.1:5001")
         elif client_type == "openai_compatible":
             self.base_url_edit.setText("127.0.0.1:1234")
+        self.lb_group.setVisible(client_type == "load_balancer")
 
     def accept(self):
         """Saves the settings when OK is clicked."""
         self.current_settings["client_type"] = self.client_type_combo.currentData()
         self.current_settings["base_url"] = self.base_url_edit.text()
+
+        # Parse backend lines: "<client_type> <address>" or just "<address>" (KoboldCpp)
+        backends = []
+        for line in self.backends_edit.toPlainText().splitlines():
+            parts = line.split()
+            if len(parts) == 1:
+                backends.append({"client_type": "kobold", "base_url": parts[0]})
+            elif len(parts) >= 2 and parts[0] in ("kobold", "openai_compatible"):
+                backends.append({"client_type": parts[0], "base_url": parts[1]})
+        self.current_settings["backends"] = backends
+        self.current_settings["lb_policy"] = self.lb_policy_combo.currentData()
+        self.current_settings["lb_max_concurrency_per_backend"] = self.lb_concurrency_spinbox.value()
         save_settings(self.current_settings)
         super().accept()
 
@@ -94,6 +137,13 @@ class GenerationParamsDialog(QDialog):
         self.max_length_generate_spinbox.setValue(self.current_settings.get("max_length_generate", DEFAULT_SETTINGS["max_length_generate"]))
         form_layout.addRow("最大長 (小説生成):", self.max_length_generate_spinbox)
 
+        # Context size for the continuation prompt budget
+        self.max_context_spinbox = QSpinBox()
+        self.max_context_spinbox.setRange(0, 1048576)
+        self.max_context_spinbox.setSpecialValueText("自動 (バックエンドから取得)") # Shown for 0
+        self.max_context_spinbox.setValue(self.current_settings.get("max_context_length", DEFAULT_SETTINGS["max_context_length"]))
+        form_layout.addRow("最大コンテキスト長:", self.max_context_spinbox)
+
         # temperature
         self.temp_spinbox = QDoubleSpinBox()
         self.temp_spinbox.setRange(0.0, 5.0) # Allow higher temps if needed
@@ -132,6 +182,20 @@ class GenerationParamsDialog(QDialog):
         self.rep_pen_spinbox.setValue(self.current_settings.get("rep_pen", DEFAULT_SETTINGS["rep_pen"]))
         form_layout.addRow("Repetition Penalty:", self.rep_pen_spinbox)
 
+        # Repetition guard (client-side loop detection)
+        repetition_layout = QHBoxLayout()
+        self.repetition_guard_check = QCheckBox("ループを検出したら打ち切る")
+        self.repetition_guard_check.setChecked(self.current_settings.get("repetition_guard", DEFAULT_SETTINGS["repetition_guard"]))
+        self.repetition_guard_check.setToolTip("同じ文や行が繰り返され始めたらストリームを切り、サーバー側の生成も中断します。")
+        self.repetition_min_chars_spinbox = QSpinBox()
+        self.repetition_min_chars_spinbox.setRange(16, 2000)
+        self.repetition_min_chars_spinbox.setSuffix(" 文字")
+        self.repetition_min_chars_spinbox.setValue(self.current_settings.get("repetition_guard_min_chars", DEFAULT_SETTINGS["repetition_guard_min_chars"]))
+        self.repetition_min_chars_spinbox.setToolTip("末尾でこの文字数以上が繰り返しになった時点でループとみなします。")
+        repetition_layout.addWidget(self.repetition_guard_check)
+        repetition_layout.addWidget(self.repetition_min_chars_spinbox)
+        form_layout.addRow("繰り返し検出:", repetition_layout)
+
         # --- Default Rating Setting ---
         rating_label = QLabel("デフォルトレーティング:")
         self.rating_combo = QComboBox()
@@ -145,6 +209,16 @@ class GenerationParamsDialog(QDialog):
             self.rating_combo.setCurrentIndex(rating_index)
         # --- End Default Rating Setting ---
 
+        # IDEA candidate pool (sections generated but not shown answer later requests)
+        self.idea_pool_spinbox = QSpinBox()
+        self.idea_pool_spinbox.setRange(0, 1000)
+        self.idea_pool_spinbox.setSuffix(" 件/項目")
+        self.idea_pool_spinbox.setValue(self.current_settings.get("idea_candidate_pool_size", DEFAULT_SETTINGS["idea_candidate_pool_size"]))
+        self.idea_pool_spinbox.setToolTip("アイデア生成で表示されなかった項目 (安全な手法で先に書かれたタイトルなど) を保持し、\n"
+                                          "条件の合う項目の生成を求められた時はバックエンドを使わずに表示します。\n"
+                                          "候補はプロジェクトファイルに保存されます。0 で無効。")
+        form_layout.addRow("アイデア候補プール:", self.idea_pool_spinbox)
+
         main_layout.addLayout(form_layout)
 
         # Stop Sequences
@@ -178,6 +252,23 @@ class GenerationParamsDialog(QDialog):
         cont_order_desc_label.setWordWrap(True) # Allow text wrapping
         cont_order_layout.addWidget(cont_order_desc_label)
 
+        self.cache_stable_check = QCheckBox("キャッシュ効率を優先したプロンプト配置 (プレフィックス再利用)")
+        self.cache_stable_check.setToolTip("Dynamic Promptsを含む参考情報を本文の後に置き、本文の先頭削除を粗い単位で行います。")
+        self.cache_stable_check.setChecked(self.current_settings.get("cache_stable_prompt", DEFAULT_SETTINGS["cache_stable_prompt"]))
+        cont_order_layout.addWidget(self.cache_stable_check)
+
+        # Seed for Dynamic Prompts (reproducible rolls)
+        seed_layout = QHBoxLayout()
+        seed_label = QLabel("Dynamic Promptsのシード (-1 = ランダム):")
+        self.dynamic_seed_spinbox = QSpinBox()
+        self.dynamic_seed_spinbox.setRange(-1, 2147483647)
+        self.dynamic_seed_spinbox.setValue(self.current_settings.get("dynamic_prompt_seed", DEFAULT_SETTINGS["dynamic_prompt_seed"]))
+        self.dynamic_seed_spinbox.setToolTip("0以上を指定すると、生成開始ごとに同じ選択結果が再現されます。")
+        seed_layout.addWidget(seed_label)
+        seed_layout.addWidget(self.dynamic_seed_spinbox)
+        seed_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        cont_order_layout.addLayout(seed_layout)
+
         main_layout.addWidget(cont_order_group)
         # --- End Continuation Prompt Order Setting ---
 
@@ -204,6 +295,92 @@ class GenerationParamsDialog(QDialog):
         gen_layout.addWidget(self.gen_manual_radio)
         inf_gen_layout.addWidget(gen_group)
 
+        # Parallel streams (number of candidates generated at once)
+        parallel_layout = QHBoxLayout()
+        parallel_label = QLabel("同時生成数 (バックエンドの並列スロット数まで):")
+        self.parallel_streams_spinbox = QSpinBox()
+        self.parallel_streams_spinbox.setRange(1, 16)
+        self.parallel_streams_spinbox.setValue(self.current_settings.get("infinite_parallel_streams", DEFAULT_SETTINGS["infinite_parallel_streams"]))
+        parallel_layout.addWidget(parallel_label)
+        parallel_layout.addWidget(self.parallel_streams_spinbox)
+        parallel_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(parallel_layout)
+
+        # Prefetch depth (manual mode: next blocks are generated while the current one is shown)
+        prefetch_layout = QHBoxLayout()
+        prefetch_label = QLabel("先読み数 (手動モード時, 0 = 無効):")
+        self.prefetch_depth_spinbox = QSpinBox()
+        self.prefetch_depth_spinbox.setRange(0, 8)
+        self.prefetch_depth_spinbox.setValue(self.current_settings.get("infinite_prefetch_depth", DEFAULT_SETTINGS["infinite_prefetch_depth"]))
+        self.prefetch_depth_spinbox.setToolTip("表示中のブロックの裏で次の候補を生成します。バックエンドに空きスロットが必要です。\n"
+                                               "本文や詳細情報を編集すると先読み分は破棄され、プロンプトが再構築されます。")
+        prefetch_layout.addWidget(prefetch_label)
+        prefetch_layout.addWidget(self.prefetch_depth_spinbox)
+        prefetch_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(prefetch_layout)
+
+        # Upper bound of simultaneous requests (single generation preempts infinite/prefetch jobs beyond it)
+        concurrency_layout = QHBoxLayout()
+        concurrency_label = QLabel("同時リクエスト上限 (0 = 自動):")
+        self.max_concurrency_spinbox = QSpinBox()
+        self.max_concurrency_spinbox.setRange(0, 32)
+        self.max_concurrency_spinbox.setValue(self.current_settings.get("generation_max_concurrency", DEFAULT_SETTINGS["generation_max_concurrency"]))
+        self.max_concurrency_spinbox.setToolTip("上限に達している時に単発生成を開始すると、無限生成・先読みのリクエストを中断して優先します。\n"
+                                                "0 の場合は同時生成数、先読み数+1、アイデア連鎖生成の同時数のうち最大の値になります。")
+        concurrency_layout.addWidget(concurrency_label)
+        concurrency_layout.addWidget(self.max_concurrency_spinbox)
+        concurrency_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(concurrency_layout)
+
+        # Near-duplicate suppression (blocks similar to recent ones are collapsed or dropped)
+        dedup_layout = QHBoxLayout()
+        dedup_label = QLabel("類似ブロックの抑制 (類似度, 0 = 無効):")
+        self.dedup_threshold_spinbox = QDoubleSpinBox()
+        self.dedup_threshold_spinbox.setRange(0.0, 1.0)
+        self.dedup_threshold_spinbox.setSingleStep(0.05)
+        self.dedup_threshold_spinbox.setDecimals(2)
+        self.dedup_threshold_spinbox.setValue(self.current_settings.get("infinite_dedup_threshold", DEFAULT_SETTINGS["infinite_dedup_threshold"]))
+        self.dedup_threshold_spinbox.setToolTip("直近のブロックと文字 n-gram がこの割合以上一致したブロックを類似とみなします (目安 0.7〜0.9)。")
+        self.dedup_action_combo = QComboBox()
+        self.dedup_action_combo.addItem("省略表示", "collapse")
+        self.dedup_action_combo.addItem("削除", "drop")
+        dedup_action_index = self.dedup_action_combo.findData(self.current_settings.get("infinite_dedup_action", DEFAULT_SETTINGS["infinite_dedup_action"]))
+        self.dedup_action_combo.setCurrentIndex(max(0, dedup_action_index))
+        dedup_abort_label = QLabel("早期中断 (文字数, 0 = しない):")
+        self.dedup_abort_spinbox = QSpinBox()
+        self.dedup_abort_spinbox.setRange(0, 2000)
+        self.dedup_abort_spinbox.setValue(self.current_settings.get("infinite_dedup_abort_chars", DEFAULT_SETTINGS["infinite_dedup_abort_chars"]))
+        self.dedup_abort_spinbox.setToolTip("生成中のブロックの冒頭がこの文字数に達した時点で既存ブロックの繰り返しと判定できれば、リクエストを中断します。")
+        dedup_layout.addWidget(dedup_label)
+        dedup_layout.addWidget(self.dedup_threshold_spinbox)
+        dedup_layout.addWidget(self.dedup_action_combo)
+        dedup_layout.addWidget(dedup_abort_label)
+        dedup_layout.addWidget(self.dedup_abort_spinbox)
+        dedup_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(dedup_layout)
+
+        # Output refresh rate (streamed tokens are rendered in batches)
+        refresh_layout = QHBoxLayout()
+        refresh_label = QLabel("出力の更新頻度 (回/秒, 0 = トークンごと):")
+        self.output_refresh_spinbox = QSpinBox()
+        self.output_refresh_spinbox.setRange(0, 120)
+        self.output_refresh_spinbox.setValue(self.current_settings.get("output_refresh_rate", DEFAULT_SETTINGS["output_refresh_rate"]))
+        refresh_layout.addWidget(refresh_label)
+        refresh_layout.addWidget(self.output_refresh_spinbox)
+        refresh_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(refresh_layout)
+
+        # Bounded output history (older blocks are moved to a file on disk)
+        history_layout = QHBoxLayout()
+        history_label = QLabel("出力エリアに残すブロック数 (0 = 無制限):")
+        self.output_max_blocks_spinbox = QSpinBox()
+        self.output_max_blocks_spinbox.setRange(0, 10000)
+        self.output_max_blocks_spinbox.setValue(self.current_settings.get("output_max_blocks", DEFAULT_SETTINGS["output_max_blocks"]))
+        history_layout.addWidget(history_label)
+        history_layout.addWidget(self.output_max_blocks_spinbox)
+        history_layout.addSpacerItem(QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum))
+        inf_gen_layout.addLayout(history_layout)
+
         main_layout.addWidget(inf_gen_group)
 
         # Load initial state for radio buttons
@@ -271,11 +448,15 @@ class GenerationParamsDialog(QDialog):
         # self.current_settings["max_length"] = self.max_length_spinbox.value() # Removed old setting
         self.current_settings["max_length_idea"] = self.max_length_idea_spinbox.value()
         self.current_settings["max_length_generate"] = self.max_length_generate_spinbox.value()
+        self.current_settings["max_context_length"] = self.max_context_spinbox.value()
         self.current_settings["temperature"] = self.temp_spinbox.value()
         self.current_settings["min_p"] = self.min_p_spinbox.value()
         self.current_settings["top_p"] = self.top_p_spinbox.value()
         self.current_settings["top_k"] = self.top_k_spinbox.value() # Save Top-K
         self.current_settings["rep_pen"] = self.rep_pen_spinbox.value()
+        self.current_settings["repetition_guard"] = self.repetition_guard_check.isChecked()
+        self.current_settings["repetition_guard_min_chars"] = self.repetition_min_chars_spinbox.value()
+        self.current_settings["idea_candidate_pool_size"] = self.idea_pool_spinbox.value()
 
         # Process stop sequences: split by newline, strip whitespace, remove empty lines
         stop_sequences_text = self.stop_seq_edit.toPlainText()
@@ -284,12 +465,22 @@ class GenerationParamsDialog(QDialog):
 
         # Save continuation prompt order setting
         self.current_settings["cont_prompt_order"] = self.cont_order_combo.currentData()
+        self.current_settings["cache_stable_prompt"] = self.cache_stable_check.isChecked()
+        self.current_settings["dynamic_prompt_seed"] = self.dynamic_seed_spinbox.value()
 
         # Save infinite generation behavior settings
         inf_gen_behavior = self.current_settings.get("infinite_generation_behavior", {})
         inf_gen_behavior["idea"] = "immediate" if self.idea_immediate_radio.isChecked() else "manual"
         inf_gen_behavior["generate"] = "immediate" if self.gen_immediate_radio.isChecked() else "manual"
         self.current_settings["infinite_generation_behavior"] = inf_gen_behavior
+        self.current_settings["infinite_parallel_streams"] = self.parallel_streams_spinbox.value()
+        self.current_settings["infinite_prefetch_depth"] = self.prefetch_depth_spinbox.value()
+        self.current_settings["generation_max_concurrency"] = self.max_concurrency_spinbox.value()
+        self.current_settings["infinite_dedup_threshold"] = self.dedup_threshold_spinbox.value()
+        self.current_settings["infinite_dedup_action"] = self.dedup_action_combo.currentData()
+        self.current_settings["infinite_dedup_abort_chars"] = self.dedup_abort_spinbox.value()
+        self.current_settings["output_refresh_rate"] = self.output_refresh_spinbox.value()
+        self.current_settings["output_max_blocks"] = self.output_max_blocks_spinbox.value()
 
         # Save transfer settings
         if self.transfer_next_always_radio.isChecked():
@@ -318,6 +509,87 @@ class GenerationParamsDialog(QDialog):
        dialog = GenerationParamsDialog(parent)
        return dialog.exec() == QDialog.Accepted
 
+class OutputArchiveDialog(QDialog):
+    """Browses output blocks that were moved out of the output area, one page at a time."""
+    def __init__(self, archive: OutputArchive, page_size: int,
+                 transfer_to_main: Optional[Callable[[str], None]] = None,
+                 transfer_to_memo: Optional[Callable[[str], None]] = None,
+                 parent: QWidget | None = None):
+        """
+        Args:
+            archive: The archive to browse.
+            page_size: Number of blocks shown per page.
+            transfer_to_main / transfer_to_memo: Called with the selected text by the transfer buttons.
+        """
+        super().__init__(parent)
+        self.setWindowTitle("過去の出力")
+        self.resize(700, 600)
+        self.archive = archive
+        self.page_size = max(1, page_size)
+        self.transfer_to_main = transfer_to_main
+        self.transfer_to_memo = transfer_to_memo
+
+        main_layout = QVBoxLayout(self)
+        self.text_edit = QPlainTextEdit()
+        self.text_edit.setReadOnly(True)
+        main_layout.addWidget(self.text_edit)
+
+        nav_layout = QHBoxLayout()
+        self.prev_button = QPushButton("< 前へ")
+        self.next_button = QPushButton("次へ >")
+        self.page_label = QLabel()
+        self.prev_button.clicked.connect(lambda: self._show_page(self.page_index - 1))
+        self.next_button.clicked.connect(lambda: self._show_page(self.page_index + 1))
+        nav_layout.addWidget(self.prev_button)
+        nav_layout.addWidget(self.page_label)
+        nav_layout.addWidget(self.next_button)
+        nav_layout.addStretch()
+        main_layout.addLayout(nav_layout)
+
+        transfer_layout = QHBoxLayout()
+        to_main_button = QPushButton("[ 選択部分を本文へ転記 ]")
+        to_memo_button = QPushButton("[ 選択部分をメモへ転記 ]")
+        to_main_button.clicked.connect(lambda: self._transfer_selection(self.transfer_to_main))
+        to_memo_button.clicked.connect(lambda: self._transfer_selection(self.transfer_to_memo))
+        to_main_button.setEnabled(transfer_to_main is not None)
+        to_memo_button.setEnabled(transfer_to_memo is not None)
+        transfer_layout.addWidget(to_main_button)
+        transfer_layout.addWidget(to_memo_button)
+        transfer_layout.addStretch()
+        main_layout.addLayout(transfer_layout)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        button_box.rejected.connect(self.reject)
+        main_layout.addWidget(button_box)
+
+        # Start at the newest page (closest to what is still in the output area)
+        self.page_index = 0
+        self._show_page(self.archive.page_count(self.page_size) - 1)
+
+    def _show_page(self, page_index: int):
+        page_count = self.archive.page_count(self.page_size)
+        if page_count == 0:
+            self.text_edit.setPlainText("")
+            self.page_label.setText("過去の出力はありません")
+            self.prev_button.setEnabled(False)
+            self.next_button.setEnabled(False)
+            return
+        self.page_index = max(0, min(page_index, page_count - 1))
+        try:
+            text, labels = self.archive.read_page(self.page_index, self.page_size)
+        except OutputArchiveError as e:
+            self.text_edit.setPlainText(f"--- 読み込みエラー: {e} ---")
+            return
+        self.text_edit.setPlainText(text)
+        self.page_label.setText(f"ページ {self.page_index + 1} / {page_count}  ({labels[0]} 〜 {labels[-1]})")
+        self.prev_button.setEnabled(self.page_index > 0)
+        self.next_button.setEnabled(self.page_index < page_count - 1)
+
+    def _transfer_selection(self, transfer: Optional[Callable[[str], None]]):
+        selected_text = self.text_edit.textCursor().selectedText()
+        if transfer is not None and selected_text:
+            transfer(selected_text)
+
 if __name__ == '__main__':
     # Example usage for testing dialogs individually
     from PySide6.QtWidgets import QApplication
@@ -224,7 +224,8 @@ class MenuHandler:
             'dialogue_level': 'dialogue_level_combo',
             'rating': 'rating_combo_details', # Add rating combo from details tab
             'authors_note': 'authors_note_edit', # Add authors_note edit
-            'main_text': 'main_text_edit', 'memo': 'memo_edit'
+            'main_text': 'main_text_edit', 'memo': 'memo_edit',
+            'idea_pool': 'idea_pool'
         }
         missing_attrs = [name for name, attr in required_ui.items() if not hasattr(self.main_window, attr)]
         if missing_attrs:
@@ -247,7 +248,8 @@ class MenuHandler:
         return {
             "details": details,
             "main_text": main_text,
-            "memo_text": memo_text
+            "memo_text": memo_text,
+            "idea_pool": self.main_window.idea_pool.to_data() # Unshown IDEA sections (candidate pool)
         }
 
     def _apply_project_data(self, data: dict):
@@ -260,7 +262,8 @@ class MenuHandler:
             'dialogue_level': 'dialogue_level_combo',
             'rating': 'rating_combo_details', # Add rating combo from details tab
             'main_text': 'main_text_edit', 'memo': 'memo_edit',
-            'output_clear': 'output_text_edit', 'output_counter': 'output_block_counter'
+            'output_clear': 'output_text_edit', 'output_counter': 'output_block_counter',
+            'idea_pool': 'idea_pool'
         }
         missing_attrs = [name for name, attr in required_ui.items() if not hasattr(self.main_window, attr)]
         if missing_attrs:
@@ -289,10 +292,14 @@ class MenuHandler:
         # Apply main text and memo safely
         self.main_window.main_text_edit.setPlainText(data.get("main_text", "") or "") # Ensure string
         self.main_window.memo_edit.setPlainText(data.get("memo_text", "") or "") # Ensure string
-
-        # Reset output area and counter when loading a project
-        self.main_window.output_text_edit.clear()
-        self.main_window.output_block_counter = 1
+        # The candidate pool belongs to the project (older project files have none)
+        self.main_window.idea_pool.load_data(data.get("idea_pool", []))
+
+        # Reset output area, output history and counter when loading a project
+        self.main_window._clear_output_edit()
+        # Blocks of the previous project no longer count as duplicates
+        if self.main_window.duplicate_filter is not None:
+            self.main_window.duplicate_filter.clear()
 
 
     # --- Edit Menu ---
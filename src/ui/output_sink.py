@@ -0,0 +1,94 @@
+import time
+from typing import List, Optional, Tuple
+
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtGui import QTextCursor
+from PySide6.QtWidgets import QPlainTextEdit
+
+class BufferedOutputSink(QObject):
+    """
+    Collects streamed tokens for a QPlainTextEdit and inserts them in batches.
+
+    Instead of one insertText() and scrollbar update per token, pending text is
+    flushed at a fixed rate (e.g. 30 Hz) inside a single edit block, so the Qt
+    main thread stays responsive at high token rates and with parallel streams.
+    Text can target the end of the document or an anchored block cursor
+    (see MainWindow._open_output_block).
+    """
+    def __init__(self, text_edit: QPlainTextEdit, refresh_rate: float = 30.0, parent: Optional[QObject] = None):
+        """
+        Args:
+            text_edit: The output widget to write to.
+            refresh_rate: Flushes per second. 0 or less writes every chunk immediately.
+        """
+        super().__init__(parent)
+        self.text_edit = text_edit
+        self._pending: List[Tuple[Optional[QTextCursor], str]] = [] # (block cursor or None for end, text)
+        self.render_time = 0.0 # Total seconds spent in flush() (read by generation metrics)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self.set_refresh_rate(refresh_rate)
+
+    def set_refresh_rate(self, refresh_rate: float):
+        """Changes the flush rate (Hz). 0 or less disables buffering."""
+        self.refresh_rate = float(refresh_rate)
+        if self.refresh_rate > 0:
+            self._timer.setInterval(max(1, int(1000 / self.refresh_rate)))
+        else:
+            self.flush()
+
+    def append(self, text: str, block_cursor: Optional[QTextCursor] = None):
+        """
+        Queues text for the end of the document, or for the block of 'block_cursor'.
+        """
+        if not text:
+            return
+        if self._pending and self._pending[-1][0] is block_cursor:
+            # Merge consecutive chunks for the same target
+            self._pending[-1] = (block_cursor, self._pending[-1][1] + text)
+        else:
+            self._pending.append((block_cursor, text))
+
+        if self.refresh_rate <= 0:
+            self.flush()
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def discard(self):
+        """Drops pending text without writing it (e.g. when the output area is cleared)."""
+        self._pending = []
+        self._timer.stop()
+
+    def flush(self):
+        """Writes all pending text in one edit block and keeps following the bottom if it was there."""
+        self._timer.stop()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        started = time.perf_counter()
+
+        v_bar = self.text_edit.verticalScrollBar()
+        is_at_bottom = v_bar.value() >= v_bar.maximum() - 5
+
+        end_cursor = QTextCursor(self.text_edit.document())
+        end_cursor.beginEditBlock() # Layout and repaint happen once at endEditBlock()
+        try:
+            for block_cursor, text in pending:
+                if block_cursor is None:
+                    end_cursor.movePosition(QTextCursor.End)
+                    end_cursor.insertText(text)
+                else:
+                    position = block_cursor.position()
+                    block_cursor.insertText(text)
+                    # Anchored cursors keep their position on insert; advance explicitly (UTF-16 units)
+                    block_cursor.setPosition(position + len(text.encode("utf-16-le")) // 2)
+        finally:
+            end_cursor.endEditBlock()
+
+        if is_at_bottom:
+            v_bar.setValue(v_bar.maximum())
+        self.render_time += time.perf_counter() - started
@@ -0,0 +1,31 @@
+from typing import Any, Dict, Optional
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from src.core.settings import get_settings_store
+
+class SettingsNotifier(QObject):
+    """
+    Qt bridge for the settings store.
+
+    Emits settings_changed(settings, changed_keys) on the UI thread whenever the
+    settings are saved or config.json is edited outside the application. External
+    edits are detected by polling the file's mtime.
+    """
+    settings_changed = Signal(dict, object) # (settings, set of changed keys)
+
+    def __init__(self, poll_interval_ms: int = 2000, parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self._store = get_settings_store()
+        self._store.subscribe(self._on_store_changed)
+        self._poll_timer = QTimer(self)
+        self._poll_timer.timeout.connect(self._store.check_for_changes)
+        self._poll_timer.start(poll_interval_ms)
+
+    def _on_store_changed(self, settings: Dict[str, Any], changed_keys: set):
+        self.settings_changed.emit(settings, changed_keys)
+
+    def stop(self):
+        """Stops polling and detaches from the store."""
+        self._poll_timer.stop()
+        self._store.unsubscribe(self._on_store_changed)
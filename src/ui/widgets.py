@@ -334,6 +334,7 @@ class TagWidget(QWidget):
 
     def set_tags(self, tags: list[str]):
         """Sets the tags, replacing existing ones."""
+        had_tags = bool(self._tags)
         # Clear existing tags
         while self.tags_layout.count():
             item = self.tags_layout.takeAt(0)
@@ -350,7 +351,7 @@ class TagWidget(QWidget):
                 self._tags.add(tag)
                 self._add_tag_label(tag)
                 added = True
-        if added:
+        if added or had_tags: # Also notify when tags were cleared
             self.tagsChanged.emit(self.get_tags())
             self.tags_display_widget.adjustSize() # Adjust container size
 